@@ -0,0 +1,415 @@
+"""
+Forecast-accuracy backtest.
+
+    python backtest.py [--start YYYY-MM-DD] [--end YYYY-MM-DD] [--tolerance 1] [--json]
+
+Replays WorkOrder / ProductionLog / ProductionEvent history day by day.
+Each simulated morning runs simulate_line_orders "as of" that day and
+compares every predicted finish date with the order's real completed_at.
+
+State is carried forward: logs are streamed once in date order, each
+order's remaining hours are decremented in place, and a line is only
+re-simulated on days where something on it changed. On quiet days the
+previous queue offsets are reused (finish = day + offset), which is
+exactly what the simulation would return for an unchanged queue.
+Lines with a shift calendar are re-simulated every day, because their
+capacity vector shifts with the weekday. The calendar is the current
+one; past shift patterns are not versioned.
+"""
+
+import argparse
+import json
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import select
+
+from capacity_engine import simulate_line_orders
+from line_calendar import HORIZON_DAYS, capacity_window_start, compile_capacity_vector
+from models import LineCalendarException, LineShiftPattern, ProductionEvent, ProductionLog, WorkOrder
+from plants import DEFAULT_PLANT, plants
+from projections import load_production_line_rows
+
+
+ERROR_CLAMP_DAYS = 10
+
+
+class ReplayOrder:
+
+    __slots__ = (
+        "id",
+        "work_order_no",
+        "production_line_id",
+        "remaining_hours",
+        "status",
+        "is_material_ready",
+        "material_ready_date",
+        "priority",
+        "promise_date",
+        "created_datetime",
+        "created_date",
+        "completed_date",
+    )
+
+    def __init__(self, row):
+        (
+            self.id,
+            self.work_order_no,
+            self.production_line_id,
+            self.remaining_hours,
+            self.is_material_ready,
+            self.material_ready_date,
+            self.priority,
+            self.promise_date,
+            self.created_datetime,
+            completed_at,
+        ) = row
+
+        self.status = "OPEN"
+        self.created_date = self.created_datetime.date()
+        self.completed_date = completed_at.date() if completed_at else None
+
+
+class ReplayEvent:
+
+    __slots__ = ("id", "production_line_id", "impact_hours", "is_resolved", "start", "end")
+
+    def __init__(self, row):
+        self.id, self.production_line_id, self.impact_hours, self.start, resolved_at = row
+        self.end = resolved_at.date() if resolved_at else None
+        self.is_resolved = False
+
+
+class ErrorStats:
+
+    __slots__ = ("count", "abs_sum", "bias_sum", "within", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.abs_sum = 0
+        self.bias_sum = 0
+        self.within = 0
+        self.histogram = [0] * (2 * ERROR_CLAMP_DAYS + 1)
+
+    def add(self, error, tolerance):
+        self.count += 1
+        self.abs_sum += abs(error)
+        self.bias_sum += error
+        if abs(error) <= tolerance:
+            self.within += 1
+        clamped = max(-ERROR_CLAMP_DAYS, min(ERROR_CLAMP_DAYS, error))
+        self.histogram[clamped + ERROR_CLAMP_DAYS] += 1
+
+    def report(self):
+        if not self.count:
+            return {"predictions": 0}
+        return {
+            "predictions": self.count,
+            "within_tolerance_pct": round(100 * self.within / self.count, 1),
+            "mean_abs_error_days": round(self.abs_sum / self.count, 2),
+            "mean_bias_days": round(self.bias_sum / self.count, 2),
+            "error_histogram": {
+                f"{d:+d}" if abs(d) < ERROR_CLAMP_DAYS else (f"<={d}" if d < 0 else f">=+{d}"): n
+                for d, n in zip(range(-ERROR_CLAMP_DAYS, ERROR_CLAMP_DAYS + 1), self.histogram)
+                if n
+            },
+        }
+
+
+# ==========================================================
+# Replay
+# ==========================================================
+
+def _load_orders(db):
+    rows = db.execute(
+        select(
+            WorkOrder.id,
+            WorkOrder.work_order_no,
+            WorkOrder.production_line_id,
+            WorkOrder.planned_hours,
+            WorkOrder.is_material_ready,
+            WorkOrder.material_ready_date,
+            WorkOrder.priority,
+            WorkOrder.promise_date,
+            WorkOrder.created_datetime,
+            WorkOrder.completed_at,
+        ).order_by(WorkOrder.created_datetime)
+    )
+    return [ReplayOrder(row) for row in rows]
+
+
+def _load_events(db):
+    rows = db.execute(
+        select(
+            ProductionEvent.id,
+            ProductionEvent.production_line_id,
+            ProductionEvent.impact_hours,
+            ProductionEvent.event_date,
+            ProductionEvent.resolved_at,
+        ).order_by(ProductionEvent.event_date)
+    )
+    return [ReplayEvent(row) for row in rows]
+
+
+def _load_calendars(db):
+    """{line_id: (shift_patterns, exceptions)} for lines that have a calendar."""
+    calendars = {}
+
+    for row in db.execute(
+        select(LineShiftPattern.production_line_id, LineShiftPattern.weekday, LineShiftPattern.hours)
+    ):
+        calendars.setdefault(row.production_line_id, ([], []))[0].append(row)
+
+    for row in db.execute(
+        select(
+            LineCalendarException.production_line_id,
+            LineCalendarException.exception_date,
+            LineCalendarException.exception_type,
+            LineCalendarException.hours,
+        )
+    ):
+        calendars.setdefault(row.production_line_id, ([], []))[1].append(row)
+
+    return calendars
+
+
+def _stream_logs(db):
+    return db.execute(
+        select(
+            ProductionLog.log_date,
+            ProductionLog.work_order_id,
+            ProductionLog.produced_hours,
+        )
+        .order_by(ProductionLog.log_date, ProductionLog.id)
+        .execution_options(yield_per=5000)
+    )
+
+
+def run_backtest(db, start=None, end=None, tolerance_days=1):
+
+    lines = {line.id: line for line in load_production_line_rows(db)}
+    orders = _load_orders(db)
+    events = _load_events(db)
+    calendars = _load_calendars(db)
+
+    start = start or (orders[0].created_date if orders else date.today())
+    end = end or date.today()
+
+    orders_by_id = {wo.id: wo for wo in orders}
+    logs = iter(_stream_logs(db))
+    pending_log = next(logs, None)
+
+    next_order = 0
+    next_event = 0
+
+    active_orders = {}       # line_id → {wo_id: ReplayOrder}
+    active_events = {}       # line_id → {event_id: ReplayEvent}
+    offsets = {}             # line_id → [(wo, finish_offset_days)]
+    dirty_lines = set()
+
+    overall = ErrorStats()
+    by_line = {}
+    by_priority = {}
+    days = 0
+    simulations = 0
+
+    day = start
+    while day <= end:
+
+        # -------------------------------
+        # 1️⃣ 当天早上之前的日志（log_date < day）
+        # -------------------------------
+        while pending_log is not None and pending_log.log_date < day:
+            wo = orders_by_id.get(pending_log.work_order_id)
+            if wo is not None:
+                wo.remaining_hours = max(wo.remaining_hours - pending_log.produced_hours, 0)
+                wo.status = "RUNNING"
+                dirty_lines.add(wo.production_line_id)
+            pending_log = next(logs, None)
+
+        # -------------------------------
+        # 2️⃣ 新工单进入 / 已完工离开
+        # -------------------------------
+        while next_order < len(orders) and orders[next_order].created_date <= day:
+            wo = orders[next_order]
+            next_order += 1
+            if wo.completed_date is not None and wo.completed_date < day:
+                continue
+            active_orders.setdefault(wo.production_line_id, {})[wo.id] = wo
+            dirty_lines.add(wo.production_line_id)
+
+        for line_id, line_orders in active_orders.items():
+            finished = [
+                wo_id for wo_id, wo in line_orders.items()
+                if wo.completed_date is not None and wo.completed_date < day
+            ]
+            for wo_id in finished:
+                del line_orders[wo_id]
+            if finished:
+                dirty_lines.add(line_id)
+
+            for wo in line_orders.values():
+                if (
+                    wo.is_material_ready
+                    and wo.material_ready_date is not None
+                    and wo.material_ready_date == day
+                ):
+                    dirty_lines.add(line_id)
+
+        # -------------------------------
+        # 3️⃣ 事件生效 / 解决
+        # -------------------------------
+        while next_event < len(events) and events[next_event].start <= day:
+            event = events[next_event]
+            next_event += 1
+            active_events.setdefault(event.production_line_id, {})[event.id] = event
+            dirty_lines.add(event.production_line_id)
+
+        for line_id, line_events in active_events.items():
+            resolved = [
+                event_id for event_id, event in line_events.items()
+                if event.end is not None and event.end <= day
+            ]
+            for event_id in resolved:
+                del line_events[event_id]
+            if resolved:
+                dirty_lines.add(line_id)
+
+        # -------------------------------
+        # 4️⃣ 只重算有变化的产线（有日历的产线每天重算）
+        # -------------------------------
+        dirty_lines.update(line_id for line_id in calendars if line_id in active_orders)
+
+        for line_id in dirty_lines:
+            line = lines.get(line_id)
+            line_orders = active_orders.get(line_id)
+            if line is None or not line_orders:
+                offsets.pop(line_id, None)
+                continue
+
+            ready = [
+                wo for wo in sorted(line_orders.values(), key=lambda w: w.id)
+                if wo.is_material_ready
+                and (wo.material_ready_date is None or wo.material_ready_date <= day)
+            ]
+
+            capacity_vector = None
+            if line_id in calendars:
+                patterns, exceptions = calendars[line_id]
+                capacity_vector = compile_capacity_vector(
+                    line, patterns, exceptions, capacity_window_start(day), HORIZON_DAYS
+                )
+
+            result = simulate_line_orders(
+                line,
+                ready,
+                list(active_events.get(line_id, {}).values()),
+                today=day,
+                capacity_vector=capacity_vector
+            )
+            simulations += 1
+
+            if isinstance(result, dict):
+                offsets.pop(line_id, None)
+                continue
+
+            offsets[line_id] = [
+                (orders_by_id[row["work_order_id"]], (row["estimated_finish_date"] - day).days)
+                for row in result
+            ]
+
+        dirty_lines.clear()
+
+        # -------------------------------
+        # 5️⃣ 对比实际完工
+        # -------------------------------
+        for line_id, line_offsets in offsets.items():
+            line_stats = by_line.setdefault(line_id, ErrorStats())
+            for wo, offset in line_offsets:
+                if wo.completed_date is None:
+                    continue
+                error = (day + timedelta(days=offset) - wo.completed_date).days
+                overall.add(error, tolerance_days)
+                line_stats.add(error, tolerance_days)
+                by_priority.setdefault(wo.priority, ErrorStats()).add(error, tolerance_days)
+
+        days += 1
+        day += timedelta(days=1)
+
+    return {
+        "start": start,
+        "end": end,
+        "days": days,
+        "line_simulations": simulations,
+        "tolerance_days": tolerance_days,
+        "overall": overall.report(),
+        "by_line": {
+            lines[line_id].line_name if line_id in lines else str(line_id): stats.report()
+            for line_id, stats in sorted(by_line.items())
+        },
+        "by_priority": {
+            priority: stats.report()
+            for priority, stats in sorted(by_priority.items())
+        },
+    }
+
+
+# ==========================================================
+# CLI
+# ==========================================================
+
+def _print_report(report):
+    print(
+        f"{report['start']} → {report['end']}  "
+        f"{report['days']} days, {report['line_simulations']} line simulations"
+    )
+
+    def row(label, stats):
+        if not stats["predictions"]:
+            print(f"  {label:<20} no predictions")
+            return
+        print(
+            f"  {label:<20} n={stats['predictions']:<8} "
+            f"±{report['tolerance_days']}d {stats['within_tolerance_pct']:5.1f}%  "
+            f"MAE {stats['mean_abs_error_days']:5.2f}  bias {stats['mean_bias_days']:+.2f}"
+        )
+
+    row("overall", report["overall"])
+    print("by line")
+    for name, stats in report["by_line"].items():
+        row(name, stats)
+    print("by priority")
+    for name, stats in report["by_priority"].items():
+        row(name, stats)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay history and score delivery forecasts")
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    parser.add_argument("--tolerance", type=int, default=1)
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--plant", default=DEFAULT_PLANT)
+    args = parser.parse_args(argv[1:])
+
+    plant = plants.get(args.plant)
+    if plant is None:
+        print(f"unknown plant: {args.plant}")
+        return 2
+
+    db = plant.SessionLocal()
+    try:
+        report = run_backtest(db, args.start, args.end, args.tolerance)
+    finally:
+        db.close()
+
+    if args.json:
+        print(json.dumps(report, default=str, indent=2))
+    else:
+        _print_report(report)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
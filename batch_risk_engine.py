@@ -0,0 +1,170 @@
+from array import array
+from datetime import date
+
+
+# ==========================================================
+# Batch Risk Engine（Risk Engine V3 — 全厂一次评分）
+# ==========================================================
+#
+# 与 risk_engine.calculate_work_order_risk 同一套优先级，但按列计算：
+# 先把工单转成列数组（状态码 / 日期序数 / 布尔标志），
+# 每条规则生成一个 mask，按优先级从低到高覆盖写入结果列。
+#
+# Priority order:
+# 1. HOLD          (status BLOCKED)            → CRITICAL
+# 2. OVERDUE       (promise_date < today)      → CRITICAL
+# 3. CAPACITY      (projected finish > promise)→ RISK / CRITICAL
+# 4. MATERIAL      (material not ready)        → RISK
+# 5. NPI                                       → RISK
+# 6. ENGINEERING   (engineering_hold)          → RISK
+# 7. SAFE
+
+STATUS_CODES = {
+    "OPEN": 0,
+    "RUNNING": 1,
+    "BLOCKED": 2,
+    "BLOCKED_MATERIAL": 3,
+    "DONE": 4,
+    "HOLD": 2,
+}
+
+STATUS_BLOCKED = 2
+STATUS_BLOCKED_MATERIAL = 3
+
+RISK_LEVELS = ("SAFE", "RISK", "CRITICAL")
+SAFE, RISK, CRITICAL = 0, 1, 2
+
+CONSTRAINT_TYPES = (None, "ENGINEERING", "NPI", "MATERIAL", "CAPACITY", "OVERDUE", "HOLD")
+NO_CONSTRAINT, ENGINEERING, NPI, MATERIAL, CAPACITY, OVERDUE, HOLD = range(7)
+
+# 预测延误超过该天数 → CRITICAL
+CAPACITY_CRITICAL_DELAY_DAYS = 3
+
+NO_PROJECTION = 0
+
+
+class RiskColumns:
+
+    __slots__ = (
+        "work_order_ids",
+        "status",
+        "promise",
+        "material_ready",
+        "projected_finish",
+        "is_npi",
+        "engineering_hold",
+    )
+
+    def __init__(self):
+        self.work_order_ids = array("q")
+        self.status = array("b")
+        self.promise = array("l")
+        self.material_ready = array("b")
+        self.projected_finish = array("l")
+        self.is_npi = array("b")
+        self.engineering_hold = array("b")
+
+    def __len__(self):
+        return len(self.work_order_ids)
+
+
+def build_risk_columns(work_orders, projected_finish=None):
+    """
+    work_orders: WorkOrder ORM objects or projections.WorkOrderRow
+    projected_finish: {work_order_id: date} from simulate_line_orders
+    """
+    projected_finish = projected_finish or {}
+    columns = RiskColumns()
+
+    for wo in work_orders:
+        finish = projected_finish.get(wo.id)
+
+        columns.work_order_ids.append(wo.id)
+        columns.status.append(STATUS_CODES.get(str(wo.status), 0))
+        columns.promise.append(wo.promise_date.toordinal())
+        columns.material_ready.append(1 if wo.is_material_ready else 0)
+        columns.projected_finish.append(finish.toordinal() if finish else NO_PROJECTION)
+        columns.is_npi.append(1 if wo.is_npi else 0)
+        columns.engineering_hold.append(1 if wo.engineering_hold else 0)
+
+    return columns
+
+
+def _apply(mask, target, value):
+    return [value if m else t for m, t in zip(mask, target)]
+
+
+def score_risk_columns(columns, today=None):
+
+    today_ordinal = (today or date.today()).toordinal()
+    size = len(columns)
+
+    status = columns.status
+    promise = columns.promise
+    projected = columns.projected_finish
+
+    level = [SAFE] * size
+    constraint = [NO_CONSTRAINT] * size
+
+    # 延误天数：今天已过承诺日 / 预测完工晚于承诺日，取大者
+    overdue_days = [today_ordinal - p for p in promise]
+    projected_days = [
+        (f - p) if f != NO_PROJECTION else 0
+        for f, p in zip(projected, promise)
+    ]
+    delay = [max(o, d, 0) for o, d in zip(overdue_days, projected_days)]
+
+    # -------------------------------
+    # 低优先级 → 高优先级，逐层覆盖
+    # -------------------------------
+    mask = columns.engineering_hold
+    level = _apply(mask, level, RISK)
+    constraint = _apply(mask, constraint, ENGINEERING)
+
+    mask = columns.is_npi
+    level = _apply(mask, level, RISK)
+    constraint = _apply(mask, constraint, NPI)
+
+    mask = [
+        (not ready) or s == STATUS_BLOCKED_MATERIAL
+        for ready, s in zip(columns.material_ready, status)
+    ]
+    level = _apply(mask, level, RISK)
+    constraint = _apply(mask, constraint, MATERIAL)
+
+    mask = [d > 0 for d in projected_days]
+    level = [
+        (CRITICAL if d >= CAPACITY_CRITICAL_DELAY_DAYS else RISK) if m else lv
+        for m, d, lv in zip(mask, projected_days, level)
+    ]
+    constraint = _apply(mask, constraint, CAPACITY)
+
+    mask = [o > 0 for o in overdue_days]
+    level = _apply(mask, level, CRITICAL)
+    constraint = _apply(mask, constraint, OVERDUE)
+
+    mask = [s == STATUS_BLOCKED for s in status]
+    level = _apply(mask, level, CRITICAL)
+    constraint = _apply(mask, constraint, HOLD)
+
+    return {
+        "work_order_ids": columns.work_order_ids,
+        "risk_level": level,
+        "constraint": constraint,
+        "delay_days": delay,
+    }
+
+
+def summarize_risk(scores):
+
+    levels = {name: 0 for name in RISK_LEVELS}
+    constraints = {name: 0 for name in CONSTRAINT_TYPES if name}
+
+    for lv in scores["risk_level"]:
+        levels[RISK_LEVELS[lv]] += 1
+
+    for c in scores["constraint"]:
+        if c:
+            constraints[CONSTRAINT_TYPES[c]] += 1
+
+    return {"by_risk_level": levels, "by_constraint": constraints}
@@ -0,0 +1,135 @@
+"""
+Lot trace latency over a large genealogy.
+
+    python -m bench.bench_genealogy [work_orders]
+
+Builds a throwaway SQLite file: 2,000 raw-material lots, one output lot
+per work order with 5 consumed lots each (5 edges per work order),
+shipped to 5,000 sales orders. Times trace_forward (raw lot → customers)
+and trace_backward (sales order → raw lots / suppliers).
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from lot_genealogy import shipped_lot_ids, trace_backward, trace_forward
+from models import Base, Lot, LotEdge, LotShipment, SalesOrder
+
+RAW_LOTS = 2000
+SALES_ORDERS = 5000
+INPUTS_PER_ORDER = 5
+REPEAT = 20
+
+
+def seed(session, work_orders):
+    rng = random.Random(7)
+    start = datetime(2024, 1, 1)
+
+    session.execute(insert(SalesOrder), [
+        dict(order_no=f"SO{i:06d}", customer_name=f"Customer {i % 400}", order_date=start.date())
+        for i in range(SALES_ORDERS)
+    ])
+
+    session.execute(insert(Lot), [
+        dict(
+            id=i + 1,
+            lot_type="RAW",
+            item_id=i % 50 + 1,
+            lot_no=f"RL{i:06d}",
+            supplier=f"Supplier {i % 30}",
+            quantity=1000,
+            quantity_remaining=0,
+            received_at=start + timedelta(hours=i),
+        )
+        for i in range(RAW_LOTS)
+    ])
+
+    for batch_start in range(0, work_orders, 20000):
+        batch = range(batch_start, min(batch_start + 20000, work_orders))
+
+        session.execute(insert(Lot), [
+            dict(
+                id=RAW_LOTS + i + 1,
+                lot_type="FINISHED",
+                item_id=1,
+                lot_no=f"WO{i:07d}",
+                work_order_id=i + 1,
+                quantity=1,
+                quantity_remaining=0,
+                received_at=start + timedelta(minutes=i),
+            )
+            for i in batch
+        ])
+
+        # 同一段时间的工单用相邻的原料批次（FIFO）
+        session.execute(insert(LotEdge), [
+            dict(
+                parent_lot_id=(i * RAW_LOTS // work_orders + k * 7) % RAW_LOTS + 1,
+                child_lot_id=RAW_LOTS + i + 1,
+                work_order_id=i + 1,
+                quantity=rng.uniform(0.5, 5),
+                created_at=start,
+            )
+            for i in batch
+            for k in range(INPUTS_PER_ORDER)
+        ])
+
+        session.execute(insert(LotShipment), [
+            dict(lot_id=RAW_LOTS + i + 1, sales_order_id=i % SALES_ORDERS + 1, quantity=1, shipped_at=start)
+            for i in batch
+        ])
+
+    session.commit()
+
+
+def timed(func):
+    samples = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(samples), max(samples)
+
+
+def main():
+    work_orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+
+        started = time.perf_counter()
+        with Session() as session:
+            seed(session, work_orders)
+        print(
+            f"{work_orders} work orders, {work_orders * INPUTS_PER_ORDER} lot edges, "
+            f"{work_orders} shipments seeded in {time.perf_counter() - started:.1f}s"
+        )
+
+        with Session() as session:
+            result, p50, worst = timed(lambda: trace_forward(session, RAW_LOTS // 2))
+            print(
+                f"forward  raw lot → customers      {p50:7.2f}ms p50 {worst:7.2f}ms max  "
+                f"({len(result['lots'])} lots, {len(result['customers'])} customers)"
+            )
+
+            result, p50, worst = timed(lambda: trace_backward(session, shipped_lot_ids(session, 42)))
+            print(
+                f"backward sales order → raw lots   {p50:7.2f}ms p50 {worst:7.2f}ms max  "
+                f"({len(result['lots'])} lots, {len(result['suppliers'])} suppliers)"
+            )
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Plant-wide discrete-event simulation of routed work orders.
+
+    python -m bench.bench_plant_simulation [work_orders] [operations_per_order]
+
+Synthetic plant: 24 lines with a 5-day week calendar, work orders routed
+through `operations_per_order` operations on different lines (SMT →
+assembly → test style chains). Times simulate_plant() over the whole
+plant, and checks that without routings it matches the per-line
+simulation (capacity_engine.project_finish_dates).
+"""
+
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from capacity_engine import project_finish_dates
+from plant_simulation import simulate_plant
+from projections import OperationRow, ProductionLineRow, WorkOrderRow
+
+LINES = 24
+HORIZON = 180
+
+
+def synthetic_plant(count, steps):
+    today = date.today()
+    created = datetime.combine(today, datetime.min.time())
+    priorities = ("HIGH", "NORMAL", "LOW")
+
+    lines = [
+        ProductionLineRow(
+            id=i + 1,
+            line_name=f"L{i + 1}",
+            working_hours_per_day=16,
+            efficiency_rate=0.9,
+            is_active=True,
+            calendar_version=0,
+        )
+        for i in range(LINES)
+    ]
+
+    start = today + timedelta(days=1)
+    vectors = {
+        line.id: [
+            0.0 if (start + timedelta(days=d)).weekday() >= 5 else 16 * 0.9
+            for d in range(HORIZON)
+        ]
+        for line in lines
+    }
+
+    orders = []
+    operations = {}
+
+    for i in range(count):
+        hours = float(2 + i % 14)
+        orders.append(WorkOrderRow(
+            id=i + 1,
+            work_order_no=f"WO-{i:07d}",
+            production_line_id=1 + i % LINES,
+            remaining_hours=hours,
+            status="RUNNING" if i % 9 == 0 else "OPEN",
+            is_material_ready=i % 17 != 0,
+            priority=priorities[i % 3],
+            promise_date=today + timedelta(days=i % 120),
+            is_npi=False,
+            engineering_hold=False,
+            created_datetime=created + timedelta(seconds=i),
+            actual_hours=1.0 if i % 9 == 0 else 0.0,
+        ))
+
+        # 工序在不同产线组之间流转（前段 → 中段 → 后段）
+        operations[i + 1] = [
+            OperationRow(
+                work_order_id=i + 1,
+                sequence=(k + 1) * 10,
+                operation_name=f"OP{k + 1}",
+                production_line_id=1 + (k * LINES // steps + i % (LINES // steps)) % LINES,
+                standard_hours=1.0 + (i + k) % 3,
+            )
+            for k in range(steps)
+        ]
+
+    return lines, vectors, orders, operations
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    lines, vectors, orders, operations = synthetic_plant(count, steps)
+    today = date.today()
+
+    started = time.perf_counter()
+    result = simulate_plant(lines, orders, operations, capacity_vectors=vectors, today=today)
+    elapsed = time.perf_counter() - started
+
+    summary = result["summary"]
+    print(
+        f"{summary['work_orders']} work orders, {summary['operations']} operations on {LINES} lines: "
+        f"{elapsed:.2f}s ({summary['events']} events, makespan {summary['makespan_date']}, "
+        f"{summary['late_work_orders']} late)"
+    )
+
+    # 没有工序 → 与逐线仿真同一结果
+    started = time.perf_counter()
+    plain = simulate_plant(lines, orders, capacity_vectors=vectors, today=today)
+    plant_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    projected = project_finish_dates(lines, orders, capacity_vectors=vectors, today=today)
+    line_elapsed = time.perf_counter() - started
+
+    mismatches = sum(
+        1 for row in plain["work_orders"]
+        if projected.get(row["work_order_id"]) != row["estimated_finish_date"]
+    )
+    print(
+        f"single-operation plant {plant_elapsed:.2f}s vs per-line simulation {line_elapsed:.2f}s, "
+        f"{mismatches} finish-date mismatches"
+    )
+
+
+if __name__ == "__main__":
+    main()
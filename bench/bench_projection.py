@@ -0,0 +1,119 @@
+"""
+ORM hydration vs read-only projection for the capacity engines.
+
+    python -m bench.bench_projection [work_orders]
+
+Builds a throwaway SQLite file, loads one line's work orders both ways
+and runs calculate_line_capacity + simulate_line_orders on each.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from capacity_engine import calculate_line_capacity, simulate_line_orders
+from models import Base, ProductionLine, WorkOrder
+from projections import load_production_line_row, load_work_order_rows
+
+
+def seed(session, count):
+    session.add(ProductionLine(
+        id=1,
+        line_name="BENCH",
+        working_hours_per_day=16,
+        efficiency_rate=0.9,
+    ))
+
+    today = date.today()
+    priorities = ("HIGH", "NORMAL", "LOW")
+
+    session.execute(insert(WorkOrder), [
+        dict(
+            work_order_no=f"WO-{i:07d}",
+            sales_order_id=1,
+            product_id=1,
+            production_line_id=1,
+            planned_hours=8,
+            remaining_hours=8 - (i % 8),
+            priority=priorities[i % 3],
+            promise_date=today + timedelta(days=i % 90),
+            is_material_ready=i % 5 != 0,
+            status="RUNNING" if i % 8 else "OPEN",
+        )
+        for i in range(count)
+    ])
+    session.commit()
+
+
+def run(session_factory, load):
+    session = session_factory()
+
+    started = time.perf_counter()
+    line, work_orders = load(session)
+    loaded = time.perf_counter()
+
+    calculate_line_capacity(line, work_orders, [], forecast_days=5)
+    simulate_line_orders(line, work_orders, [])
+    finished = time.perf_counter()
+
+    session.close()
+    return loaded - started, finished - loaded
+
+
+def measure(label, session_factory, load):
+    load_seconds, engine_seconds = run(session_factory, load)
+
+    # 内存单独跑一遍（tracemalloc 本身会拖慢计时）
+    tracemalloc.start()
+    run(session_factory, load)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{label:<12} load {1000 * load_seconds:8.1f} ms"
+        f"   engines {1000 * engine_seconds:7.1f} ms"
+        f"   peak {peak / 1024 / 1024:7.1f} MiB"
+    )
+
+
+def load_orm(session):
+    line = session.get(ProductionLine, 1)
+    work_orders = session.query(WorkOrder).filter(
+        WorkOrder.production_line_id == 1,
+        WorkOrder.status != "DONE"
+    ).all()
+    return line, work_orders
+
+
+def load_projection(session):
+    return load_production_line_row(session, 1), load_work_order_rows(session, 1)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        with session_factory() as session:
+            seed(session, count)
+
+        print(f"{count} work orders on one line")
+
+        for _ in range(2):
+            measure("orm", session_factory, load_orm)
+            measure("projection", session_factory, load_projection)
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Batch risk scoring throughput.
+
+    python -m bench.bench_risk [work_orders]
+
+Scores synthetic open work orders with the column engine and, for
+comparison, the per-object V2 scorer (risk_engine.calculate_work_order_risk).
+"""
+
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from batch_risk_engine import build_risk_columns, score_risk_columns
+from projections import WorkOrderRow
+from risk_engine import calculate_work_order_risk
+
+
+def synthetic_orders(count):
+    today = date.today()
+    created = datetime.combine(today, datetime.min.time())
+    statuses = ("OPEN", "RUNNING", "RUNNING", "BLOCKED_MATERIAL", "BLOCKED")
+    priorities = ("HIGH", "NORMAL", "LOW")
+
+    orders = []
+    projected = {}
+
+    for i in range(count):
+        promise = today + timedelta(days=(i % 40) - 10)
+        orders.append(WorkOrderRow(
+            id=i + 1,
+            work_order_no=f"WO-{i:07d}",
+            production_line_id=1 + i % 20,
+            remaining_hours=float(i % 16),
+            status=statuses[i % 5],
+            is_material_ready=i % 7 != 0,
+            priority=priorities[i % 3],
+            promise_date=promise,
+            is_npi=i % 11 == 0,
+            engineering_hold=i % 13 == 0,
+            created_datetime=created,
+        ))
+        projected[i + 1] = promise + timedelta(days=(i % 9) - 4)
+
+    return orders, projected
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    orders, projected = synthetic_orders(count)
+
+    started = time.perf_counter()
+    columns = build_risk_columns(orders, projected)
+    built = time.perf_counter()
+    score_risk_columns(columns)
+    scored = time.perf_counter()
+
+    for wo in orders:
+        calculate_work_order_risk(wo)
+    per_object = time.perf_counter() - scored
+
+    print(f"{count} open work orders")
+    print(f"build columns  {1000 * (built - started):7.1f} ms")
+    print(f"score batch    {1000 * (scored - built):7.1f} ms")
+    print(f"V2 per-object  {1000 * per_object:7.1f} ms  (no capacity / material rules)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Typeahead latency of GET /search at scale.
+
+    python -m bench.bench_search [rows]
+
+Builds a throwaway SQLite file with `rows` searchable records (work orders,
+sales orders, products, raw materials), builds the FTS5 index, then times
+search() for growing prefixes against the FTS index and the LIKE fallback.
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+import search_index
+from models import Base, Product, RawMaterial, SalesOrder, WorkOrder
+
+CUSTOMERS = ("Acme Industrial", "Globex Power", "Initech Motors", "Umbrella Energy", "Stark Drives")
+MATERIALS = ("Copper wire", "Stainless steel sheet", "Silicon wafer", "Epoxy resin", "Ferrite core")
+QUERIES = ("w", "wo", "wo-0", "wo-01", "wo-0123", "wo-012345", "acme", "stain sh", "20240", "zzz")
+REPEAT = 50
+LIKE_REPEAT = 5       # 回退路径是全表扫描
+
+
+def seed(session, rows):
+    quarter = rows // 4
+    today = date.today()
+
+    for start in range(0, quarter, 50000):
+        batch = range(start, min(start + 50000, quarter))
+        session.execute(insert(WorkOrder), [
+            dict(
+                work_order_no=f"WO-{i:07d}",
+                sales_order_id=1,
+                product_id=1,
+                production_line_id=1,
+                planned_hours=8,
+                remaining_hours=8,
+                priority="NORMAL",
+                promise_date=today,
+                is_material_ready=True,
+                status="OPEN",
+            )
+            for i in batch
+        ])
+        session.execute(insert(SalesOrder), [
+            dict(order_no=f"SO-2024{i:07d}", customer_name=CUSTOMERS[i % 5], order_date=today)
+            for i in batch
+        ])
+        session.execute(insert(Product), [
+            dict(model_no=f"INV-{i:06d}-K", model_description=f"Inverter {i % 900} kW")
+            for i in batch
+        ])
+        session.execute(insert(RawMaterial), [
+            dict(material_code=f"RM{i:07d}", material_name=f"{MATERIALS[i % 5]} {i % 97}", unit="pc")
+            for i in batch
+        ])
+
+    session.commit()
+
+
+def timed(session, query, fts, repeat):
+    search_index._available.clear()
+    if not fts:
+        session.execute(text("ALTER TABLE search_index RENAME TO search_index_off"))
+    try:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = search_index.search(session, query, limit=20)
+            samples.append((time.perf_counter() - started) * 1000)
+    finally:
+        if not fts:
+            session.execute(text("ALTER TABLE search_index_off RENAME TO search_index"))
+        search_index._available.clear()
+
+    samples.sort()
+    return result, statistics.median(samples), samples[max(int(len(samples) * 0.99) - 1, 0)]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+
+        started = time.perf_counter()
+        with Session() as session:
+            seed(session, rows)
+        print(f"seeded {rows} rows in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            search_index.rebuild_search_index(connection)
+        print(f"built FTS5 index in {time.perf_counter() - started:.1f}s")
+
+        with Session() as session:
+            print(f"{'query':<12} {'hits':>4}  {'fts p50':>8} {'fts p99':>8}  {'like p50':>9} {'like p99':>9}")
+            for query in QUERIES:
+                result, fts_p50, fts_p99 = timed(session, query, fts=True, repeat=REPEAT)
+                _, like_p50, like_p99 = timed(session, query, fts=False, repeat=LIKE_REPEAT)
+                print(
+                    f"{query:<12} {len(result['results']):>4}  "
+                    f"{fts_p50:7.2f}ms {fts_p99:7.2f}ms  {like_p50:8.2f}ms {like_p99:8.2f}ms"
+                )
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
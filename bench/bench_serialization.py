@@ -0,0 +1,96 @@
+"""
+Response encoding: Pydantic from_attributes validation vs column dicts.
+
+    python -m bench.bench_serialization [rows]
+
+Compares, for GET /work-orders sized payloads:
+  pydantic    ORM rows -> list[WorkOrderResponse] validation -> JSON
+                (what response_model=list[...] does per request)
+  fast        column SELECT -> dicts -> FastJSONResponse.render
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from fast_json import FastJSONResponse, fetch_dicts, orjson, schema_columns
+from models import Base, WorkOrder
+from schemas import WorkOrderResponse
+
+
+def seed(session, count):
+    today = date.today()
+    session.execute(insert(WorkOrder), [
+        dict(
+            work_order_no=f"WO-{i:07d}",
+            sales_order_id=1,
+            product_id=1,
+            production_line_id=1 + i % 4,
+            planned_hours=8.0,
+            remaining_hours=float(8 - i % 8),
+            priority="NORMAL",
+            promise_date=today + timedelta(days=i % 90),
+            is_material_ready=True,
+            status="RUNNING",
+        )
+        for i in range(count)
+    ])
+    session.commit()
+
+
+def pydantic_path(session):
+    adapter = TypeAdapter(list[WorkOrderResponse])
+    rows = session.query(WorkOrder).all()
+    validated = adapter.validate_python(rows, from_attributes=True)
+    return json.dumps(adapter.dump_python(validated, mode="json")).encode("utf-8")
+
+
+def fast_path(session):
+    rows = fetch_dicts(session, select(*schema_columns(WorkOrder, WorkOrderResponse)))
+    return FastJSONResponse(rows).body
+
+
+def timed(session_factory, func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        with session_factory() as session:
+            started = time.perf_counter()
+            body = func(session)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+
+        with session_factory() as session:
+            seed(session, count)
+
+        slow, slow_body = timed(session_factory, pydantic_path)
+        fast, fast_body = timed(session_factory, fast_path)
+
+        assert json.loads(slow_body) == json.loads(fast_body)
+
+        encoder = "orjson" if orjson is not None else "json"
+        print(f"{count} rows, {len(fast_body) / 1024 / 1024:.1f} MiB payload ({encoder})")
+        print(f"pydantic  {1000 * slow:8.1f} ms")
+        print(f"fast      {1000 * fast:8.1f} ms   ({slow / fast:.1f}x)")
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Worker start-up cost: `import main` + lifespan schema check.
+
+    python -m bench.bench_startup [runs]
+
+Each run is a fresh interpreter against an already-migrated temporary
+SQLite file, i.e. what a respawned worker pays before serving.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+PROBE = """
+import time
+started = time.perf_counter()
+import main
+from database import engine
+from migrations import check_schema_version
+imported = time.perf_counter()
+check_schema_version(engine)
+checked = time.perf_counter()
+print(imported - started, checked - imported)
+"""
+
+
+def run_probe(env):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    wall = time.perf_counter() - started
+    import_seconds, check_seconds = map(float, output.split()[-2:])
+    return wall, import_seconds, check_seconds
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            MES_DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            PYTHONPATH=root,
+        )
+
+        subprocess.run(
+            [sys.executable, os.path.join(root, "migrations.py"), "upgrade"],
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+
+        samples = [run_probe(env) for _ in range(runs)]
+
+    wall, imports, checks = zip(*samples)
+
+    print(f"{runs} cold starts (median)")
+    print(f"process wall    {1000 * statistics.median(wall):7.1f} ms")
+    print(f"import main     {1000 * statistics.median(imports):7.1f} ms")
+    print(f"schema check    {1000 * statistics.median(checks):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
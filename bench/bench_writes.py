@@ -0,0 +1,171 @@
+"""
+Sustained write throughput: per-request commit vs group commit.
+
+    python -m bench.bench_writes [threads] [writes_per_thread]
+
+Concurrent threads submit the POST /production-log and POST /raw-materials
+write functions (the code behind the endpoints, without HTTP overhead)
+against a temporary SQLite file:
+  inline      MES_WRITE_PIPELINE=0 behaviour, one commit per request
+  pipeline    single writer, group commit (MES_WRITE_BATCH_WINDOW_MS=0)
+  window      single writer, group commit with a 2 ms batching window
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+
+def seed(session_factory, models, work_orders):
+    with session_factory() as session:
+        session.add(models.ProductionLine(line_name="L1", working_hours_per_day=8, efficiency_rate=1))
+        session.add(models.Product(model_no="M1"))
+        session.add(models.SalesOrder(order_no="SO1", customer_name="ACME", order_date=date.today(), status="OPEN"))
+        session.flush()
+
+        for i in range(3):
+            material = models.RawMaterial(material_code=f"RM{i}", material_name="x", unit="pc")
+            session.add(material)
+            session.flush()
+            session.add(models.RawMaterialInventory(raw_material_id=material.id, quantity_on_hand=1e9))
+            session.add(models.BOM(product_id=1, raw_material_id=material.id, quantity_required=1))
+
+        for i in range(work_orders):
+            session.add(models.WorkOrder(
+                work_order_no=f"WO{i}",
+                sales_order_id=1,
+                product_id=1,
+                production_line_id=1,
+                planned_hours=1e9,
+                remaining_hours=1e9,
+                priority="NORMAL",
+                promise_date=date.today(),
+                is_material_ready=True,
+                status="OPEN",
+            ))
+        session.commit()
+
+
+def run(threads, per_thread, write):
+    failures = []
+
+    def worker(index):
+        for n in range(per_thread):
+            try:
+                write(index, n)
+            except Exception as exc:
+                failures.append(exc)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started, failures
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["MES_DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["MES_SCHEDULER"] = "off"
+        os.environ.pop("MES_PLANTS", None)
+
+        from sqlalchemy import event
+
+        import main as app_module
+        import models
+        import write_pipeline
+        from database import SessionLocal, engine
+        from migrations import upgrade
+        from schemas import ProductionLogCreate, RawMaterialCreate
+
+        upgrade(engine)
+        seed(SessionLocal, models, threads)
+
+        # 数 SQLite 真正执行的提交（语句跟踪），不是按批次推算：
+        # COMMIT，以及事务外的最外层 RELEASE（它本身就是一次提交）
+        commits = [0]
+
+        @event.listens_for(engine, "connect")
+        def _trace_commits(dbapi_connection, connection_record):
+            state = {"begun": False, "savepoints": 0}
+
+            def trace(statement):
+                keyword = statement.split(None, 1)[0].upper()
+                if keyword == "BEGIN":
+                    state["begun"] = True
+                elif keyword == "SAVEPOINT":
+                    state["savepoints"] += 1
+                elif keyword == "RELEASE":
+                    state["savepoints"] -= 1
+                    if not state["begun"] and state["savepoints"] == 0:
+                        commits[0] += 1
+                elif keyword in ("COMMIT", "END"):
+                    state["begun"] = False
+                    commits[0] += 1
+                elif keyword == "ROLLBACK" and "TO" not in statement.upper().split():
+                    state["begun"] = False
+                    state["savepoints"] = 0
+
+            dbapi_connection.set_trace_callback(trace)
+
+        engine.dispose()
+
+        pipeline = write_pipeline.write_pipeline
+
+        def production_log(index, n):
+            log = ProductionLogCreate(
+                production_line_id=1,
+                work_order_id=index + 1,
+                produced_hours=0.01,
+                log_date=date.today(),
+            )
+            pipeline.submit(lambda db: app_module._apply_production_log(db, log))
+
+        def raw_material(index, n):
+            material = RawMaterialCreate(
+                material_code=f"X-{index}-{n}-{time.perf_counter_ns()}",
+                material_name="bench",
+                unit="pc",
+            )
+            pipeline.submit(lambda db: app_module._create_raw_material(db, material))
+
+        scenarios = [
+            ("inline", False, 0.0),
+            ("pipeline", True, 0.0),
+            ("window", True, 0.002),
+        ]
+
+        total = threads * per_thread
+        print(f"{threads} threads x {per_thread} writes")
+
+        for label, write in (("production-log", production_log), ("raw-materials", raw_material)):
+            print(label)
+            baseline = None
+            for name, enabled, window in scenarios:
+                write_pipeline.PIPELINE_ENABLED = enabled
+                write_pipeline.BATCH_WINDOW_SECONDS = window
+                commits[0] = 0
+
+                elapsed, failures = run(threads, per_thread, write)
+                rate = (total - len(failures)) / elapsed
+                baseline = baseline or rate
+
+                print(
+                    f"  {name:<9} {rate:8.0f} writes/s  "
+                    f"{commits[0] / total:5.2f} commits/write  "
+                    f"{len(failures):4d} failed  ({rate / baseline:.1f}x)"
+                )
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+from datetime import datetime
+
+from sqlalchemy import delete, event, func, inspect, insert, select
+from sqlalchemy.orm import Session
+
+from models import (
+    BOM,
+    BOMFlatRequirement,
+    BOMSubassembly,
+    Product,
+    RawMaterial,
+    RawMaterialInventory,
+    WorkOrder,
+)
+
+
+# ==========================================================
+# BOM Explosion（多层 BOM → 每个产品一条展开后的单位用量向量）
+# ==========================================================
+#
+#   boms                产品 → 原料         数量 × (1 + 损耗率)
+#   bom_subassemblies   产品 → 半成品       数量 × (1 + 损耗率) × 半成品的展开向量
+#   bom_flat_requirements (产品, 原料) → 单位用量（逐层连乘，多条路径相加）
+#
+# 报工扣料 / 物料需求只读展开表（一次查询），不再逐层走树。
+#
+# 维护：after_flush 钩子，同一事务内重算。BOM 行变化 → 只重算该产品及其所有上级
+# （bom_subassemblies 上向上的递归 CTE）；没受影响的下级直接用已缓存的向量。
+# 只对 ORM flush 生效；Core 批量写这两张表之后需要自己调 refresh / rebuild。
+#
+# 环：新增半成品行前用 would_create_cycle 检查（接口返回 400）；
+# 展开时再遇到环（绕过接口直接写库）→ BOMCycleError，事务回滚。
+
+BOM_MODELS = (BOM, BOMSubassembly)
+
+
+class BOMCycleError(ValueError):
+    pass
+
+
+def _line_factor(quantity, scrap_rate):
+    return quantity * (1 + (scrap_rate or 0))
+
+
+# -------------------------------
+# 图查询
+# -------------------------------
+
+def _descendants(component_product_id):
+    """Recursive CTE: component_product_id and every sub-assembly below it."""
+
+    seed = select(Product.id.label("product_id")).where(Product.id == component_product_id)
+    tree = seed.cte("bom_down", recursive=True)
+    return tree.union(
+        select(BOMSubassembly.component_product_id.label("product_id"))
+        .join(tree, BOMSubassembly.product_id == tree.c.product_id)
+    )
+
+
+def _ancestors(product_ids):
+    """Recursive CTE: product_ids and every product that uses them, directly or not."""
+
+    seed = select(Product.id.label("product_id")).where(Product.id.in_(product_ids))
+    tree = seed.cte("bom_up", recursive=True)
+    return tree.union(
+        select(BOMSubassembly.product_id.label("product_id"))
+        .join(tree, BOMSubassembly.component_product_id == tree.c.product_id)
+    )
+
+
+def would_create_cycle(db, product_id, component_product_id):
+    """product → component would close a loop (product is already below component)."""
+
+    if product_id == component_product_id:
+        return True
+
+    tree = _descendants(component_product_id)
+    return db.execute(
+        select(tree.c.product_id).where(tree.c.product_id == product_id).limit(1)
+    ).first() is not None
+
+
+# -------------------------------
+# 展开
+# -------------------------------
+
+def _explode(product_ids, materials, components, cached):
+    """Flat vectors for product_ids, children first.
+
+    materials:  {product_id: [(raw_material_id, factor)]}
+    components: {product_id: [(component_product_id, factor)]}
+    cached:     {product_id: {raw_material_id: quantity}} for components outside product_ids
+    """
+
+    vectors = {}
+    visiting = set()
+
+    def explode(product_id):
+        if product_id in vectors:
+            return vectors[product_id]
+        if product_id not in product_ids:
+            return cached.get(product_id, {})
+        if product_id in visiting:
+            raise BOMCycleError(f"BOM cycle at product {product_id}")
+
+        visiting.add(product_id)
+
+        vector = {}
+        for material_id, factor in materials.get(product_id, ()):
+            vector[material_id] = vector.get(material_id, 0.0) + factor
+
+        for component_id, factor in components.get(product_id, ()):
+            for material_id, quantity in explode(component_id).items():
+                vector[material_id] = vector.get(material_id, 0.0) + factor * quantity
+
+        visiting.discard(product_id)
+        vectors[product_id] = vector
+        return vector
+
+    for product_id in product_ids:
+        explode(product_id)
+
+    return vectors
+
+
+def _load_lines(connection, product_ids=None):
+
+    bom_query = select(BOM.product_id, BOM.raw_material_id, BOM.quantity_required, BOM.scrap_rate)
+    sub_query = select(
+        BOMSubassembly.product_id,
+        BOMSubassembly.component_product_id,
+        BOMSubassembly.quantity_required,
+        BOMSubassembly.scrap_rate,
+    )
+    if product_ids is not None:
+        bom_query = bom_query.where(BOM.product_id.in_(product_ids))
+        sub_query = sub_query.where(BOMSubassembly.product_id.in_(product_ids))
+
+    materials = {}
+    for product_id, material_id, quantity, scrap_rate in connection.execute(bom_query):
+        materials.setdefault(product_id, []).append((material_id, _line_factor(quantity, scrap_rate)))
+
+    components = {}
+    for product_id, component_id, quantity, scrap_rate in connection.execute(sub_query):
+        components.setdefault(product_id, []).append((component_id, _line_factor(quantity, scrap_rate)))
+
+    return materials, components
+
+
+def _write_vectors(connection, vectors, now):
+    rows = [
+        dict(product_id=product_id, raw_material_id=material_id, quantity=quantity, computed_at=now)
+        for product_id, vector in vectors.items()
+        for material_id, quantity in vector.items()
+    ]
+    if rows:
+        connection.execute(insert(BOMFlatRequirement), rows)
+
+
+def refresh_flat_requirements(connection, product_ids, now=None):
+    """Recompute the flat vectors of product_ids and all their ancestors; returns the products touched."""
+
+    if not product_ids:
+        return set()
+
+    now = now or datetime.utcnow()
+
+    tree = _ancestors(list(product_ids))
+    affected = set(connection.scalars(select(tree.c.product_id)).all())
+    if not affected:
+        return affected
+
+    materials, components = _load_lines(connection, affected)
+
+    # 受影响产品用到的、但自身没变的半成品 → 直接读缓存
+    outside = {
+        component_id
+        for lines in components.values()
+        for component_id, _ in lines
+        if component_id not in affected
+    }
+    cached = {}
+    if outside:
+        for product_id, material_id, quantity in connection.execute(
+            select(
+                BOMFlatRequirement.product_id,
+                BOMFlatRequirement.raw_material_id,
+                BOMFlatRequirement.quantity,
+            ).where(BOMFlatRequirement.product_id.in_(outside))
+        ):
+            cached.setdefault(product_id, {})[material_id] = quantity
+
+    vectors = _explode(affected, materials, components, cached)
+
+    connection.execute(delete(BOMFlatRequirement).where(BOMFlatRequirement.product_id.in_(affected)))
+    _write_vectors(connection, vectors, now)
+
+    return affected
+
+
+def rebuild_flat_requirements(connection):
+    """Recompute every flat vector from boms / bom_subassemblies (migration / repair)."""
+
+    materials, components = _load_lines(connection)
+    product_ids = set(materials) | set(components)
+
+    vectors = _explode(product_ids, materials, components, {})
+
+    connection.execute(delete(BOMFlatRequirement))
+    _write_vectors(connection, vectors, datetime.utcnow())
+
+
+# -------------------------------
+# 同步（flush 钩子）
+# -------------------------------
+
+def _changed_products(obj, deleted=False):
+    products = {obj.product_id}
+    if deleted:
+        return products
+
+    history = inspect(obj).attrs.product_id.history
+    products.update(value for value in history.deleted if value is not None)
+    return products
+
+
+def _after_flush(session, flush_context):
+
+    changed = set()
+
+    for obj in session.new:
+        if isinstance(obj, BOM_MODELS):
+            changed |= _changed_products(obj)
+
+    for obj in session.dirty:
+        if isinstance(obj, BOM_MODELS) and session.is_modified(obj):
+            changed |= _changed_products(obj)
+
+    for obj in session.deleted:
+        if isinstance(obj, BOM_MODELS):
+            changed |= _changed_products(obj, deleted=True)
+
+    if changed:
+        refresh_flat_requirements(session.connection(), changed)
+
+
+def install_bom_cache():
+    if event.contains(Session, "after_flush", _after_flush):
+        return
+    event.listen(Session, "after_flush", _after_flush)
+
+
+# -------------------------------
+# 查询
+# -------------------------------
+
+def flat_requirements(db, product_id):
+    """Per-unit material vector of one product, with on-hand stock."""
+
+    return [
+        dict(row._mapping)
+        for row in db.execute(
+            select(
+                BOMFlatRequirement.raw_material_id,
+                RawMaterial.material_code,
+                RawMaterial.material_name,
+                RawMaterial.unit,
+                BOMFlatRequirement.quantity,
+                RawMaterialInventory.quantity_on_hand,
+                BOMFlatRequirement.computed_at,
+            )
+            .join(RawMaterial, RawMaterial.id == BOMFlatRequirement.raw_material_id)
+            .outerjoin(
+                RawMaterialInventory,
+                RawMaterialInventory.raw_material_id == BOMFlatRequirement.raw_material_id,
+            )
+            .where(BOMFlatRequirement.product_id == product_id)
+            .order_by(BOMFlatRequirement.raw_material_id)
+        )
+    ]
+
+
+def material_requirements(db, production_line_id=None):
+    """Open work orders' remaining hours × flat vectors, netted against on-hand stock."""
+
+    required = func.sum(WorkOrder.remaining_hours * BOMFlatRequirement.quantity)
+
+    query = (
+        select(
+            BOMFlatRequirement.raw_material_id,
+            RawMaterial.material_code,
+            RawMaterial.material_name,
+            RawMaterial.unit,
+            required.label("required"),
+            func.count(func.distinct(WorkOrder.id)).label("work_orders"),
+            RawMaterialInventory.quantity_on_hand,
+        )
+        .join(BOMFlatRequirement, BOMFlatRequirement.product_id == WorkOrder.product_id)
+        .join(RawMaterial, RawMaterial.id == BOMFlatRequirement.raw_material_id)
+        .outerjoin(
+            RawMaterialInventory,
+            RawMaterialInventory.raw_material_id == BOMFlatRequirement.raw_material_id,
+        )
+        .where(WorkOrder.status != "DONE", WorkOrder.remaining_hours > 0)
+        .group_by(
+            BOMFlatRequirement.raw_material_id,
+            RawMaterial.material_code,
+            RawMaterial.material_name,
+            RawMaterial.unit,
+            RawMaterialInventory.quantity_on_hand,
+        )
+        .order_by(BOMFlatRequirement.raw_material_id)
+    )
+    if production_line_id is not None:
+        query = query.where(WorkOrder.production_line_id == production_line_id)
+
+    items = []
+    for row in db.execute(query):
+        on_hand = row.quantity_on_hand or 0.0
+        items.append({
+            "raw_material_id": row.raw_material_id,
+            "material_code": row.material_code,
+            "material_name": row.material_name,
+            "unit": row.unit,
+            "work_orders": row.work_orders,
+            "required": round(row.required, 4),
+            "on_hand": on_hand,
+            "shortage": round(max(row.required - on_hand, 0.0), 4),
+        })
+
+    return {
+        "production_line_id": production_line_id,
+        "shortages": sum(1 for item in items if item["shortage"] > 0),
+        "materials": items,
+    }
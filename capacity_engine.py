@@ -1,10 +1,35 @@
 import math
+from bisect import bisect_left
 from datetime import date, timedelta
+from itertools import accumulate
+
+from queue_engine import dispatch_key
+
+
+# ==========================================================
+# CAPACITY VECTOR（line_calendar.py 编译，vector[0] = 明天）
+# ==========================================================
+# 不传向量 = 旧口径：每天 working_hours_per_day × efficiency_rate
+
+def finish_day_offset(cumulative, hours):
+    """Days from today until `hours` of work is done, given cumulative capacity."""
+    if hours <= 0:
+        return 0
+
+    index = bisect_left(cumulative, hours - 1e-9)
+    if index < len(cumulative):
+        return index + 1
+
+    # 超出向量范围：按范围内平均产能外推
+    horizon = len(cumulative)
+    average = cumulative[-1] / horizon
+    return horizon + math.ceil((hours - cumulative[-1]) / average)
 
 
 # ==========================================================
 # LINE CAPACITY SUMMARY + AUTO REBALANCE (A + B Version)
 # ==========================================================
+# 输入按属性读取：ORM 对象或 projections.py 的只读行均可
 
 def calculate_line_capacity(
     production_line,
@@ -12,7 +37,8 @@ def calculate_line_capacity(
     production_events,
     all_lines=None,
     all_work_orders=None,
-    forecast_days: int = 5
+    forecast_days: int = 5,
+    capacity_vectors=None
 ):
 
     daily_capacity = (
@@ -23,6 +49,15 @@ def calculate_line_capacity(
     if daily_capacity <= 0:
         return {"error": "Invalid daily capacity configuration"}
 
+    capacity_vectors = capacity_vectors or {}
+    capacity_vector = capacity_vectors.get(production_line.id)
+
+    if capacity_vector is not None:
+        available_hours = sum(capacity_vector[:forecast_days])
+        daily_capacity = available_hours / forecast_days
+    else:
+        available_hours = daily_capacity * forecast_days
+
     # -------------------------------
     # OPEN / BLOCKED HOURS
     # -------------------------------
@@ -48,7 +83,6 @@ def calculate_line_capacity(
         if not event.is_resolved
     )
 
-    available_hours = daily_capacity * forecast_days
     net_available_hours = max(available_hours - event_impact_hours, 0)
 
     current_utilization = 0
@@ -112,11 +146,15 @@ def calculate_line_capacity(
 
             line_open_hours = sum(wo.remaining_hours for wo in line_orders)
 
-            line_daily_capacity = (
-                line.working_hours_per_day * line.efficiency_rate
-            )
+            line_vector = capacity_vectors.get(line.id)
 
-            line_available = line_daily_capacity * forecast_days
+            if line_vector is not None:
+                line_available = sum(line_vector[:forecast_days])
+            else:
+                line_available = (
+                    line.working_hours_per_day * line.efficiency_rate
+                    * forecast_days
+                )
             spare_capacity = line_available - line_open_hours
 
             if spare_capacity > 0:
@@ -131,14 +169,10 @@ def calculate_line_capacity(
 
             transfer_hours = min(overload_gap_hours, spare_capacity)
 
-            priority_map = {"HIGH": 1, "NORMAL": 2, "LOW": 3}
-
+            # 从派工队列队尾（最不急的）开始转出
             sorted_orders = sorted(
                 open_orders,
-                key=lambda x: (
-                    priority_map.get(x.priority, 2),
-                    x.promise_date
-                ),
+                key=dispatch_key,
                 reverse=True
             )
 
@@ -182,8 +216,15 @@ def calculate_line_capacity(
 # ==========================================================
 # LINE SIMULATION (完整版本)
 # ==========================================================
+# 输入按属性读取：ORM 对象或 projections.py 的只读行均可
 
-def simulate_line_orders(production_line, work_orders, production_events):
+def simulate_line_orders(
+    production_line,
+    work_orders,
+    production_events,
+    today=None,
+    capacity_vector=None
+):
 
     daily_capacity = (
         production_line.working_hours_per_day
@@ -193,35 +234,39 @@ def simulate_line_orders(production_line, work_orders, production_events):
     if daily_capacity <= 0:
         return {"error": "Invalid daily capacity configuration"}
 
+    cumulative = None
+    if capacity_vector is not None:
+        cumulative = list(accumulate(capacity_vector))
+        if not cumulative or cumulative[-1] <= 0:
+            return {"error": "No calendar capacity in forecast horizon"}
+
     open_orders = [
         wo for wo in work_orders
         if wo.status != "DONE" and wo.is_material_ready
     ]
 
-    priority_map = {"HIGH": 1, "NORMAL": 2, "LOW": 3}
-
-    sorted_orders = sorted(
-        open_orders,
-        key=lambda x: (
-            priority_map.get(x.priority, 2),
-            x.promise_date
-        )
-    )
+    # 与派工队列同一顺序
+    sorted_orders = sorted(open_orders, key=dispatch_key)
 
     results = []
     accumulated_hours = 0
-    today = date.today()
+    today = today or date.today()
 
     for wo in sorted_orders:
         accumulated_hours += wo.remaining_hours
 
-        days_needed = accumulated_hours / daily_capacity
-        estimated_finish = today + timedelta(days=math.ceil(days_needed))
+        if cumulative is None:
+            days_needed = math.ceil(accumulated_hours / daily_capacity)
+        else:
+            days_needed = finish_day_offset(cumulative, accumulated_hours)
+
+        estimated_finish = today + timedelta(days=days_needed)
 
         delay_days = (estimated_finish - wo.promise_date).days
         will_delay = delay_days > 0
 
         results.append({
+            "work_order_id": wo.id,
             "work_order_no": wo.work_order_no,
             "priority": wo.priority,
             "remaining_hours": wo.remaining_hours,
@@ -233,3 +278,49 @@ def simulate_line_orders(production_line, work_orders, production_events):
         })
 
     return results
+
+
+# ==========================================================
+# PLANT PROJECTION（全厂预测完工日）
+# ==========================================================
+
+def project_finish_dates(
+    production_lines,
+    work_orders,
+    production_events=(),
+    capacity_vectors=None,
+    today=None
+):
+
+    capacity_vectors = capacity_vectors or {}
+
+    orders_by_line = {}
+    for wo in work_orders:
+        orders_by_line.setdefault(wo.production_line_id, []).append(wo)
+
+    events_by_line = {}
+    for event in production_events:
+        events_by_line.setdefault(event.production_line_id, []).append(event)
+
+    projected = {}
+
+    for line in production_lines:
+        line_orders = orders_by_line.get(line.id)
+        if not line_orders:
+            continue
+
+        result = simulate_line_orders(
+            line,
+            line_orders,
+            events_by_line.get(line.id, []),
+            today=today,
+            capacity_vector=capacity_vectors.get(line.id)
+        )
+
+        if isinstance(result, dict):
+            continue
+
+        for row in result:
+            projected[row["work_order_id"]] = row["estimated_finish_date"]
+
+    return projected
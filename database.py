@@ -1,12 +1,42 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite:///./mini_mes.db"
+DATABASE_URL = os.getenv("MES_DATABASE_URL", "sqlite:///./mini_mes.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+
+def make_engine(url):
+    if not url.startswith("sqlite"):
+        return create_engine(url)
+
+    bind = create_engine(url, connect_args={"check_same_thread": False})
+    install_sqlite_transactions(bind)
+    return bind
+
+
+def install_sqlite_transactions(bind):
+    # pysqlite 默认不在 SAVEPOINT 前发 BEGIN：begin_nested() 的 RELEASE 会单独提交，
+    # 外层 rollback 撤不回来（写入管道整批 = 一个事务 就不成立）。
+    # SQLAlchemy 的标准做法：驱动不管事务，BEGIN 由我们在事务开始时发。
+    #
+    # 读也在事务里了，所以开 WAL：读事务不挡写线程提交。
+    # 写事务用 execution_options(sqlite_begin="IMMEDIATE") 一开始就拿写锁，
+    # 免得“先读后写”升级锁时直接 SQLITE_BUSY。
+
+    @event.listens_for(bind, "connect")
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    @event.listens_for(bind, "begin")
+    def _begin(connection):
+        mode = connection.get_execution_options().get("sqlite_begin", "DEFERRED")
+        # 直接走 DBAPI：和 pysqlite 原来隐式的 BEGIN 一样，不算进请求的语句数
+        connection.connection.driver_connection.execute(f"BEGIN {mode}")
+
+
+engine = make_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -18,7 +48,10 @@ Base = declarative_base()
 
 
 def get_db():
-    db = SessionLocal()
+    # 多工厂：按请求所在工厂取 Session（见 plants.py）
+    from plants import current_plant
+
+    db = current_plant().SessionLocal()
     try:
         yield db
     finally:
@@ -0,0 +1,387 @@
+import re
+from datetime import date, timedelta
+
+from sqlalchemy import case, delete, insert, select, update
+
+from models import EventCauseRollup, EventDailyRollup, ProductionEvent
+
+
+# ==========================================================
+# Event Analytics（事件损失 / MTTR / Pareto：只读汇总表）
+# ==========================================================
+#
+# production_events 只在产能计算里被当成"未解决工时总和"；
+# 解决时长、按类型的损失都没有留下来。
+#
+# 两张汇总表，在事件新建 / 解决时增量更新（同一事务，写入管道单写者，无并发冲突）：
+#   event_daily_rollups  (产线, 类型, 发生日)  → 次数 / 损失工时 / 已解决数 / 修复总秒数
+#   event_cause_rollups  (产线, 类型, 原因)    → 同上 + 首次 / 最近发生日
+#
+# 报表只读汇总表（行数 ≈ 产线 × 类型 × 有事件的天数），不扫 production_events。
+# MTTR = 修复总秒数 / 已解决数，修复时长 = resolved_at - created_at，归到事件发生日。
+
+GRANULARITIES = ("day", "week", "month")
+UNSPECIFIED_CAUSE = "(unspecified)"
+CAUSE_MAX_LENGTH = 80
+MAX_TIMELINE_PERIODS = 3660     # 按天最多约 10 年
+
+
+def cause_key(description):
+    """Recurring causes are matched on the normalized description."""
+    text = re.sub(r"\s+", " ", (description or "").strip().lower())
+    return text[:CAUSE_MAX_LENGTH] or UNSPECIFIED_CAUSE
+
+
+def repair_seconds(event):
+    if event.resolved_at is None:
+        return 0.0
+    return max((event.resolved_at - event.created_at).total_seconds(), 0.0)
+
+
+# -------------------------------
+# 增量更新（建单 / 解决）
+# -------------------------------
+
+def _bump(db, model, keys, event_date, count, loss, resolved, seconds):
+
+    values = dict(
+        event_count=model.event_count + count,
+        loss_hours=model.loss_hours + loss,
+        resolved_count=model.resolved_count + resolved,
+        repair_seconds=model.repair_seconds + seconds,
+    )
+    if model is EventCauseRollup:
+        values.update(
+            first_date=case((model.first_date > event_date, event_date), else_=model.first_date),
+            last_date=case((model.last_date < event_date, event_date), else_=model.last_date),
+        )
+
+    result = db.execute(
+        update(model)
+        .where(*(getattr(model, name) == value for name, value in keys.items()))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount:
+        return
+
+    row = dict(keys, event_count=count, loss_hours=loss, resolved_count=resolved, repair_seconds=seconds)
+    if model is EventCauseRollup:
+        row.update(first_date=event_date, last_date=event_date)
+    db.execute(insert(model), [row])
+
+
+def _apply(db, event, count=0, loss=0.0, resolved=0, seconds=0.0):
+
+    _bump(
+        db, EventDailyRollup,
+        dict(
+            production_line_id=event.production_line_id,
+            event_type=event.event_type,
+            event_date=event.event_date,
+        ),
+        event.event_date, count, loss, resolved, seconds,
+    )
+    _bump(
+        db, EventCauseRollup,
+        dict(
+            production_line_id=event.production_line_id,
+            event_type=event.event_type,
+            cause=cause_key(event.description),
+        ),
+        event.event_date, count, loss, resolved, seconds,
+    )
+
+
+def record_event_created(db, event):
+    _apply(db, event, count=1, loss=event.impact_hours)
+
+
+def record_event_resolved(db, event):
+    _apply(db, event, resolved=1, seconds=repair_seconds(event))
+
+
+def rebuild_event_rollups(connection):
+    """Recompute both rollups from production_events (migration / repair)."""
+
+    connection.execute(delete(EventDailyRollup))
+    connection.execute(delete(EventCauseRollup))
+
+    daily = {}
+    causes = {}
+
+    for event in connection.execute(select(
+        ProductionEvent.production_line_id,
+        ProductionEvent.event_type,
+        ProductionEvent.event_date,
+        ProductionEvent.description,
+        ProductionEvent.impact_hours,
+        ProductionEvent.created_at,
+        ProductionEvent.resolved_at,
+    )):
+        seconds = repair_seconds(event)
+        resolved = 1 if event.resolved_at is not None else 0
+
+        for rows, key in (
+            (daily, (event.production_line_id, event.event_type, event.event_date)),
+            (causes, (event.production_line_id, event.event_type, cause_key(event.description))),
+        ):
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = dict(
+                    event_count=0, loss_hours=0.0, resolved_count=0, repair_seconds=0.0,
+                    first_date=event.event_date, last_date=event.event_date,
+                )
+            row["event_count"] += 1
+            row["loss_hours"] += event.impact_hours
+            row["resolved_count"] += resolved
+            row["repair_seconds"] += seconds
+            row["first_date"] = min(row["first_date"], event.event_date)
+            row["last_date"] = max(row["last_date"], event.event_date)
+
+    if daily:
+        connection.execute(insert(EventDailyRollup), [
+            dict(
+                production_line_id=line_id,
+                event_type=event_type,
+                event_date=event_date,
+                event_count=row["event_count"],
+                loss_hours=row["loss_hours"],
+                resolved_count=row["resolved_count"],
+                repair_seconds=row["repair_seconds"],
+            )
+            for (line_id, event_type, event_date), row in daily.items()
+        ])
+
+    if causes:
+        connection.execute(insert(EventCauseRollup), [
+            dict(row, production_line_id=line_id, event_type=event_type, cause=cause)
+            for (line_id, event_type, cause), row in causes.items()
+        ])
+
+
+# -------------------------------
+# 报表
+# -------------------------------
+
+def _metrics(count, loss, resolved, seconds):
+    return {
+        "event_count": count,
+        "loss_hours": round(loss, 2),
+        "resolved_count": resolved,
+        "mttr_hours": round(seconds / resolved / 3600, 2) if resolved else None,
+    }
+
+
+def _daily_rows(db, start=None, end=None, production_line_id=None, event_type=None):
+
+    query = select(
+        EventDailyRollup.production_line_id,
+        EventDailyRollup.event_type,
+        EventDailyRollup.event_date,
+        EventDailyRollup.event_count,
+        EventDailyRollup.loss_hours,
+        EventDailyRollup.resolved_count,
+        EventDailyRollup.repair_seconds,
+    )
+
+    if start is not None:
+        query = query.where(EventDailyRollup.event_date >= start)
+    if end is not None:
+        query = query.where(EventDailyRollup.event_date <= end)
+    if production_line_id is not None:
+        query = query.where(EventDailyRollup.production_line_id == production_line_id)
+    if event_type is not None:
+        query = query.where(EventDailyRollup.event_type == event_type)
+
+    return db.execute(query).all()
+
+
+def _accumulate(totals, key, row):
+    acc = totals.setdefault(key, [0, 0.0, 0, 0.0])
+    acc[0] += row.event_count
+    acc[1] += row.loss_hours
+    acc[2] += row.resolved_count
+    acc[3] += row.repair_seconds
+
+
+def event_summary(db, group_by="event_type", start=None, end=None, production_line_id=None):
+    """Loss hours and MTTR per event type, per line, or per (line, type)."""
+
+    key_of = {
+        "event_type": lambda row: (row.event_type,),
+        "production_line": lambda row: (row.production_line_id,),
+        "line_type": lambda row: (row.production_line_id, row.event_type),
+    }[group_by]
+
+    totals = {}
+    overall = {}
+    for row in _daily_rows(db, start, end, production_line_id):
+        _accumulate(totals, key_of(row), row)
+        _accumulate(overall, None, row)
+
+    names = {
+        "event_type": ("event_type",),
+        "production_line": ("production_line_id",),
+        "line_type": ("production_line_id", "event_type"),
+    }[group_by]
+
+    groups = [
+        dict(zip(names, key), **_metrics(*acc))
+        for key, acc in totals.items()
+    ]
+    groups.sort(key=lambda group: -group["loss_hours"])
+
+    return {
+        "start": start,
+        "end": end,
+        "group_by": group_by,
+        "total": _metrics(*overall.get(None, [0, 0.0, 0, 0.0])),
+        "groups": groups,
+    }
+
+
+def _pareto(items, metric):
+    items.sort(key=lambda item: -item[metric])
+    grand_total = sum(item[metric] for item in items)
+
+    running = 0
+    for item in items:
+        running += item[metric]
+        item["share"] = round(item[metric] / grand_total, 4) if grand_total else 0.0
+        item["cumulative_share"] = round(running / grand_total, 4) if grand_total else 0.0
+
+    return items
+
+
+def event_pareto(db, metric="loss_hours", start=None, end=None, production_line_id=None):
+    """Event types ranked by loss (or count) with cumulative share."""
+
+    totals = {}
+    for row in _daily_rows(db, start, end, production_line_id):
+        _accumulate(totals, row.event_type, row)
+
+    items = [dict(event_type=event_type, **_metrics(*acc)) for event_type, acc in totals.items()]
+
+    return {
+        "start": start,
+        "end": end,
+        "metric": metric,
+        "items": _pareto(items, metric),
+    }
+
+
+def top_causes(db, production_line_id=None, event_type=None, metric="event_count", limit=10):
+    """Recurring causes (all time), ranked by occurrences or loss."""
+
+    query = select(
+        EventCauseRollup.production_line_id,
+        EventCauseRollup.event_type,
+        EventCauseRollup.cause,
+        EventCauseRollup.event_count,
+        EventCauseRollup.loss_hours,
+        EventCauseRollup.resolved_count,
+        EventCauseRollup.repair_seconds,
+        EventCauseRollup.first_date,
+        EventCauseRollup.last_date,
+    )
+
+    if production_line_id is not None:
+        query = query.where(EventCauseRollup.production_line_id == production_line_id)
+    if event_type is not None:
+        query = query.where(EventCauseRollup.event_type == event_type)
+
+    # 跨产线的同一原因合并
+    totals = {}
+    seen = {}
+    for row in db.execute(query):
+        key = (row.event_type, row.cause)
+        _accumulate(totals, key, row)
+        first, last = seen.get(key, (row.first_date, row.last_date))
+        seen[key] = (min(first, row.first_date), max(last, row.last_date))
+
+    items = [
+        dict(
+            event_type=event_type,
+            cause=cause,
+            first_date=seen[(event_type, cause)][0],
+            last_date=seen[(event_type, cause)][1],
+            **_metrics(*acc),
+        )
+        for (event_type, cause), acc in totals.items()
+    ]
+
+    return {
+        "metric": metric,
+        "causes": _pareto(items, metric)[:max(limit, 0)],
+    }
+
+
+def _period_start(day, granularity):
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(start, granularity):
+    if granularity == "week":
+        return start + timedelta(days=7)
+    if granularity == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def loss_timeline(
+    db,
+    start,
+    end,
+    granularity="day",
+    rolling_periods=7,
+    production_line_id=None,
+    event_type=None,
+):
+    """Loss hours per period (by type) with a trailing rolling sum; empty periods are zero."""
+
+    by_period = {}
+    for row in _daily_rows(db, start, end, production_line_id, event_type):
+        period = _period_start(row.event_date, granularity)
+        entry = by_period.setdefault(period, {"event_count": 0, "loss_hours": 0.0, "by_type": {}})
+        entry["event_count"] += row.event_count
+        entry["loss_hours"] += row.loss_hours
+        entry["by_type"][row.event_type] = entry["by_type"].get(row.event_type, 0.0) + row.loss_hours
+
+    periods = []
+    window = []
+    period = _period_start(start, granularity)
+
+    while period <= end:
+        entry = by_period.get(period, {"event_count": 0, "loss_hours": 0.0, "by_type": {}})
+
+        window.append(entry["loss_hours"])
+        if len(window) > rolling_periods:
+            window.pop(0)
+
+        periods.append({
+            "period_start": period,
+            "event_count": entry["event_count"],
+            "loss_hours": round(entry["loss_hours"], 2),
+            "rolling_loss_hours": round(sum(window), 2),
+            "by_type": {name: round(hours, 2) for name, hours in entry["by_type"].items()},
+        })
+        period = _next_period(period, granularity)
+
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "rolling_periods": rolling_periods,
+        "periods": periods,
+    }
+
+
+def default_window(start, end, days=90):
+    end = end or date.today()
+    return start or end - timedelta(days=days - 1), end
@@ -0,0 +1,72 @@
+import json
+from datetime import date, datetime
+from enum import Enum
+
+from fastapi.responses import Response
+from sqlalchemy import select
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson 为可选依赖
+    orjson = None
+
+
+# ==========================================================
+# Fast JSON Response
+# ==========================================================
+#
+# 受信任的 DB 行直接按列编码，跳过 Pydantic 逐行 from_attributes 校验。
+# 有 orjson 用 orjson，没有则退回标准库 json（功能一致，只是慢）。
+# 端点仍保留 response_model 以生成 OpenAPI 文档；
+# 返回 Response 对象时 FastAPI 不再做二次序列化。
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+        return json.dumps(
+            content,
+            default=_json_default,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# ==========================================================
+# Column → dict
+# ==========================================================
+
+def schema_columns(model, schema):
+    """ORM columns matching the response schema's fields, in field order."""
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+def fetch_dicts(db, query):
+    result = db.execute(query)
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def list_response(db, model, schema, *criteria, order_by=None):
+
+    query = select(*schema_columns(model, schema))
+
+    if criteria:
+        query = query.where(*criteria)
+
+    if order_by is not None:
+        query = query.order_by(order_by)
+
+    return FastJSONResponse(fetch_dicts(db, query))
@@ -0,0 +1,615 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from line_calendar import capacity_window_start, load_capacity_vectors
+from models import ScheduleLineState, ScheduleOrder, ScheduleRun, ScheduleSlot
+from plant_simulation import EPSILON, LineClock, build_chain, day_of, run_chains
+from plants import PlantLocal
+from projections import (
+    load_operation_rows,
+    load_production_event_rows,
+    load_production_line_rows,
+    load_work_order_rows,
+)
+from queue_engine import dispatch_key
+
+
+# ==========================================================
+# Finite Scheduler（有限产能排程：哪张工单 / 哪道工序 / 哪条线 / 哪天几点）
+# ==========================================================
+#
+# 在 plant_simulation 的事件循环上排程（同一套工序链 + 产线日历时钟），另外考虑：
+#   产能   日历向量扣掉未解决事件工时（从事件发生日往后扣）
+#   物料   未齐套：有齐套日 → 当天起才能开工；没有 → WAITING_MATERIAL，不排
+#   优先级 权重 HIGH 3 / NORMAL 2 / LOW 1
+# 目标：加权拖期 Σ 权重 × max(完工 - 承诺日结束, 0) 最小。
+#
+# 解 = 每个产线组内工单的先后顺序（rank）；按顺序做非延迟派工解码成时间。
+#   构造：派工队列顺序 / 交期顺序，取较好的
+#   改进：局部搜索（把拖期工单往前插 / 相邻交换），只接受变好的，直到 time_budget_ms 用完
+#
+# 产线组 = 被同一工单的工序串起来的产线（连通分量），组与组之间互不影响。
+# 每条产线存一份输入哈希（产线配置 / 日历版本 / 事件 / 涉及的工单行与工序 / 今天）：
+#   FULL    全部重排，从头构造
+#   REPAIR  只重排哈希变化的组，以上一版 rank 为起点（新工单按交期插入），其余组原样保留
+# 报工 / 事件 / 建单后由 schedule_repair 任务触发修复（jobs.py）。
+#
+# 时段：一道工序在一天里占的一段（跨天拆段）；每天从 MES_SCHEDULE_DAY_START_HOUR 点起
+# 连续排当天的有效工时（班次只有工时没有起止时刻）。
+
+PRIORITY_WEIGHT = {"HIGH": 3.0, "NORMAL": 2.0, "LOW": 1.0}
+
+TIME_BUDGET_MS = int(os.getenv("MES_SCHEDULE_TIME_BUDGET_MS", "2000"))
+MAX_TIME_BUDGET_MS = 60000
+DAY_START_HOUR = float(os.getenv("MES_SCHEDULE_DAY_START_HOUR", "8"))
+
+STALE_MOVES = 200           # 一个组连续这么多次没改进 → 不再搜索
+SEARCH_SEED = 20240601      # 固定种子：同样输入 + 同样预算 → 同样结果（时间不够时除外）
+
+SCHEDULED = "SCHEDULED"
+WAITING_MATERIAL = "WAITING_MATERIAL"
+BLOCKED = "BLOCKED"
+NO_CAPACITY = "NO_CAPACITY"
+
+
+@dataclass(slots=True)
+class Job:
+    wo: object
+    chain: list
+    weight: float
+    release: float
+    due: float
+
+
+@dataclass(slots=True)
+class Component:
+    lines: set
+    jobs: list = field(default_factory=list)
+    waiting: list = field(default_factory=list)     # [(wo, status)]
+    dirty: bool = True
+    order: list = None
+    objective: float = 0.0
+    starts: list = None
+    finishes: list = None
+    completion: list = None
+    stale: int = 0
+
+
+def _digest(*parts):
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def weight_of(wo):
+    return PRIORITY_WEIGHT.get(wo.priority, PRIORITY_WEIGHT["NORMAL"])
+
+
+def deduct_events(vector, events, start):
+    """Capacity vector minus unresolved event hours, taken from the event day onwards."""
+
+    vector = list(vector)
+    for event in sorted(events, key=lambda e: (e.event_date, e.id)):
+        lost = event.impact_hours
+        day = max((event.event_date - start).days, 0)
+        while lost > EPSILON and day < len(vector):
+            taken = min(vector[day], lost)
+            vector[day] -= taken
+            lost -= taken
+            day += 1
+    return vector
+
+
+# -------------------------------
+# 问题构建
+# -------------------------------
+
+def _status(wo, chain, clocks):
+    if str(wo.status) == "BLOCKED":
+        return BLOCKED
+    if not wo.is_material_ready and wo.material_ready_date is None:
+        return WAITING_MATERIAL
+    if any(line_id not in clocks or clocks[line_id].rate <= 0 for line_id, *_ in chain):
+        return NO_CAPACITY
+    return SCHEDULED
+
+
+def _signature(wo, chain):
+    return (
+        wo.id,
+        wo.remaining_hours,
+        wo.actual_hours,
+        str(wo.status),
+        wo.is_material_ready,
+        wo.material_ready_date,
+        wo.priority,
+        wo.promise_date,
+        tuple((line_id, round(hours, 6), sequence) for line_id, hours, sequence, _ in chain),
+    )
+
+
+def build_problem(lines, work_orders, operations, events, vectors, today):
+    """Clocks, connected line groups with their jobs, and one inputs hash per line."""
+
+    start = capacity_window_start(today)
+
+    events_by_line = {}
+    for event in events:
+        events_by_line.setdefault(event.production_line_id, []).append(event)
+
+    clocks = {
+        line.id: LineClock(
+            deduct_events(vectors.get(line.id) or (), events_by_line.get(line.id, ()), start),
+            line.working_hours_per_day * line.efficiency_rate,
+        )
+        for line in lines
+    }
+
+    # 并查集：同一工单的工序把产线连成一组
+    parent = {line.id: line.id for line in lines}
+
+    def find(line_id):
+        parent.setdefault(line_id, line_id)
+        while parent[line_id] != line_id:
+            parent[line_id] = parent[parent[line_id]]
+            line_id = parent[line_id]
+        return line_id
+
+    entries = []
+    signatures = {}
+    for wo in work_orders:
+        if wo.status == "DONE":
+            continue
+
+        chain = build_chain(wo, operations.get(wo.id))
+        status = _status(wo, chain, clocks)
+        entries.append((wo, chain, status))
+
+        signature = _signature(wo, chain)
+        chain_lines = {line_id for line_id, *_ in chain}
+        for line_id in chain_lines:
+            signatures.setdefault(line_id, []).append(signature)
+
+        if status == SCHEDULED:
+            first, *rest = chain_lines
+            for line_id in rest:
+                parent[find(line_id)] = find(first)
+
+    components = {}
+    for line_id in list(parent):
+        components.setdefault(find(line_id), Component(lines=set())).lines.add(line_id)
+
+    for wo, chain, status in entries:
+        component = components[find(chain[0][0])]
+        if status != SCHEDULED:
+            component.waiting.append((wo, status))
+            continue
+
+        release = 0.0
+        if not wo.is_material_ready:
+            release = float(max((wo.material_ready_date - start).days, 0))
+
+        component.jobs.append(Job(
+            wo=wo,
+            chain=chain,
+            weight=weight_of(wo),
+            release=release,
+            due=float((wo.promise_date - start).days + 1),
+        ))
+
+    lines_by_id = {line.id: line for line in lines}
+    line_hashes = {
+        line_id: _digest(
+            today,
+            line_id,
+            (line.working_hours_per_day, line.efficiency_rate, line.calendar_version)
+            if (line := lines_by_id.get(line_id)) else None,
+            sorted((e.id, e.impact_hours, e.event_date) for e in events_by_line.get(line_id, ())),
+            sorted(signatures.get(line_id, ())),
+        )
+        for line_id in parent
+    }
+
+    return start, clocks, list(components.values()), line_hashes
+
+
+# -------------------------------
+# 求解
+# -------------------------------
+
+def _decode(component, clocks, order):
+    jobs = component.jobs
+
+    keys = [0] * len(jobs)
+    for position, index in enumerate(order):
+        keys[index] = position
+
+    starts, finishes, _, _ = run_chains(
+        [job.chain for job in jobs],
+        keys,
+        clocks,
+        [job.release for job in jobs],
+    )
+
+    completion = [max(times) for times in finishes]
+    objective = sum(
+        job.weight * max(completion[i] - job.due, 0.0)
+        for i, job in enumerate(jobs)
+    )
+    return objective, starts, finishes, completion
+
+
+def _accept(component, order, decoded):
+    component.order = order
+    component.objective, component.starts, component.finishes, component.completion = decoded
+
+
+def _construct(component, clocks):
+    """Better of dispatch-queue order and due-date order."""
+
+    jobs = component.jobs
+    candidates = [
+        sorted(range(len(jobs)), key=lambda i: dispatch_key(jobs[i].wo)),
+        sorted(range(len(jobs)), key=lambda i: (jobs[i].due, -jobs[i].weight, dispatch_key(jobs[i].wo))),
+    ]
+
+    best = None
+    for order in candidates:
+        decoded = _decode(component, clocks, order)
+        if best is None or decoded[0] < best[1][0] - EPSILON:
+            best = (order, decoded)
+
+    _accept(component, *best)
+
+
+def _warm_start(component, clocks, ranks):
+    """Previous order; new work orders go in by due date."""
+
+    jobs = component.jobs
+    known = sorted(
+        (i for i, job in enumerate(jobs) if ranks.get(job.wo.id) is not None),
+        key=lambda i: ranks[jobs[i].wo.id],
+    )
+    new = sorted(
+        (i for i, job in enumerate(jobs) if ranks.get(job.wo.id) is None),
+        key=lambda i: (jobs[i].due, -jobs[i].weight, dispatch_key(jobs[i].wo)),
+    )
+
+    order = known
+    for index in new:
+        due = jobs[index].due
+        position = next((p for p, j in enumerate(order) if jobs[j].due > due), len(order))
+        order.insert(position, index)
+
+    _accept(component, order, _decode(component, clocks, order))
+
+
+def _neighbour(component, rng):
+    order = list(component.order)
+    jobs = component.jobs
+    size = len(order)
+
+    tardy = [
+        (position, jobs[index].weight * (component.completion[index] - jobs[index].due))
+        for position, index in enumerate(order)
+        if position and component.completion[index] > jobs[index].due + EPSILON
+    ]
+
+    if tardy and rng.random() < 0.8:
+        # 拖期工单往前插（按加权拖期抽样）
+        position = rng.choices([p for p, _ in tardy], weights=[w for _, w in tardy])[0]
+        span = max(4, size // 10)
+        target = rng.randrange(max(0, position - span), position)
+        order.insert(target, order.pop(position))
+    else:
+        position = rng.randrange(size - 1)
+        order[position], order[position + 1] = order[position + 1], order[position]
+
+    return order
+
+
+def solve(components, clocks, ranks, mode, time_budget_ms):
+    """Construct (FULL) or warm-start (REPAIR) dirty groups, then improve them until the budget runs out."""
+
+    started = time.perf_counter()
+    deadline = started + time_budget_ms / 1000
+    rng = random.Random(SEARCH_SEED)
+
+    dirty = [component for component in components if component.dirty]
+
+    for component in dirty:
+        if not component.jobs:
+            component.order = []
+            component.completion = []
+        elif mode == "FULL":
+            _construct(component, clocks)
+        else:
+            _warm_start(component, clocks, ranks)
+
+    iterations = 0
+    active = [c for c in dirty if len(c.jobs) > 1 and c.objective > EPSILON]
+
+    while active and time.perf_counter() < deadline:
+        for component in list(active):
+            if time.perf_counter() >= deadline:
+                break
+
+            order = _neighbour(component, rng)
+            decoded = _decode(component, clocks, order)
+            iterations += 1
+
+            if decoded[0] < component.objective - EPSILON:
+                _accept(component, order, decoded)
+                component.stale = 0
+            else:
+                component.stale += 1
+
+            if component.objective <= EPSILON or component.stale >= STALE_MOVES:
+                active.remove(component)
+
+    return {
+        "iterations": iterations,
+        "components_solved": len(dirty),
+        "elapsed_ms": int((time.perf_counter() - started) * 1000),
+    }
+
+
+# -------------------------------
+# 时段
+# -------------------------------
+
+def _day_segments(clock, work_from, work_to):
+    """[(day, hours into the day, hours)] covering capacity hours work_from..work_to."""
+
+    if clock.horizon and work_from < clock.cumulative[-1]:
+        day = bisect_right(clock.cumulative, work_from + EPSILON)
+    else:
+        done = clock.cumulative[-1] if clock.horizon else 0.0
+        day = clock.horizon + int((work_from - done) / clock.rate)
+
+    segments = []
+    while work_from < work_to - EPSILON:
+        day_start = clock.work_at(day)
+        day_end = clock.work_at(day + 1)
+        if day_end > work_from + EPSILON:
+            taken_to = min(work_to, day_end)
+            segments.append((day, max(work_from - day_start, 0.0), taken_to - work_from))
+            work_from = taken_to
+        day += 1
+
+    return segments
+
+
+def _slot_start(start, day, offset_hours):
+    midnight = datetime.combine(start + timedelta(days=day), datetime.min.time())
+    return midnight + timedelta(hours=DAY_START_HOUR + offset_hours)
+
+
+def _rows(component, clocks, start, today, run_id):
+
+    orders = []
+    slots = []
+
+    for position, index in enumerate(component.order):
+        job = component.jobs[index]
+        wo = job.wo
+        job_slots = []
+
+        for op_index, (line_id, hours, sequence, name) in enumerate(job.chain):
+            if hours <= EPSILON:
+                continue
+
+            clock = clocks[line_id]
+            work_to = clock.work_at(component.finishes[index][op_index])
+
+            for day, offset, slot_hours in _day_segments(clock, work_to - hours, work_to):
+                slot_start = _slot_start(start, day, offset)
+                job_slots.append(dict(
+                    work_order_id=wo.id,
+                    sequence=sequence,
+                    operation_name=name,
+                    production_line_id=line_id,
+                    slot_date=start + timedelta(days=day),
+                    start_at=slot_start,
+                    end_at=slot_start + timedelta(hours=slot_hours),
+                    hours=slot_hours,
+                    run_id=run_id,
+                ))
+
+        finish_date = day_of(component.completion[index], today)
+
+        orders.append(dict(
+            work_order_id=wo.id,
+            status=SCHEDULED,
+            rank=float(position),
+            weight=job.weight,
+            start_at=job_slots[0]["start_at"] if job_slots else None,
+            finish_at=job_slots[-1]["end_at"] if job_slots else None,
+            tardiness_days=max((finish_date - wo.promise_date).days, 0),
+            run_id=run_id,
+        ))
+        slots.extend(job_slots)
+
+    for wo, status in component.waiting:
+        orders.append(dict(
+            work_order_id=wo.id,
+            status=status,
+            rank=None,
+            weight=weight_of(wo),
+            start_at=None,
+            finish_at=None,
+            tardiness_days=None,
+            run_id=run_id,
+        ))
+
+    return orders, slots
+
+
+# -------------------------------
+# 入口：plan（只读）→ save（写入管道里 flush）
+# -------------------------------
+
+@dataclass
+class SchedulePlan:
+    mode: str
+    reason: str
+    as_of: date
+    time_budget_ms: int
+    stats: dict
+    start: date
+    clocks: dict
+    components: list
+    line_hashes: dict
+    stored: dict            # {work_order_id: (weight, tardiness_days, status)}
+
+
+_solve_locks = PlantLocal(threading.Lock)
+
+
+def has_schedule(db):
+    return db.execute(select(ScheduleRun.id).limit(1)).first() is not None
+
+
+def plan_schedule(db, mode="FULL", time_budget_ms=None, reason=None, today=None):
+    """Load inputs and solve; nothing is written (see save_schedule)."""
+
+    today = today or date.today()
+    time_budget_ms = min(max(TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms, 0), MAX_TIME_BUDGET_MS)
+
+    lines = load_production_line_rows(db)
+    work_orders = load_work_order_rows(db)
+    operations = load_operation_rows(db)
+    events = load_production_event_rows(db)
+    vectors = load_capacity_vectors(db, lines, capacity_window_start(today))
+
+    stored = {}
+    ranks = {}
+    for wo_id, rank, weight, tardiness, status in db.execute(select(
+        ScheduleOrder.work_order_id,
+        ScheduleOrder.rank,
+        ScheduleOrder.weight,
+        ScheduleOrder.tardiness_days,
+        ScheduleOrder.status,
+    )):
+        ranks[wo_id] = rank
+        stored[wo_id] = (weight, tardiness, status)
+
+    if mode == "REPAIR" and not stored and not has_schedule(db):
+        mode = "FULL"
+
+    start, clocks, components, line_hashes = build_problem(lines, work_orders, operations, events, vectors, today)
+
+    if mode == "REPAIR":
+        previous = dict(db.execute(
+            select(ScheduleLineState.production_line_id, ScheduleLineState.inputs_hash)
+        ).all())
+        for component in components:
+            component.dirty = any(previous.get(line_id) != line_hashes[line_id] for line_id in component.lines)
+
+    with _solve_locks.instance():
+        stats = solve(components, clocks, ranks, mode, time_budget_ms)
+
+    return SchedulePlan(
+        mode=mode,
+        reason=reason,
+        as_of=today,
+        time_budget_ms=time_budget_ms,
+        stats=stats,
+        start=start,
+        clocks=clocks,
+        components=components,
+        line_hashes=line_hashes,
+        stored=stored,
+    )
+
+
+def save_schedule(db, plan):
+    """Replace the rows of re-solved groups; untouched groups keep their slots."""
+
+    run = ScheduleRun(
+        mode=plan.mode,
+        reason=plan.reason,
+        as_of=plan.as_of,
+        time_budget_ms=plan.time_budget_ms,
+        **plan.stats,
+    )
+    db.add(run)
+    db.flush()
+
+    dirty = [component for component in plan.components if component.dirty]
+
+    orders = []
+    slots = []
+    for component in dirty:
+        component_orders, component_slots = _rows(component, plan.clocks, plan.start, plan.as_of, run.id)
+        orders.extend(component_orders)
+        slots.extend(component_slots)
+
+    dirty_lines = [line_id for component in dirty for line_id in component.lines]
+    current_ids = {
+        wo.id
+        for component in plan.components
+        for wo in [job.wo for job in component.jobs] + [wo for wo, _ in component.waiting]
+    }
+    removed_ids = [row["work_order_id"] for row in orders] + [
+        wo_id for wo_id in plan.stored if wo_id not in current_ids
+    ]
+
+    if plan.mode == "FULL":
+        db.execute(delete(ScheduleSlot))
+        db.execute(delete(ScheduleOrder))
+        db.execute(delete(ScheduleLineState))
+    else:
+        if dirty_lines:
+            db.execute(delete(ScheduleSlot).where(ScheduleSlot.production_line_id.in_(dirty_lines)))
+            db.execute(delete(ScheduleLineState).where(ScheduleLineState.production_line_id.in_(dirty_lines)))
+        if removed_ids:
+            db.execute(delete(ScheduleOrder).where(ScheduleOrder.work_order_id.in_(removed_ids)))
+
+    # Core executemany：rank / 起止时间 / 工序名有 NULL，ORM 批量插入会按 NULL 模式拆成多条语句
+    if orders:
+        db.execute(ScheduleOrder.__table__.insert(), orders)
+    if slots:
+        db.execute(ScheduleSlot.__table__.insert(), slots)
+    if dirty_lines:
+        db.execute(ScheduleLineState.__table__.insert(), [
+            dict(production_line_id=line_id, inputs_hash=plan.line_hashes[line_id], run_id=run.id)
+            for line_id in dirty_lines
+        ])
+
+    # 汇总：重排的组用新结果，其余沿用已存的
+    totals = {wo_id: (weight, tardiness, status) for wo_id, (weight, tardiness, status) in plan.stored.items()}
+    for wo_id in removed_ids:
+        totals.pop(wo_id, None)
+    for row in orders:
+        totals[row["work_order_id"]] = (row["weight"], row["tardiness_days"], row["status"])
+
+    run.weighted_tardiness = sum(weight * (tardiness or 0) for weight, tardiness, _ in totals.values())
+    run.late_work_orders = sum(1 for _, tardiness, _ in totals.values() if tardiness)
+    run.scheduled_work_orders = sum(1 for _, _, status in totals.values() if status == SCHEDULED)
+    run.unscheduled_work_orders = len(totals) - run.scheduled_work_orders
+    db.flush()
+
+    return run
+
+
+# -------------------------------
+# 查询
+# -------------------------------
+
+def current_run(db):
+    return db.execute(
+        select(ScheduleRun).order_by(ScheduleRun.id.desc()).limit(1)
+    ).scalar_one_or_none()
+
+
+def schedule_counts(db):
+    return dict(db.execute(
+        select(ScheduleOrder.status, func.count()).group_by(ScheduleOrder.status)
+    ).all())
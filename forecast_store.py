@@ -0,0 +1,315 @@
+import hashlib
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import delete, select
+
+from batch_risk_engine import (
+    CONSTRAINT_TYPES,
+    RISK_LEVELS,
+    build_risk_columns,
+    score_risk_columns,
+)
+from capacity_engine import simulate_line_orders
+from line_calendar import capacity_window_start, load_capacity_vectors
+from models import WorkOrder, WorkOrderForecast, WorkOrderForecastHistory
+from progress_series import record_forecast_progress
+from queue_engine import dispatch_key
+from projections import (
+    load_production_event_rows,
+    load_production_line_rows,
+    load_work_order_rows,
+)
+from write_pipeline import write_pipeline
+
+
+# ==========================================================
+# Forecast Store（交期 + 风险结果持久化，只重算输入变化的工单）
+# ==========================================================
+#
+# 一个工单的预测只取决于：
+#   1. 自身行（剩余工时 / 状态 / 优先级 / 承诺日 / 物料 / 标志位）
+#   2. 同产线队列中排在它前面的工单
+#   3. 产线配置（含 calendar_version）+ 未解决事件 + 今天的日期
+#
+# 按队列顺序做链式哈希：h_i = H(h_{i-1}, row_i)，h_0 = H(产线)。
+# 哈希没变 → 结果不变 → 跳过；整条产线都没变 → 连仿真都不跑。
+#
+# plan（只读：仿真 + 评分）在调用方线程；save 经写入管道提交（单写者，不再另外抢写锁）。
+
+
+def _digest(*parts):
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _row_key(wo):
+    return (
+        wo.id,
+        wo.remaining_hours,
+        str(wo.status),
+        wo.is_material_ready,
+        wo.priority,
+        wo.promise_date,
+        wo.is_npi,
+        wo.engineering_hold,
+    )
+
+
+def line_inputs_hash(line, events, today):
+    return _digest(
+        line.id,
+        line.working_hours_per_day,
+        line.efficiency_rate,
+        line.calendar_version,
+        tuple(sorted((e.id, e.impact_hours) for e in events)),
+        today.toordinal(),
+    )
+
+
+def queue_order(work_orders):
+    """Same order simulate_line_orders uses."""
+    return sorted(work_orders, key=dispatch_key)
+
+
+def compute_inputs_hashes(line, work_orders, events, today):
+
+    line_hash = line_inputs_hash(line, events, today)
+    hashes = {}
+
+    chain = line_hash
+    for wo in queue_order(work_orders):
+        if wo.is_material_ready:
+            chain = _digest(chain, _row_key(wo))
+            hashes[wo.id] = chain
+        else:
+            # 不进仿真队列：只取决于自身 + 产线
+            hashes[wo.id] = _digest(line_hash, _row_key(wo))
+
+    return hashes
+
+
+# ==========================================================
+# Refresh
+# ==========================================================
+
+@dataclass
+class ForecastRefresh:
+    today: date
+    open_work_orders: int
+    changed_orders: list
+    rows: list
+    removed_ids: list
+    skipped_lines: int
+
+
+def plan_forecast_refresh(db, today=None):
+    """Read inputs, re-simulate changed lines and score changed orders; nothing is written."""
+
+    today = today or date.today()
+
+    lines = load_production_line_rows(db)
+    work_orders = sorted(load_work_order_rows(db), key=lambda wo: wo.id)
+    events = load_production_event_rows(db)
+
+    stored = dict(db.execute(
+        select(WorkOrderForecast.work_order_id, WorkOrderForecast.inputs_hash)
+    ).all())
+
+    orders_by_line = {}
+    for wo in work_orders:
+        orders_by_line.setdefault(wo.production_line_id, []).append(wo)
+
+    events_by_line = {}
+    for event in events:
+        events_by_line.setdefault(event.production_line_id, []).append(event)
+
+    changed_orders = []
+    changed_hashes = {}
+    projected = {}
+    skipped_lines = 0
+    capacity_vectors = None
+
+    for line in lines:
+        line_orders = orders_by_line.get(line.id)
+        if not line_orders:
+            continue
+
+        line_events = events_by_line.get(line.id, [])
+        hashes = compute_inputs_hashes(line, line_orders, line_events, today)
+
+        changed = [wo for wo in line_orders if stored.get(wo.id) != hashes[wo.id]]
+        if not changed:
+            skipped_lines += 1
+            continue
+
+        if capacity_vectors is None:
+            capacity_vectors = load_capacity_vectors(db, lines, capacity_window_start(today))
+
+        result = simulate_line_orders(
+            line,
+            line_orders,
+            line_events,
+            today=today,
+            capacity_vector=capacity_vectors[line.id]
+        )
+        if not isinstance(result, dict):
+            for row in result:
+                projected[row["work_order_id"]] = row["estimated_finish_date"]
+
+        changed_orders.extend(changed)
+        for wo in changed:
+            changed_hashes[wo.id] = hashes[wo.id]
+
+    open_ids = {wo.id for wo in work_orders}
+    removed_ids = [wo_id for wo_id in stored if wo_id not in open_ids]
+
+    rows = []
+    if changed_orders:
+        scores = score_risk_columns(
+            build_risk_columns(changed_orders, projected),
+            today=today
+        )
+
+        for i, wo in enumerate(changed_orders):
+            rows.append(dict(
+                work_order_id=wo.id,
+                production_line_id=wo.production_line_id,
+                inputs_hash=changed_hashes[wo.id],
+                estimated_finish_date=projected.get(wo.id),
+                delay_days=scores["delay_days"][i],
+                risk_level=RISK_LEVELS[scores["risk_level"][i]],
+                primary_constraint_type=CONSTRAINT_TYPES[scores["constraint"][i]],
+            ))
+
+    return ForecastRefresh(
+        today=today,
+        open_work_orders=len(work_orders),
+        changed_orders=changed_orders,
+        rows=rows,
+        removed_ids=removed_ids,
+        skipped_lines=skipped_lines,
+    )
+
+
+def save_forecast_refresh(db, plan):
+    """Write a planned refresh; no commit (runs inside the write pipeline)."""
+
+    today = plan.today
+    now = datetime.utcnow()
+    rows = plan.rows
+
+    if rows:
+        changed_ids = [row["work_order_id"] for row in rows]
+
+        db.execute(
+            delete(WorkOrderForecast)
+            .where(WorkOrderForecast.work_order_id.in_(changed_ids))
+        )
+
+        # Core executemany：ORM 批量插入遇到 NULL / 非 NULL 交替（未齐套没有完工日）会拆成很多条语句
+        db.execute(WorkOrderForecast.__table__.insert(), [dict(row, computed_at=now) for row in rows])
+
+        # 历史：每个工单每天一行（同一天再次变化则覆盖）
+        db.execute(
+            delete(WorkOrderForecastHistory)
+            .where(WorkOrderForecastHistory.work_order_id.in_(changed_ids))
+            .where(WorkOrderForecastHistory.snapshot_date == today)
+        )
+        db.execute(WorkOrderForecastHistory.__table__.insert(), [
+            dict(
+                work_order_id=row["work_order_id"],
+                snapshot_date=today,
+                inputs_hash=row["inputs_hash"],
+                estimated_finish_date=row["estimated_finish_date"],
+                delay_days=row["delay_days"],
+                risk_level=row["risk_level"],
+                primary_constraint_type=row["primary_constraint_type"],
+                created_at=now,
+            )
+            for row in rows
+        ])
+
+        record_forecast_progress(db, plan.changed_orders, {
+            row["work_order_id"]: (row["estimated_finish_date"], row["delay_days"])
+            for row in rows
+        }, today)
+
+    if plan.removed_ids:
+        db.execute(
+            delete(WorkOrderForecast)
+            .where(WorkOrderForecast.work_order_id.in_(plan.removed_ids))
+        )
+
+    return {
+        "as_of": today,
+        "open_work_orders": plan.open_work_orders,
+        "recomputed": len(plan.changed_orders),
+        "unchanged": plan.open_work_orders - len(plan.changed_orders),
+        "removed": len(plan.removed_ids),
+        "skipped_lines": plan.skipped_lines,
+    }
+
+
+def refresh_forecasts(db, today=None):
+    """Plan on db (read only), then save through the write pipeline."""
+
+    plan = plan_forecast_refresh(db, today)
+    db.rollback()       # 结束读事务，不挡写线程
+
+    return write_pipeline.submit(
+        lambda session: save_forecast_refresh(session, plan),
+        label="forecast_refresh"
+    )
+
+
+# ==========================================================
+# Forecast Accuracy（90 天目标：误差 ≤ ±1 天）
+# ==========================================================
+
+def forecast_accuracy(db, lead_days=0, tolerance_days=1):
+    """
+    For every completed work order, take the latest snapshot made at
+    least `lead_days` before completion and compare its estimated
+    finish date with the actual completion date.
+    """
+    rows = db.execute(
+        select(
+            WorkOrderForecastHistory.work_order_id,
+            WorkOrderForecastHistory.snapshot_date,
+            WorkOrderForecastHistory.estimated_finish_date,
+            WorkOrder.completed_at,
+        )
+        .join(WorkOrder, WorkOrder.id == WorkOrderForecastHistory.work_order_id)
+        .where(WorkOrder.completed_at.is_not(None))
+        .where(WorkOrderForecastHistory.estimated_finish_date.is_not(None))
+        .order_by(
+            WorkOrderForecastHistory.work_order_id,
+            WorkOrderForecastHistory.snapshot_date,
+        )
+    ).all()
+
+    chosen = {}
+    for work_order_id, snapshot_date, estimated, completed_at in rows:
+        completed = completed_at.date()
+        if (completed - snapshot_date).days >= lead_days:
+            chosen[work_order_id] = (estimated - completed).days
+
+    errors = list(chosen.values())
+
+    if not errors:
+        return {
+            "lead_days": lead_days,
+            "tolerance_days": tolerance_days,
+            "measured_orders": 0,
+        }
+
+    within = sum(1 for e in errors if abs(e) <= tolerance_days)
+
+    return {
+        "lead_days": lead_days,
+        "tolerance_days": tolerance_days,
+        "measured_orders": len(errors),
+        "within_tolerance_pct": round(100 * within / len(errors), 1),
+        "mean_abs_error_days": round(sum(abs(e) for e in errors) / len(errors), 2),
+        "mean_bias_days": round(sum(errors) / len(errors), 2),
+    }
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from fast_json import FastJSONResponse
+from models import ProductionLog
+from plants import PlantLocal
+
+
+# ==========================================================
+# Idempotent Production Log（终端断网重试去重）
+# ==========================================================
+#
+# 客户端带 Idempotency-Key（请求头或 body.idempotency_key）：
+#   1. 先查本进程最近 key 缓存 → 命中直接重放，不碰数据库
+#   2. 未命中 → 正常执行；key 写进 production_logs（唯一索引）
+#   3. 唯一索引冲突 / 业务校验失败 → 按 key 查一次库，有则重放首次结果
+#
+# 正常路径不多一次查询：去重靠唯一索引，而不是先查后写。
+# 同一个 key 配不同的请求体 → 409。
+
+CACHE_SIZE = int(os.getenv("MES_IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+REPLAY_HEADER = "Idempotent-Replay"
+
+
+class StoredResult:
+
+    __slots__ = ("request_hash", "response")
+
+    def __init__(self, request_hash, response):
+        self.request_hash = request_hash
+        self.response = response
+
+
+class RecentKeyCache:
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is not None:
+                self._entries.move_to_end(key)
+            return stored
+
+    def put(self, key, stored):
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+recent_keys = PlantLocal(RecentKeyCache)
+
+
+def request_hash(payload):
+    body = payload.model_dump_json(exclude={"idempotency_key"})
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def snapshot(response):
+    return json.dumps(response, default=str, separators=(",", ":"))
+
+
+def find_stored_result(db, key):
+    row = db.execute(
+        select(ProductionLog.request_hash, ProductionLog.response_snapshot)
+        .where(ProductionLog.idempotency_key == key)
+    ).first()
+
+    if row is None or row.response_snapshot is None:
+        return None
+
+    stored = StoredResult(row.request_hash, json.loads(row.response_snapshot))
+    recent_keys.put(key, stored)
+    return stored
+
+
+def replay(stored, expected_hash):
+    if stored.request_hash != expected_hash:
+        raise HTTPException(
+            status_code=409,
+            detail="Idempotency key already used for a different request"
+        )
+
+    return FastJSONResponse(stored.response, headers={REPLAY_HEADER: "true"})
@@ -0,0 +1,618 @@
+import functools
+import inspect
+import itertools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger("mini_mes.instrumentation")
+
+
+# ==========================================================
+# Metrics Registry (Prometheus text format)
+# ==========================================================
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, labels=None, value=1.0):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def set(self, name, labels=None, value=0.0):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, labels=None, value=0.0, buckets=DURATION_BUCKETS):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {
+                    "buckets": buckets,
+                    "counts": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+                self._histograms[key] = histogram
+
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(
+                (key, dict(value, counts=list(value["counts"])))
+                for key, value in self._histograms.items()
+            )
+
+        lines = []
+        seen = set()
+
+        def header(name, metric_type):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                bucket_labels = labels + (("le", str(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{_format_labels(inf_labels)} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    )
+    return "{" + body + "}"
+
+
+metrics = MetricsRegistry()
+
+metrics.describe("mes_requests_total", "HTTP requests by route, method and status")
+metrics.describe("mes_request_duration_seconds", "End-to-end request latency")
+metrics.describe("mes_request_phase_seconds_total", "Request time split by phase")
+metrics.describe("mes_db_queries_total", "SQL statements executed, by route")
+metrics.describe("mes_db_query_seconds_total", "Time spent in SQL, by route")
+metrics.describe("mes_db_queries_per_request", "SQL statements per request (N+1 detector)")
+
+
+# ==========================================================
+# Per-Request Stats
+# ==========================================================
+
+class RequestStats:
+
+    def __init__(self, method):
+        self.method = method
+        self.route = None
+        self.status_code = 500
+        self.started = time.perf_counter()
+        self.total_seconds = 0.0
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.phases = defaultdict(float)
+        self.samples = None
+
+    def finish(self, status_code):
+        self.status_code = status_code
+        self.total_seconds = time.perf_counter() - self.started
+
+    def breakdown(self):
+        """
+        Phase split of the request.
+
+        handler   = endpoint body (SQL + ORM + engines)
+        sql       = cursor execute time
+        engine    = phase("engine") blocks
+        write_queue = waiting for the write pipeline (group commit)
+        orm       = handler - sql - engine - write_queue (hydration / python)
+        serialize = total - handler (validation + response encoding)
+        """
+        handler = self.phases.get("handler", 0.0)
+        engine_time = self.phases.get("engine", 0.0)
+        queue_time = self.phases.get("write_queue", 0.0)
+
+        result = {
+            "total": self.total_seconds,
+            "handler": handler,
+            "sql": self.query_seconds,
+            "engine": engine_time,
+            "orm": max(handler - self.query_seconds - engine_time - queue_time, 0.0),
+            "serialize": max(self.total_seconds - handler, 0.0),
+        }
+
+        for name, seconds in self.phases.items():
+            if name not in result:
+                result[name] = seconds
+
+        return result
+
+    def server_timing(self):
+        parts = [
+            f"{name};dur={seconds * 1000:.2f}"
+            for name, seconds in self.breakdown().items()
+        ]
+        parts.append(f'db;desc="{self.query_count} queries"')
+        return ", ".join(parts)
+
+
+_current_stats = ContextVar("mes_request_stats", default=None)
+
+
+def current_request_stats():
+    return _current_stats.get()
+
+
+@contextmanager
+def phase(name):
+    stats = _current_stats.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.phases[name] += time.perf_counter() - started
+
+
+# ==========================================================
+# SQLAlchemy Hooks（所有 Engine 共用）
+# ==========================================================
+
+_sql_hooks_installed = False
+
+
+def install_sql_hooks():
+    global _sql_hooks_installed
+
+    if _sql_hooks_installed:
+        return
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    _sql_hooks_installed = True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._mes_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+
+    if stats is None or context is None:
+        return
+
+    started = getattr(context, "_mes_query_started", None)
+
+    stats.query_count += 1
+    if started is not None:
+        stats.query_seconds += time.perf_counter() - started
+
+
+# ==========================================================
+# Route Class（记录 route 模板 + handler 时间）
+# ==========================================================
+
+class TimedRoute(APIRoute):
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(path, endpoint), **kwargs)
+
+
+def _timed_endpoint(path, endpoint):
+
+    budget = getattr(endpoint, "__query_budget__", None)
+
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            stats = _enter_handler(path)
+            started = time.perf_counter()
+            try:
+                result = await endpoint(*args, **kwargs)
+            finally:
+                _exit_handler(stats, started)
+            _check_budget(stats, path, budget)
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        stats = _enter_handler(path)
+        started = time.perf_counter()
+        try:
+            result = endpoint(*args, **kwargs)
+        finally:
+            _exit_handler(stats, started)
+        _check_budget(stats, path, budget)
+        return result
+
+    return wrapper
+
+
+def _enter_handler(path):
+    stats = _current_stats.get()
+
+    if stats is not None:
+        stats.route = path
+        if profiler.enabled:
+            stats.samples = profiler.attach(threading.get_ident())
+
+    return stats
+
+
+def _exit_handler(stats, started):
+    if stats is None:
+        return
+
+    stats.phases["handler"] += time.perf_counter() - started
+
+    if stats.samples is not None:
+        profiler.detach(threading.get_ident())
+
+
+# ==========================================================
+# Query Budget Guard（N+1 检测）
+# ==========================================================
+
+class QueryBudgetExceeded(Exception):
+
+    def __init__(self, label, query_count, budget):
+        self.label = label
+        self.query_count = query_count
+        self.budget = budget
+        super().__init__(
+            f"{label} executed {query_count} queries (budget {budget})"
+        )
+
+
+class QueryGuard:
+    """
+    MES_QUERY_GUARD=1 (dev mode) turns an exceeded endpoint budget into
+    an error instead of a warning. MES_QUERY_BUDGET_DEFAULT applies to
+    endpoints without @query_budget.
+    """
+
+    def __init__(self):
+        self.strict = False
+        self.default_budget = None
+
+    def configure(self, strict=None, default_budget=None):
+        if strict is not None:
+            self.strict = strict
+        self.default_budget = default_budget
+
+
+query_guard = QueryGuard()
+
+metrics.describe("mes_query_budget_exceeded_total", "Requests over their query budget")
+
+
+def query_budget(max_queries):
+    """Declare the fixed number of SQL statements an endpoint may issue."""
+
+    def decorator(func):
+        func.__query_budget__ = max_queries
+        return func
+
+    return decorator
+
+
+def _check_budget(stats, path, budget):
+    if stats is None:
+        return
+
+    if budget is None:
+        budget = query_guard.default_budget
+
+    if budget is None or stats.query_count <= budget:
+        return
+
+    metrics.inc("mes_query_budget_exceeded_total", {"route": path, "method": stats.method})
+
+    if query_guard.strict:
+        raise QueryBudgetExceeded(f"{stats.method} {path}", stats.query_count, budget)
+
+    logger.warning(
+        "%s %s executed %d queries (budget %d)",
+        stats.method,
+        path,
+        stats.query_count,
+        budget,
+    )
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.query_count = 0
+        self.statements = []
+
+
+@contextmanager
+def count_queries(bind=Engine):
+    """
+    Count SQL statements issued inside the block, on any thread
+    (works through TestClient).
+
+        with count_queries() as counter:
+            client.get("/work-orders")
+        assert counter.query_count <= 2
+    """
+    counter = QueryCounter()
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter.query_count += 1
+        counter.statements.append(statement)
+
+    event.listen(bind, "after_cursor_execute", _count)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "after_cursor_execute", _count)
+
+
+@contextmanager
+def assert_max_queries(max_queries, label="block", bind=Engine):
+    with count_queries(bind) as counter:
+        yield counter
+
+    if counter.query_count > max_queries:
+        raise QueryBudgetExceeded(label, counter.query_count, max_queries)
+
+
+# ==========================================================
+# Middleware Entry
+# ==========================================================
+
+async def track_request(request, call_next):
+    stats = RequestStats(request.method)
+    token = _current_stats.set(stats)
+    status_code = 500
+
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        _current_stats.reset(token)
+        stats.finish(status_code)
+        record_request(stats)
+
+    response.headers["Server-Timing"] = stats.server_timing()
+    return response
+
+
+def record_request(stats):
+    route = stats.route or "unmatched"
+    labels = {"route": route, "method": stats.method}
+
+    metrics.inc("mes_requests_total", dict(labels, status=stats.status_code))
+    metrics.observe("mes_request_duration_seconds", labels, stats.total_seconds)
+
+    for name, seconds in stats.breakdown().items():
+        if name == "total":
+            continue
+        metrics.inc("mes_request_phase_seconds_total", dict(labels, phase=name), seconds)
+
+    metrics.inc("mes_db_queries_total", labels, stats.query_count)
+    metrics.inc("mes_db_query_seconds_total", labels, stats.query_seconds)
+    metrics.observe(
+        "mes_db_queries_per_request",
+        labels,
+        stats.query_count,
+        buckets=QUERY_COUNT_BUCKETS,
+    )
+
+    if stats.samples is not None:
+        profiler.maybe_dump(stats)
+
+
+def render_metrics():
+    return metrics.render()
+
+
+# ==========================================================
+# Sampling Profiler (opt-in, flame-graph folded stacks)
+# ==========================================================
+
+class SamplingProfiler:
+    """
+    Samples the stacks of threads currently serving a request and writes
+    folded stacks (flamegraph.pl / speedscope format) for slow requests.
+
+    Enabled by MES_PROFILE_SLOW_MS or configure_profiler().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_seconds = 0.5
+        self.interval_seconds = 0.005
+        self.output_dir = "./profiles"
+        self._lock = threading.Lock()
+        self._targets = {}
+        self._thread = None
+        self._sequence = itertools.count()
+
+    def configure(self, slow_ms=None, interval_ms=None, output_dir=None):
+        if interval_ms is not None:
+            self.interval_seconds = max(interval_ms, 1) / 1000
+        if output_dir is not None:
+            self.output_dir = output_dir
+
+        if slow_ms is None:
+            self.enabled = False
+            return
+
+        self.slow_seconds = slow_ms / 1000
+        self.enabled = True
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run,
+                name="mes-sampling-profiler",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def attach(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+        return samples
+
+    def detach(self, thread_id):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while self.enabled:
+            time.sleep(self.interval_seconds)
+
+            with self._lock:
+                targets = list(self._targets.items())
+
+            if not targets:
+                continue
+
+            frames = sys._current_frames()
+
+            for thread_id, samples in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[_fold_stack(frame)] += 1
+
+    def maybe_dump(self, stats):
+        if stats.total_seconds < self.slow_seconds or not stats.samples:
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        route = re.sub(r"[^A-Za-z0-9]+", "_", stats.route or "unmatched").strip("_")
+        filename = "{}_{:04d}_{}_{}_{}ms.folded".format(
+            time.strftime("%Y%m%dT%H%M%S"),
+            next(self._sequence) % 10000,
+            stats.method,
+            route or "root",
+            int(stats.total_seconds * 1000),
+        )
+        path = os.path.join(self.output_dir, filename)
+
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stats.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        logger.warning(
+            "Slow request %s %s took %.0f ms (%d queries), profile: %s",
+            stats.method,
+            stats.route,
+            stats.total_seconds * 1000,
+            stats.query_count,
+            path,
+        )
+
+        return path
+
+
+def _fold_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+        )
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+profiler = SamplingProfiler()
+
+
+def configure_profiler(slow_ms=None, interval_ms=None, output_dir=None):
+    profiler.configure(slow_ms=slow_ms, interval_ms=interval_ms, output_dir=output_dir)
+    return {
+        "enabled": profiler.enabled,
+        "slow_ms": int(profiler.slow_seconds * 1000) if profiler.enabled else None,
+        "interval_ms": int(profiler.interval_seconds * 1000),
+        "output_dir": profiler.output_dir,
+    }
+
+
+def configure_from_env():
+    default_budget = os.getenv("MES_QUERY_BUDGET_DEFAULT")
+
+    query_guard.configure(
+        strict=os.getenv("MES_QUERY_GUARD", "0") == "1",
+        default_budget=int(default_budget) if default_budget else None,
+    )
+
+    slow_ms = os.getenv("MES_PROFILE_SLOW_MS")
+    interval_ms = os.getenv("MES_PROFILE_INTERVAL_MS")
+
+    configure_profiler(
+        slow_ms=int(slow_ms) if slow_ms else None,
+        interval_ms=int(interval_ms) if interval_ms else None,
+        output_dir=os.getenv("MES_PROFILE_DIR"),
+    )
@@ -0,0 +1,332 @@
+"""
+Background job scheduler.
+
+Named jobs run on worker threads, outside request handling:
+
+    scheduler.register("forecast_refresh", func, interval=300, debounce=2)
+    scheduler.trigger("forecast_refresh")      # after a write
+
+- groups: one worker thread per `group` (jobs.py uses the plant code);
+  jobs of a group run one at a time, groups run in parallel, so a slow
+  job in one plant does not hold up another plant's jobs
+
+- periodic: `interval` seconds after the previous run finished
+- on-demand: trigger() / run_now()
+- dedup: triggering a pending job does not queue it twice; triggering a
+  running job schedules exactly one follow-up run
+- debounce: each trigger pushes the run back by `debounce` seconds, but
+  never more than `max_delay` after the first trigger of a burst
+
+MES_SCHEDULER=inline (default) runs the thread inside the API process.
+MES_SCHEDULER=off leaves it to a separate worker process:
+
+    python job_scheduler.py
+
+The API process then has no jobs: trigger() is a no-op there and
+/jobs/{name}/run answers 409. The worker notices writes by polling
+change_records (the change_watch job in jobs.py) instead.
+"""
+
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from instrumentation import metrics
+
+
+logger = logging.getLogger("mini_mes.jobs")
+
+DEFAULT_GROUP = "default"
+
+metrics.describe("mes_job_runs_total", "Background job runs by outcome")
+metrics.describe("mes_job_duration_seconds", "Background job run time")
+metrics.describe("mes_job_triggers_total", "On-demand job triggers (before dedup)")
+metrics.describe("mes_job_last_success_timestamp", "Unix time of the last successful run")
+
+
+class Job:
+
+    def __init__(self, name, func, interval=None, debounce=0.0, max_delay=None, group=None):
+        self.name = name
+        self.func = func
+        self.group = group or DEFAULT_GROUP
+        self.interval = interval
+        self.debounce = debounce
+        self.max_delay = max_delay if max_delay is not None else max(debounce * 5, 1.0)
+
+        self.due_at = None
+        self.burst_started_at = None
+        self.rerun_requested = False
+        self.running = False
+
+        self.runs = 0
+        self.failures = 0
+        self.triggers = 0
+        self.last_started_at = None
+        self.last_finished_at = None
+        self.last_duration_seconds = None
+        self.last_error = None
+        self.last_result = None
+        self.next_periodic_at = None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "group": self.group,
+            "interval_seconds": self.interval,
+            "debounce_seconds": self.debounce,
+            "running": self.running,
+            "pending": self.due_at is not None or self.rerun_requested,
+            "runs": self.runs,
+            "failures": self.failures,
+            "triggers": self.triggers,
+            "last_started_at": self.last_started_at,
+            "last_finished_at": self.last_finished_at,
+            "last_duration_seconds": self.last_duration_seconds,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+        }
+
+
+class JobScheduler:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._jobs = {}
+        self._threads = {}          # group → worker thread
+        self._started = False
+        self._stopping = False
+
+    # ==========================
+    # Registration
+    # ==========================
+
+    def register(self, name, func, interval=None, debounce=0.0, max_delay=None, run_on_start=False, group=None):
+        job = Job(name, func, interval=interval, debounce=debounce, max_delay=max_delay, group=group)
+
+        now = time.monotonic()
+        if run_on_start:
+            job.due_at = now
+        if interval:
+            job.next_periodic_at = now + interval
+
+        with self._lock:
+            self._jobs[name] = job
+            if self._started:
+                self._start_worker(job.group)
+            self._wakeup.notify_all()
+
+        return job
+
+    # ==========================
+    # Triggers
+    # ==========================
+
+    def trigger(self, name, delay=None):
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                return False
+
+            job.triggers += 1
+            metrics.inc("mes_job_triggers_total", {"job": name})
+
+            if job.running:
+                job.rerun_requested = True
+                return True
+
+            now = time.monotonic()
+            wait = job.debounce if delay is None else delay
+
+            if job.due_at is None:
+                job.burst_started_at = now
+
+            job.due_at = min(now + wait, job.burst_started_at + job.max_delay)
+            self._wakeup.notify_all()
+
+        return True
+
+    def run_now(self, name):
+        return self.trigger(name, delay=0)
+
+    # ==========================
+    # Lifecycle
+    # ==========================
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in list(self._threads.values()))
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+
+            self._started = True
+            self._stopping = False
+            for group in {job.group for job in self._jobs.values()}:
+                self._start_worker(group)
+
+    def _start_worker(self, group):
+        # 持有 _lock 时调用
+        if group in self._threads:
+            return
+
+        thread = threading.Thread(
+            target=self._loop,
+            args=(group,),
+            name=f"mes-job-scheduler-{group}",
+            daemon=True,
+        )
+        self._threads[group] = thread
+        thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            self._stopping = True
+            self._started = False
+            self._wakeup.notify_all()
+            threads = list(self._threads.values())
+            self._threads = {}
+
+        for thread in threads:
+            thread.join(timeout)
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "jobs": [job.status() for job in self._jobs.values()],
+            }
+
+    def job_summary(self, name):
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                return None
+            return {
+                "running": job.running,
+                "pending": job.due_at is not None or job.rerun_requested,
+                "last_finished_at": job.last_finished_at,
+                "last_error": job.last_error,
+            }
+
+    # ==========================
+    # Worker Loop
+    # ==========================
+
+    def _next_due(self, group):
+        best_job, best_at = None, None
+
+        for job in self._jobs.values():
+            if job.group != group:
+                continue
+            candidates = [t for t in (job.due_at, job.next_periodic_at) if t is not None]
+            if not candidates:
+                continue
+            at = min(candidates)
+            if best_at is None or at < best_at:
+                best_job, best_at = job, at
+
+        return best_job, best_at
+
+    def _loop(self, group):
+        while True:
+            with self._lock:
+                while True:
+                    if self._stopping:
+                        return
+
+                    now = time.monotonic()
+                    job, due_at = self._next_due(group)
+
+                    if job is not None and due_at <= now:
+                        break
+
+                    self._wakeup.wait(None if due_at is None else due_at - now)
+
+                job.running = True
+                job.due_at = None
+                job.burst_started_at = None
+
+            self._execute(job)
+
+    def _execute(self, job):
+        started_wall = datetime.utcnow()
+        started = time.perf_counter()
+        error = None
+        result = None
+
+        try:
+            result = job.func()
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            logger.error("Job %s failed\n%s", job.name, traceback.format_exc())
+
+        duration = time.perf_counter() - started
+
+        with self._lock:
+            job.running = False
+            job.runs += 1
+            job.last_started_at = started_wall
+            job.last_finished_at = datetime.utcnow()
+            job.last_duration_seconds = round(duration, 4)
+
+            if error:
+                job.failures += 1
+                job.last_error = error
+            else:
+                job.last_error = None
+                job.last_result = result
+
+            if job.interval:
+                job.next_periodic_at = time.monotonic() + job.interval
+
+            if job.rerun_requested:
+                job.rerun_requested = False
+                job.due_at = time.monotonic() + job.debounce
+                job.burst_started_at = time.monotonic()
+
+        outcome = "failure" if error else "success"
+        metrics.inc("mes_job_runs_total", {"job": job.name, "outcome": outcome})
+        metrics.observe("mes_job_duration_seconds", {"job": job.name}, duration)
+        if not error:
+            metrics.set("mes_job_last_success_timestamp", {"job": job.name}, time.time())
+
+
+scheduler = JobScheduler()
+
+
+def scheduler_mode():
+    return os.getenv("MES_SCHEDULER", "inline")
+
+
+# ==========================================================
+# Standalone Worker
+# ==========================================================
+
+def main():
+    from jobs import register_default_jobs
+
+    logging.basicConfig(level=logging.INFO)
+    register_default_jobs(scheduler, run_on_start=True, watch_changes=True)
+    scheduler.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    logger.info("Job worker started: %s", ", ".join(j["name"] for j in scheduler.status()["jobs"]))
+    stop.wait()
+    scheduler.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import os
+
+from plants import current_plant, plant_job, plants, use_plant
+
+
+# ==========================================================
+# Background Jobs（重计算离开请求线程）
+# ==========================================================
+#
+# 每个 job 自己开 Session 只读计算，结果经写入管道写库（看板直接读表），
+# 返回值只是给 /jobs 看的运行摘要。
+#
+# 写接口提交后 trigger("forecast_refresh") / trigger("schedule_repair")：
+# 连续写入只会在安静 debounce 秒后（最多 max_delay 秒）跑一次。
+# 多工厂：每个工厂各注册一套 job（默认工厂用原名，其它工厂 name@code），
+# 每个工厂一个工作线程：一个工厂的慢任务不拖后其它工厂。
+#
+# MES_SCHEDULER=off（job 在 python job_scheduler.py 里跑）：API 进程的 trigger()
+# 到不了 worker → worker 多一个 change_watch job，每 MES_CHANGE_WATCH_SECONDS
+# 查 change_records 有没有游标之后的业务变更，有就 trigger 上面两个 job。
+
+FORECAST_REFRESH_INTERVAL = float(os.getenv("MES_FORECAST_REFRESH_SECONDS", "300"))
+FORECAST_REFRESH_DEBOUNCE = float(os.getenv("MES_FORECAST_REFRESH_DEBOUNCE", "2"))
+OUTBOX_RELAY_INTERVAL = float(os.getenv("MES_OUTBOX_RELAY_SECONDS", "1"))
+SCHEDULE_REPAIR_INTERVAL = float(os.getenv("MES_SCHEDULE_REPAIR_SECONDS", "600"))
+SCHEDULE_REPAIR_DEBOUNCE = float(os.getenv("MES_SCHEDULE_REPAIR_DEBOUNCE", "5"))
+CHANGE_WATCH_INTERVAL = float(os.getenv("MES_CHANGE_WATCH_SECONDS", "1"))
+
+# job 自己写的表：不能反过来触发 job
+JOB_OUTPUT_TABLES = (
+    "work_order_forecasts",
+    "work_order_forecast_history",
+    "schedule_runs",
+    "schedule_orders",
+    "schedule_slots",
+    "schedule_line_states",
+)
+
+
+def run_forecast_refresh():
+
+    from forecast_store import refresh_forecasts
+
+    db = current_plant().SessionLocal()
+    try:
+        return refresh_forecasts(db)
+    finally:
+        db.close()
+
+
+def run_schedule_repair():
+
+    from finite_scheduler import has_schedule, plan_schedule, save_schedule
+    from write_pipeline import write_pipeline
+
+    db = current_plant().SessionLocal()
+    try:
+        # 还没排过（没有 POST /schedule）→ 不自动排
+        if not has_schedule(db):
+            return {"skipped": "no schedule"}
+        plan = plan_schedule(db, mode="REPAIR", reason="job")
+    finally:
+        db.close()
+
+    run = write_pipeline.submit(lambda session: save_schedule(session, plan), label="schedule")
+    return {"run_id": run.id, "mode": run.mode, "components_solved": run.components_solved}
+
+
+def change_watch(scheduler):
+
+    from sqlalchemy import func, select
+
+    from models import ChangeRecord
+
+    cursor = {}     # plant code → 已看过的最大 change_records.id
+
+    def run():
+        plant = current_plant()
+        db = plant.SessionLocal()
+        try:
+            seen = cursor.get(plant.code)
+            query = select(
+                func.max(ChangeRecord.id),
+                func.count().filter(ChangeRecord.entity.not_in(JOB_OUTPUT_TABLES)),
+            )
+            if seen is not None:
+                query = query.where(ChangeRecord.id > seen)
+            latest, changes = db.execute(query).one()
+        finally:
+            db.close()
+
+        if latest is None:
+            return {"cursor": seen, "changes": 0}
+
+        cursor[plant.code] = latest
+
+        # 第一次只定位游标：启动时 run_on_start 已经各跑过一次
+        if seen is not None and changes:
+            scheduler.trigger(plant_job("forecast_refresh", plant))
+            scheduler.trigger(plant_job("schedule_repair", plant))
+
+        return {"cursor": latest, "changes": changes if seen is not None else 0}
+
+    return run
+
+
+def in_plant(plant, func):
+    # job 线程没有请求上下文：先切到该工厂，Session / 缓存才对得上
+    def run():
+        with use_plant(plant):
+            return func()
+    return run
+
+
+def register_default_jobs(scheduler, run_on_start=False, watch_changes=False):
+
+    from read_model import MAX_STALENESS_SECONDS, run_snapshot_refresh
+
+    for plant in plants.all():
+
+        scheduler.register(
+            plant_job("forecast_refresh", plant),
+            in_plant(plant, run_forecast_refresh),
+            interval=FORECAST_REFRESH_INTERVAL,
+            debounce=FORECAST_REFRESH_DEBOUNCE,
+            max_delay=FORECAST_REFRESH_DEBOUNCE * 5,
+            run_on_start=run_on_start,
+            group=plant.code,
+        )
+
+        # 报工 / 事件 / 建单之后：只重排输入变化的产线组（finite_scheduler）
+        scheduler.register(
+            plant_job("schedule_repair", plant),
+            in_plant(plant, run_schedule_repair),
+            interval=SCHEDULE_REPAIR_INTERVAL,
+            debounce=SCHEDULE_REPAIR_DEBOUNCE,
+            max_delay=SCHEDULE_REPAIR_DEBOUNCE * 5,
+            run_on_start=run_on_start,
+            group=plant.code,
+        )
+
+        if watch_changes:
+            scheduler.register(
+                plant_job("change_watch", plant),
+                in_plant(plant, change_watch(scheduler)),
+                interval=CHANGE_WATCH_INTERVAL,
+                run_on_start=run_on_start,
+                group=plant.code,
+            )
+
+        read_model = plant.read_model
+        if read_model is not None and read_model.source == "snapshot":
+            # 快照只在这里复制：读请求只读上一份快照
+            scheduler.register(
+                plant_job("read_snapshot_refresh", plant),
+                in_plant(plant, run_snapshot_refresh),
+                interval=MAX_STALENESS_SECONDS / 2,
+                run_on_start=run_on_start,
+                group=plant.code,
+            )
+
+        if os.getenv("MES_OUTBOX_FILE"):
+            from outbox_relay import run_relay_job
+
+            scheduler.register(
+                plant_job("outbox_relay", plant),
+                in_plant(plant, run_relay_job),
+                interval=OUTBOX_RELAY_INTERVAL,
+                run_on_start=run_on_start,
+                group=plant.code,
+            )
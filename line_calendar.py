@@ -0,0 +1,171 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from models import LineCalendarException, LineShiftPattern
+from plants import PlantLocal
+
+
+# ==========================================================
+# Line Calendar → Capacity Vector（按天有效产能）
+# ==========================================================
+#
+# vector[i] = start + i 这一天的有效工时（班次工时 × 效率，已套用例外日）
+#
+#   没有班次记录      → 每天 working_hours_per_day（旧行为）
+#   weekday 无班次    → 0（周末休息）
+#   HOLIDAY           → 0
+#   MAINTENANCE       → 扣减 hours（为空 = 整天）
+#   EXTRA_SHIFT       → 增加 hours
+#
+# 编译结果按 (产线, calendar_version, 工时, 效率, 起始日, 天数) 缓存；
+# 日历改动时 calendar_version +1，旧键自然失效，无需逐请求展开。
+
+HORIZON_DAYS = int(os.getenv("MES_CALENDAR_HORIZON_DAYS", "180"))
+CACHE_SIZE = int(os.getenv("MES_CALENDAR_CACHE_SIZE", "1024"))
+
+EXCEPTION_TYPES = ("HOLIDAY", "MAINTENANCE", "EXTRA_SHIFT")
+
+
+def compile_capacity_vector(line, shift_patterns, exceptions, start, days):
+
+    if shift_patterns:
+        week = [0.0] * 7
+        for pattern in shift_patterns:
+            week[pattern.weekday] += pattern.hours
+    else:
+        week = [line.working_hours_per_day] * 7
+
+    overrides = {}
+    for exception in exceptions:
+        overrides.setdefault(exception.exception_date, []).append(exception)
+
+    vector = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        hours = week[day.weekday()]
+
+        for exception in overrides.get(day, ()):
+            if exception.exception_type == "HOLIDAY":
+                hours = 0.0
+            elif exception.exception_type == "MAINTENANCE":
+                hours = 0.0 if exception.hours is None else max(hours - exception.hours, 0.0)
+            elif exception.exception_type == "EXTRA_SHIFT":
+                hours += exception.hours or 0.0
+
+        vector.append(hours * line.efficiency_rate)
+
+    return tuple(vector)
+
+
+class CapacityVectorCache:
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(line, start, days):
+        return (
+            line.id,
+            line.calendar_version,
+            line.working_hours_per_day,
+            line.efficiency_rate,
+            start,
+            days,
+        )
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, line_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == line_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# 每个工厂一份（产线 id 只在本厂唯一）
+capacity_cache = PlantLocal(CapacityVectorCache)
+
+
+def capacity_window_start(today):
+    # 今天已在生产中：预测从明天算起（与 ceil(工时 / 日产能) 的旧口径一致）
+    return today + timedelta(days=1)
+
+
+def load_capacity_vectors(db, lines, start, days=HORIZON_DAYS):
+    """{line_id: vector}; only lines missing from the cache touch the DB (2 queries)."""
+
+    vectors = {}
+    missing = []
+
+    for line in lines:
+        vector = capacity_cache.get(CapacityVectorCache.key(line, start, days))
+        if vector is None:
+            missing.append(line)
+        else:
+            vectors[line.id] = vector
+
+    if not missing:
+        return vectors
+
+    line_ids = [line.id for line in missing]
+    end = start + timedelta(days=days)
+
+    patterns = {}
+    for pattern in db.execute(
+        select(LineShiftPattern.production_line_id, LineShiftPattern.weekday, LineShiftPattern.hours)
+        .where(LineShiftPattern.production_line_id.in_(line_ids))
+    ):
+        patterns.setdefault(pattern.production_line_id, []).append(pattern)
+
+    exceptions = {}
+    for exception in db.execute(
+        select(
+            LineCalendarException.production_line_id,
+            LineCalendarException.exception_date,
+            LineCalendarException.exception_type,
+            LineCalendarException.hours,
+        )
+        .where(LineCalendarException.production_line_id.in_(line_ids))
+        .where(LineCalendarException.exception_date >= start)
+        .where(LineCalendarException.exception_date < end)
+    ):
+        exceptions.setdefault(exception.production_line_id, []).append(exception)
+
+    for line in missing:
+        vector = compile_capacity_vector(
+            line,
+            patterns.get(line.id, ()),
+            exceptions.get(line.id, ()),
+            start,
+            days,
+        )
+        capacity_cache.put(CapacityVectorCache.key(line, start, days), vector)
+        vectors[line.id] = vector
+
+    return vectors
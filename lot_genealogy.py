@@ -0,0 +1,345 @@
+from datetime import datetime
+
+from sqlalchemy import and_, func, insert, or_, select
+
+from models import (
+    Lot,
+    LotEdge,
+    LotShipment,
+    Product,
+    RawMaterial,
+    RawMaterialInventory,
+    SalesOrder,
+    WorkOrder,
+)
+from outbox import record_inserts
+
+
+# ==========================================================
+# Lot Genealogy（批次追溯）
+# ==========================================================
+#
+#   原料收货     → lots(RAW)，一次收货一个批次
+#   报工扣料     → 按收货时间 FIFO 分配原料批次 → lot_edges(原料批次 → 工单产出批次)
+#                  工单第一次报工时建产出批次 lots(FINISHED, lot_no = 工单号)，完工入库时数量 +1
+#   发货         → lot_shipments(产出批次 → 销售单)
+#
+# 追溯 = lot_edges 上的递归 CTE（UNION 去重，有环也会终止），两端都有索引。
+# 结果用 IN (SELECT ... FROM cte) 过滤，不用 JOIN：SQLite 对 CTE 的 JOIN 会选错驱动表（慢几十倍）。
+#   正向：原料批次 X → 用到的工单 / 产出批次 → 哪些客户收到了
+#   反向：产出批次 / 销售单 → 用了哪些原料批次（供应商）
+#
+# 没有批次的库存（迁移前的期初、直接改库存）照常扣减，只是不产生追溯边。
+# lot_edges / lot_shipments 用 Core 批量写，变更记录由 record_inserts 补记（/changes、outbox_relay 可见）。
+
+EPSILON = 1e-9
+
+
+# -------------------------------
+# 写入
+# -------------------------------
+
+def allocate_material_lots(db, work_order, consumptions, transaction_ids=None, now=None):
+    """FIFO-allocate raw-material lots for one production log; returns the work order's output lot.
+
+    consumptions: [(raw_material_id, quantity)], in the same order as transaction_ids.
+    """
+
+    now = now or datetime.utcnow()
+    material_ids = {material_id for material_id, _ in consumptions}
+
+    lots = db.query(Lot).filter(or_(
+        and_(
+            Lot.lot_type == "RAW",
+            Lot.item_id.in_(material_ids),
+            Lot.quantity_remaining > EPSILON,
+        ),
+        and_(
+            Lot.lot_type == "FINISHED",
+            Lot.work_order_id == work_order.id,
+        ),
+    )).order_by(Lot.received_at, Lot.id).all()
+
+    output_lot = next((lot for lot in lots if lot.lot_type == "FINISHED"), None)
+
+    if output_lot is None:
+        output_lot = Lot(
+            lot_type="FINISHED",
+            item_id=work_order.product_id,
+            lot_no=work_order.work_order_no,
+            work_order_id=work_order.id,
+            quantity=0,
+            quantity_remaining=0,
+            received_at=now,
+        )
+        db.add(output_lot)
+        db.flush()
+
+    open_lots = {}
+    for lot in lots:
+        if lot.lot_type == "RAW":
+            open_lots.setdefault(lot.item_id, []).append(lot)
+
+    edges = []
+    for index, (material_id, quantity) in enumerate(consumptions):
+        needed = quantity
+
+        for lot in open_lots.get(material_id, ()):
+            if needed <= EPSILON:
+                break
+            if lot.quantity_remaining <= EPSILON:
+                continue
+
+            taken = min(lot.quantity_remaining, needed)
+            lot.quantity_remaining -= taken
+            needed -= taken
+
+            edges.append(dict(
+                parent_lot_id=lot.id,
+                child_lot_id=output_lot.id,
+                work_order_id=work_order.id,
+                material_transaction_id=transaction_ids[index] if transaction_ids else None,
+                quantity=taken,
+                created_at=now,
+            ))
+
+    if edges:
+        # Core 批量写不经过 flush：自己补记变更（outbox）
+        edge_ids = db.scalars(insert(LotEdge).returning(LotEdge.id), edges).all()
+        record_inserts(db, LotEdge, edge_ids, edges[0])
+
+    return output_lot
+
+
+def receive_output_lot(lot, quantity):
+    lot.quantity += quantity
+    lot.quantity_remaining += quantity
+
+
+def ship_output_lots(db, sales_order, work_orders, now=None):
+    """One shipped unit per work order, taken from that work order's output lot."""
+
+    now = now or datetime.utcnow()
+
+    lots = {
+        lot.work_order_id: lot
+        for lot in db.query(Lot).filter(
+            Lot.lot_type == "FINISHED",
+            Lot.work_order_id.in_([wo.id for wo in work_orders]),
+        ).all()
+    }
+
+    rows = []
+    for wo in work_orders:
+        lot = lots.get(wo.id)
+        if lot is None or lot.quantity_remaining < 1 - EPSILON:
+            continue
+        lot.quantity_remaining -= 1
+        rows.append(dict(lot_id=lot.id, sales_order_id=sales_order.id, quantity=1, shipped_at=now))
+
+    if rows:
+        shipment_ids = db.scalars(insert(LotShipment).returning(LotShipment.id), rows).all()
+        record_inserts(db, LotShipment, shipment_ids, rows[0])
+
+
+# -------------------------------
+# 追溯
+# -------------------------------
+
+LOT_COLUMNS = (
+    Lot.id.label("lot_id"),
+    Lot.lot_type,
+    Lot.item_id,
+    Lot.lot_no,
+    Lot.work_order_id,
+    Lot.supplier,
+    Lot.quantity,
+    Lot.quantity_remaining,
+    Lot.received_at,
+)
+
+
+def _closure(lot_ids, forward):
+    """Recursive CTE: every lot reachable from lot_ids along lot_edges (including lot_ids)."""
+
+    source, target = (
+        (LotEdge.parent_lot_id, LotEdge.child_lot_id)
+        if forward else
+        (LotEdge.child_lot_id, LotEdge.parent_lot_id)
+    )
+
+    seed = select(Lot.id.label("lot_id")).where(Lot.id.in_(lot_ids))
+    tree = seed.cte("lot_tree", recursive=True)
+    tree = tree.union(
+        select(target.label("lot_id")).join(tree, source == tree.c.lot_id)
+    )
+    return tree
+
+
+def _lots(db, tree):
+    return [
+        dict(row._mapping)
+        for row in db.execute(
+            select(*LOT_COLUMNS, RawMaterial.material_code, Product.model_no, WorkOrder.work_order_no)
+            .where(Lot.id.in_(select(tree.c.lot_id)))
+            .outerjoin(RawMaterial, and_(Lot.lot_type == "RAW", RawMaterial.id == Lot.item_id))
+            .outerjoin(Product, and_(Lot.lot_type == "FINISHED", Product.id == Lot.item_id))
+            .outerjoin(WorkOrder, WorkOrder.id == Lot.work_order_id)
+            .order_by(Lot.lot_type.desc(), Lot.received_at, Lot.id)
+        )
+    ]
+
+
+def _edge_totals(db, tree, forward):
+    """Quantity per (parent, child) inside the traced set."""
+
+    anchor = LotEdge.parent_lot_id if forward else LotEdge.child_lot_id
+
+    return [
+        dict(row._mapping)
+        for row in db.execute(
+            select(
+                LotEdge.parent_lot_id,
+                LotEdge.child_lot_id,
+                func.sum(LotEdge.quantity).label("quantity"),
+            )
+            .where(anchor.in_(select(tree.c.lot_id)))
+            .group_by(LotEdge.parent_lot_id, LotEdge.child_lot_id)
+        )
+    ]
+
+
+def trace_forward(db, lot_id):
+    """Where did this lot go: output lots, work orders and customers that received it."""
+
+    tree = _closure([lot_id], forward=True)
+
+    lots = _lots(db, tree)
+    if not any(lot["lot_id"] == lot_id for lot in lots):
+        return None
+
+    shipments = [
+        dict(row._mapping)
+        for row in db.execute(
+            select(
+                LotShipment.lot_id,
+                LotShipment.quantity,
+                LotShipment.shipped_at,
+                SalesOrder.id.label("sales_order_id"),
+                SalesOrder.order_no,
+                SalesOrder.customer_name,
+            )
+            .where(LotShipment.lot_id.in_(select(tree.c.lot_id)))
+            .join(SalesOrder, SalesOrder.id == LotShipment.sales_order_id)
+            .order_by(LotShipment.shipped_at, LotShipment.id)
+        )
+    ]
+
+    return {
+        "lot": next(lot for lot in lots if lot["lot_id"] == lot_id),
+        "lots": [lot for lot in lots if lot["lot_id"] != lot_id],
+        "edges": _edge_totals(db, tree, forward=True),
+        "shipments": shipments,
+        "customers": sorted({row["customer_name"] for row in shipments}),
+    }
+
+
+def trace_backward(db, lot_ids):
+    """What went into these lots: every upstream lot (with supplier) and the quantities used."""
+
+    tree = _closure(lot_ids, forward=False)
+    lots = _lots(db, tree)
+
+    return {
+        "lots": lots,
+        "edges": _edge_totals(db, tree, forward=False),
+        "suppliers": sorted({lot["supplier"] for lot in lots if lot["supplier"]}),
+    }
+
+
+def shipped_lot_ids(db, sales_order_id):
+    return db.scalars(
+        select(LotShipment.lot_id).where(LotShipment.sales_order_id == sales_order_id).distinct()
+    ).all()
+
+
+# -------------------------------
+# 迁移：期初批次 + 已有工单的产出批次 / 发货
+# -------------------------------
+
+def backfill_lots(connection):
+
+    # 已有批次数据 → 不重复回填
+    if connection.execute(select(Lot.id).limit(1)).first() is not None:
+        return
+
+    now = datetime.utcnow()
+
+    # 现有原料库存 → 每种原料一个期初批次（之后的收货才有真实批次号）
+    openings = [
+        dict(
+            lot_type="RAW",
+            item_id=material_id,
+            lot_no="OPENING",
+            quantity=on_hand,
+            quantity_remaining=on_hand,
+            received_at=now,
+        )
+        for material_id, on_hand in connection.execute(
+            select(RawMaterialInventory.raw_material_id, RawMaterialInventory.quantity_on_hand)
+            .where(RawMaterialInventory.quantity_on_hand > EPSILON)
+        )
+    ]
+    if openings:
+        connection.execute(insert(Lot), openings)
+
+    # 已开工的工单 → 产出批次；已发货订单的 DONE 工单 → 发货记录（历史扣料没有批次，不造追溯边）
+    work_orders = connection.execute(
+        select(
+            WorkOrder.id,
+            WorkOrder.work_order_no,
+            WorkOrder.product_id,
+            WorkOrder.status,
+            WorkOrder.started_at,
+            WorkOrder.completed_at,
+            WorkOrder.sales_order_id,
+            SalesOrder.status.label("sales_order_status"),
+            SalesOrder.shipment_date,
+        )
+        .join(SalesOrder, SalesOrder.id == WorkOrder.sales_order_id)
+        .where(WorkOrder.actual_hours > 0)
+    ).all()
+
+    if not work_orders:
+        return
+
+    connection.execute(insert(Lot), [
+        dict(
+            lot_type="FINISHED",
+            item_id=wo.product_id,
+            lot_no=wo.work_order_no,
+            work_order_id=wo.id,
+            quantity=1 if wo.status == "DONE" else 0,
+            quantity_remaining=1 if wo.status == "DONE" and wo.sales_order_status != "SHIPPED" else 0,
+            received_at=wo.completed_at or wo.started_at or now,
+        )
+        for wo in work_orders
+    ])
+
+    shipped = [wo for wo in work_orders if wo.status == "DONE" and wo.sales_order_status == "SHIPPED"]
+    if not shipped:
+        return
+
+    lot_ids = dict(connection.execute(
+        select(Lot.work_order_id, Lot.id).where(Lot.lot_type == "FINISHED")
+    ).all())
+
+    connection.execute(insert(LotShipment), [
+        dict(
+            lot_id=lot_ids[wo.id],
+            sales_order_id=wo.sales_order_id,
+            quantity=1,
+            shipped_at=datetime.combine(wo.shipment_date, datetime.min.time()) if wo.shipment_date else now,
+        )
+        for wo in shipped
+    ])
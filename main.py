@@ -1,47 +1,176 @@
-from models import InventoryTransaction
-from models import MaterialTransaction, RawMaterialInventory
-from models import BOM
-from schemas import BOMCreate, BOMResponse
-print(">>> USING THIS MAIN FILE <<<")
-from models import Inventory
-from schemas import InventoryCreate, InventoryResponse
-from datetime import datetime
-from models import ProductionLog
-from schemas import ProductionLogCreate
-from capacity_engine import simulate_line_orders, calculate_line_capacity
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import engine, get_db
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+
+from fastapi import FastAPI, Depends, Header, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import case, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, raiseload
+
+from bom_explosion import flat_requirements, install_bom_cache, material_requirements, would_create_cycle
+from database import get_db
+from event_analytics import (
+    GRANULARITIES,
+    MAX_TIMELINE_PERIODS,
+    default_window,
+    event_pareto,
+    event_summary,
+    loss_timeline,
+    record_event_created,
+    record_event_resolved,
+    top_causes,
+)
+from fast_json import FastJSONResponse, fetch_dicts, list_response
+from job_scheduler import scheduler, scheduler_mode
+from lot_genealogy import allocate_material_lots, receive_output_lot, ship_output_lots
+from instrumentation import (
+    TimedRoute,
+    configure_from_env,
+    configure_profiler,
+    install_sql_hooks,
+    phase,
+    query_budget,
+    render_metrics,
+    track_request,
+)
+from migrations import check_schema_version, upgrade
+from outbox import (
+    LONG_POLL_MAX_QUERIES,
+    LONG_POLL_MAX_SECONDS,
+    LONG_POLL_RECHECK_SECONDS,
+    change_feed,
+    install_outbox,
+    read_changes,
+    record_inserts,
+)
+from plants import PlantRoutingMiddleware, fan_out, plant_job, plants
+from progress_series import decode_series, record_log_progress
+from read_model import get_read_db, read_model_status, read_session
+from search_index import install_search_index
+from terminal_sync import read_sync_request
+from write_pipeline import write_pipeline
+from projections import (
+    load_production_event_rows,
+    load_production_line_row,
+    load_operation_rows,
+    load_production_line_rows,
+    load_work_order_rows,
+)
 from models import (
-    Base,
+    BOM,
+    BOMFlatRequirement,
+    BOMSubassembly,
+    Inventory,
+    InventoryTransaction,
+    LineCalendarException,
+    LineShiftPattern,
+    Lot,
+    MaterialTransaction,
     Product,
-    SalesOrder,
+    ProductionEvent,
     ProductionLine,
+    ProductionLog,
+    RawMaterial,
+    RawMaterialInventory,
+    RoutingOperation,
+    SalesOrder,
+    ScheduleOrder,
+    ScheduleSlot,
     WorkOrder,
-    ProductionEvent,   # ✅ 必须加
+    WorkOrderForecast,
+    WorkOrderOperation,
+    WorkOrderProgress,
 )
-
 from schemas import (
+    BOMCreate,
+    BOMResponse,
+    BOMSubassemblyCreate,
+    BOMSubassemblyResponse,
+    InventoryCreate,
+    InventoryResponse,
+    InventoryTransactionResponse,
+    LineCalendarExceptionCreate,
+    LineCalendarExceptionResponse,
+    LotResponse,
+    MaterialLotCreate,
     ProductCreate,
     ProductResponse,
-    SalesOrderCreate,
-    SalesOrderResponse,
-    ProductionLineCreate,
-    ProductionLineResponse,
-    WorkOrderCreate,
-    WorkOrderResponse,
     ProductionEventCreate,
     ProductionEventResponse,
+    ProductionLineCreate,
+    ProductionLineResponse,
+    ProductionLogCreate,
     RawMaterialCreate,
     RawMaterialResponse,
+    RoutingOperationItem,
+    RoutingOperationResponse,
+    SalesOrderCreate,
+    SalesOrderResponse,
+    ShiftPatternItem,
+    ShiftPatternResponse,
+    TerminalSyncRequest,
+    WorkOrderCreate,
+    WorkOrderOperationResponse,
+    WorkOrderResponse,
+    WorkOrderUpdate,
 )
 
 # ==========================
 # App Init
 # ==========================
+# 建表不在 import 时做：python migrations.py upgrade
+# 启动只检查版本号（MES_AUTO_MIGRATE=1 开发模式自动升级）
+# 后台任务：MES_SCHEDULER=inline 进程内线程；off = 由 python job_scheduler.py 单独跑
+#   （off 时本进程的 trigger 不生效，worker 轮询 change_records 发现写入，见 jobs.py）
+# 看板读接口：Depends(get_read_db)（MES_READ_MODE，见 read_model.py）；写接口：Depends(get_db)
+
+
+logger = logging.getLogger("mini_mes.api")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for plant in plants.all():
+        if os.getenv("MES_AUTO_MIGRATE", "0") == "1":
+            upgrade(plant.engine)
+        check_schema_version(plant.engine)
+
+    if scheduler_mode() == "inline":
+        from jobs import register_default_jobs
+        register_default_jobs(scheduler, run_on_start=True)
+        scheduler.start()
+    else:
+        logger.info("MES_SCHEDULER=%s: jobs run in the worker process (python job_scheduler.py)", scheduler_mode())
+
+    yield
 
-app = FastAPI()
-Base.metadata.create_all(bind=engine)
+    scheduler.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = TimedRoute
+
+# 终端同步回包 / 大列表：客户端带 Accept-Encoding: gzip 时压缩
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# 多工厂：X-Plant-Id 或 /plants/{code}/... 前缀 → 该工厂的库与缓存
+app.add_middleware(PlantRoutingMiddleware)
+
+install_sql_hooks()
+install_outbox()
+install_search_index()
+install_bom_cache()
+configure_from_env()
+
+
+@app.middleware("http")
+async def request_instrumentation(request: Request, call_next):
+    return await track_request(request, call_next)
 
 
 # ==========================
@@ -53,22 +182,202 @@ def root():
     return {"message": "Mini-MES Running (Event Enabled)"}
 
 
+# ==========================
+# Metrics & Profiler
+# ==========================
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return render_metrics()
+
+
+# 运行时改采样参数：默认关闭（MES_PROFILER_API=1 才开放，只给运维 / 调试环境）
+PROFILER_API_ENABLED = os.getenv("MES_PROFILER_API", "0") == "1"
+
+
+@app.post("/debug/profiler")
+def set_profiler(slow_ms: int | None = None, interval_ms: int | None = None):
+
+    if not PROFILER_API_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler API disabled (MES_PROFILER_API=1)")
+
+    # slow_ms 为空 = 关闭采样
+    return configure_profiler(slow_ms=slow_ms, interval_ms=interval_ms)
+
+
+# ==========================
+# Background Jobs
+# ==========================
+
+@app.get("/jobs")
+def get_jobs():
+    return {"mode": scheduler_mode(), **scheduler.status()}
+
+
+@app.get("/read-model")
+def get_read_model():
+    return read_model_status()
+
+
+# ==========================
+# Plants (Multi-factory)
+# ==========================
+
+def _plant_summary(plant):
+
+    db = read_session(plant)
+    try:
+        lines = db.execute(
+            select(func.count(ProductionLine.id)).where(ProductionLine.is_active == True)
+        ).scalar()
+
+        work_orders = dict(db.execute(
+            select(WorkOrder.status, func.count(WorkOrder.id)).group_by(WorkOrder.status)
+        ).all())
+
+        open_hours = db.execute(
+            select(func.coalesce(func.sum(WorkOrder.remaining_hours), 0.0))
+            .where(WorkOrder.status != "DONE")
+        ).scalar()
+
+        risk = dict(db.execute(
+            select(WorkOrderForecast.risk_level, func.count(WorkOrderForecast.work_order_id))
+            .join(WorkOrder, WorkOrder.id == WorkOrderForecast.work_order_id)
+            .where(WorkOrder.status != "DONE")
+            .group_by(WorkOrderForecast.risk_level)
+        ).all())
+
+        computed_at = db.execute(select(func.max(WorkOrderForecast.computed_at))).scalar()
+    finally:
+        db.close()
+
+    return {
+        "active_lines": lines,
+        "work_orders": {str(status): count for status, count in work_orders.items()},
+        "open_hours": open_hours,
+        "risk": risk,
+        "forecast_computed_at": computed_at,
+    }
+
+
+@app.get("/plants")
+def get_plants():
+    return {"default": plants.default.code, "plants": plants.codes()}
+
+
+@app.get("/plants/summary")
+def get_plants_summary():
+
+    # 各工厂并发查询；超时 / 出错的工厂单独标记，不影响其它工厂
+    results = fan_out(_plant_summary)
+
+    total = {"active_lines": 0, "open_hours": 0.0, "work_orders": {}, "risk": {}}
+    for summary in results.values():
+        if summary["status"] != "ok":
+            continue
+        total["active_lines"] += summary["active_lines"]
+        total["open_hours"] += summary["open_hours"]
+        for key in ("work_orders", "risk"):
+            for name, count in summary[key].items():
+                total[key][name] = total[key].get(name, 0) + count
+
+    return FastJSONResponse({"plants": results, "total": total})
+
+
+@app.post("/jobs/{name}/run")
+def run_job(name: str):
+
+    if scheduler_mode() != "inline":
+        raise HTTPException(status_code=409, detail="Jobs run in the worker process (MES_SCHEDULER=off)")
+
+    if not scheduler.run_now(name):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {"message": "Job queued", "job": name}
+
+
+# ==========================
+# Change Feed (Outbox)
+# ==========================
+
+@app.get("/changes")
+@query_budget(LONG_POLL_MAX_QUERIES)
+async def get_changes(
+    since: int = 0,
+    limit: int = 500,
+    wait: float = 0,
+    entity: str | None = None,
+    db: Session = Depends(get_db),
+):
+
+    # async：等待时不占线程池（几十个长轮询客户端不会拖住其它同步接口），查库仍在线程池里跑
+    limit = max(1, min(limit, 5000))
+    deadline = time.monotonic() + max(0.0, min(wait, LONG_POLL_MAX_SECONDS))
+
+    while True:
+        generation = change_feed.generation
+        page = await run_in_threadpool(read_changes, db, since=since, limit=limit, entity=entity)
+
+        remaining = deadline - time.monotonic()
+        if page["changes"] or remaining <= 0:
+            return FastJSONResponse(page)
+
+        # 等待期间归还连接；本进程提交会立即唤醒
+        await run_in_threadpool(db.rollback)
+        await change_feed.wait_async(generation, min(remaining, LONG_POLL_RECHECK_SECONDS))
+
+
+# ==========================
+# Search API（输入即搜：工单 / 销售单 / 客户 / 型号 / 物料）
+# ==========================
+
+@app.get("/search")
+@query_budget(5)
+def search_entities(
+    q: str,
+    types: str | None = None,
+    limit: int = 20,
+    db: Session = Depends(get_read_db),
+):
+
+    from search_index import ENTITIES, search
+
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+
+    selected = None
+    if types:
+        selected = [name.strip() for name in types.split(",") if name.strip()]
+        unknown = [name for name in selected if name not in ENTITIES]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown types: {', '.join(unknown)} (expected {', '.join(ENTITIES)})"
+            )
+
+    return FastJSONResponse(search(db, q, selected, limit))
+
+
 # ==========================
 # Product API
 # ==========================
 
 @app.post("/products", response_model=ProductResponse)
-def create_product(product: ProductCreate, db: Session = Depends(get_db)):
+def create_product(product: ProductCreate):
+    return write_pipeline.submit(lambda db: _create_product(db, product), label="product")
+
+
+def _create_product(db, product):
     db_product = Product(**product.model_dump())
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    db.flush()
     return db_product
 
 
 @app.get("/products", response_model=list[ProductResponse])
-def get_products(db: Session = Depends(get_db)):
-    return db.query(Product).all()
+@query_budget(2)
+def get_products(db: Session = Depends(get_read_db)):
+    return list_response(db, Product, ProductResponse)
 
 
 # ==========================
@@ -76,7 +385,11 @@ def get_products(db: Session = Depends(get_db)):
 # ==========================
 
 @app.post("/sales-orders", response_model=SalesOrderResponse)
-def create_sales_order(order: SalesOrderCreate, db: Session = Depends(get_db)):
+def create_sales_order(order: SalesOrderCreate):
+    return write_pipeline.submit(lambda db: _create_sales_order(db, order), label="sales_order")
+
+
+def _create_sales_order(db, order):
 
     db_order = SalesOrder(
         order_no=order.order_no,
@@ -87,15 +400,15 @@ def create_sales_order(order: SalesOrderCreate, db: Session = Depends(get_db)):
     )
 
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    db.flush()
 
     return db_order
 
 
 @app.get("/sales-orders", response_model=list[SalesOrderResponse])
-def get_sales_orders(db: Session = Depends(get_db)):
-    return db.query(SalesOrder).all()
+@query_budget(2)
+def get_sales_orders(db: Session = Depends(get_read_db)):
+    return list_response(db, SalesOrder, SalesOrderResponse)
 
 
 # ==========================
@@ -103,7 +416,11 @@ def get_sales_orders(db: Session = Depends(get_db)):
 # ==========================
 
 @app.post("/production-lines", response_model=ProductionLineResponse)
-def create_production_line(line: ProductionLineCreate, db: Session = Depends(get_db)):
+def create_production_line(line: ProductionLineCreate):
+    return write_pipeline.submit(lambda db: _create_production_line(db, line), label="production_line")
+
+
+def _create_production_line(db, line):
 
     # ==========================
     # Duplicate Name Protection
@@ -122,18 +439,213 @@ def create_production_line(line: ProductionLineCreate, db: Session = Depends(get
 
     try:
         db.add(db_line)
-        db.commit()
-        db.refresh(db_line)
-    except:
-        db.rollback()
+        db.flush()
+    except IntegrityError:
+        # 回滚由写入管道的 SAVEPOINT 负责
         raise HTTPException(status_code=500, detail="Failed to create production line")
 
     return db_line
 
 
 @app.get("/production-lines", response_model=list[ProductionLineResponse])
-def get_production_lines(db: Session = Depends(get_db)):
-    return db.query(ProductionLine).all()
+@query_budget(2)
+def get_production_lines(db: Session = Depends(get_read_db)):
+    return list_response(db, ProductionLine, ProductionLineResponse)
+
+
+# ==========================
+# Line Calendar API
+# ==========================
+
+def _get_line_or_404(db, line_id):
+
+    line = db.query(ProductionLine).filter(
+        ProductionLine.id == line_id
+    ).first()
+
+    if not line:
+        raise HTTPException(status_code=404, detail="Production line not found")
+
+    return line
+
+
+def _trigger_refresh():
+    # 写入提交之后：预测刷新 + 排程修复（都 debounce，连续写入只跑一次）
+    scheduler.trigger(plant_job("forecast_refresh"))
+    scheduler.trigger(plant_job("schedule_repair"))
+
+
+def _bump_calendar_version(db, line):
+    # 原子 +1：产能向量缓存键随之变化
+    line.calendar_version = ProductionLine.calendar_version + 1
+    db.flush()
+
+
+def _calendar_changed(line_id):
+
+    from line_calendar import capacity_cache
+
+    # 提交之后：清本进程缓存、触发预测刷新 / 排程修复
+    capacity_cache.invalidate(line_id)
+    _trigger_refresh()
+
+
+@app.get("/production-lines/{line_id}/calendar")
+@query_budget(5)
+def get_line_calendar(
+    line_id: int,
+    start: date | None = None,
+    days: int = 28,
+    db: Session = Depends(get_read_db),
+):
+
+    from line_calendar import capacity_window_start, load_capacity_vectors
+
+    line = load_production_line_row(db, line_id)
+
+    if not line:
+        raise HTTPException(status_code=404, detail="Production line not found")
+
+    start = start or capacity_window_start(date.today())
+    days = max(1, min(days, 366))
+
+    vector = load_capacity_vectors(db, [line], start, days)[line_id]
+
+    shifts = db.query(LineShiftPattern).filter(
+        LineShiftPattern.production_line_id == line_id
+    ).order_by(LineShiftPattern.weekday, LineShiftPattern.shift_name).all()
+
+    exceptions = db.query(LineCalendarException).filter(
+        LineCalendarException.production_line_id == line_id,
+        LineCalendarException.exception_date >= start,
+        LineCalendarException.exception_date < start + timedelta(days=days)
+    ).order_by(LineCalendarException.exception_date).all()
+
+    return {
+        "production_line_id": line_id,
+        "calendar_version": line.calendar_version,
+        "shifts": [ShiftPatternResponse.model_validate(shift) for shift in shifts],
+        "exceptions": [LineCalendarExceptionResponse.model_validate(e) for e in exceptions],
+        "capacity": [
+            {"date": start + timedelta(days=i), "hours": round(hours, 2)}
+            for i, hours in enumerate(vector)
+        ],
+    }
+
+
+@app.put("/production-lines/{line_id}/calendar/shifts", response_model=list[ShiftPatternResponse])
+def set_line_shifts(line_id: int, shifts: list[ShiftPatternItem]):
+
+    db_shifts = write_pipeline.submit(
+        lambda db: _replace_line_shifts(db, line_id, shifts),
+        label="calendar"
+    )
+    _calendar_changed(line_id)
+
+    return db_shifts
+
+
+def _replace_line_shifts(db, line_id, shifts):
+
+    line = _get_line_or_404(db, line_id)
+
+    seen = set()
+    for shift in shifts:
+        if not 0 <= shift.weekday <= 6:
+            raise HTTPException(status_code=400, detail="Weekday must be 0 (Monday) to 6 (Sunday)")
+        if not 0 < shift.hours <= 24:
+            raise HTTPException(status_code=400, detail="Shift hours must be between 0 and 24")
+        if (shift.weekday, shift.shift_name) in seen:
+            raise HTTPException(status_code=400, detail="Duplicate shift for weekday")
+        seen.add((shift.weekday, shift.shift_name))
+
+    # 整体替换班次模式（逐行删除，outbox 才能记录）
+    for old_shift in db.query(LineShiftPattern).filter(
+        LineShiftPattern.production_line_id == line_id
+    ).all():
+        db.delete(old_shift)
+
+    db.flush()
+
+    db_shifts = [
+        LineShiftPattern(production_line_id=line_id, **shift.model_dump())
+        for shift in shifts
+    ]
+    db.add_all(db_shifts)
+
+    _bump_calendar_version(db, line)
+
+    return db_shifts
+
+
+@app.post("/production-lines/{line_id}/calendar/exceptions", response_model=LineCalendarExceptionResponse)
+def create_line_calendar_exception(line_id: int, exception: LineCalendarExceptionCreate):
+
+    db_exception = write_pipeline.submit(
+        lambda db: _create_line_calendar_exception(db, line_id, exception),
+        label="calendar"
+    )
+    _calendar_changed(line_id)
+
+    return db_exception
+
+
+def _create_line_calendar_exception(db, line_id, exception):
+
+    from line_calendar import EXCEPTION_TYPES
+
+    line = _get_line_or_404(db, line_id)
+
+    if exception.exception_type not in EXCEPTION_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Exception type must be one of {', '.join(EXCEPTION_TYPES)}"
+        )
+
+    if exception.exception_type == "EXTRA_SHIFT" and not exception.hours:
+        raise HTTPException(status_code=400, detail="Extra shift requires hours")
+
+    if exception.hours is not None and exception.hours < 0:
+        raise HTTPException(status_code=400, detail="Hours cannot be negative")
+
+    db_exception = LineCalendarException(
+        production_line_id=line_id,
+        **exception.model_dump()
+    )
+    db.add(db_exception)
+
+    _bump_calendar_version(db, line)
+
+    return db_exception
+
+
+@app.delete("/production-lines/{line_id}/calendar/exceptions/{exception_id}")
+def delete_line_calendar_exception(line_id: int, exception_id: int):
+
+    write_pipeline.submit(
+        lambda db: _delete_line_calendar_exception(db, line_id, exception_id),
+        label="calendar"
+    )
+    _calendar_changed(line_id)
+
+    return {"message": "Calendar exception deleted", "exception_id": exception_id}
+
+
+def _delete_line_calendar_exception(db, line_id, exception_id):
+
+    line = _get_line_or_404(db, line_id)
+
+    exception = db.query(LineCalendarException).filter(
+        LineCalendarException.id == exception_id,
+        LineCalendarException.production_line_id == line_id
+    ).first()
+
+    if not exception:
+        raise HTTPException(status_code=404, detail="Calendar exception not found")
+
+    db.delete(exception)
+
+    _bump_calendar_version(db, line)
 
 
 # ==========================
@@ -141,7 +653,19 @@ def get_production_lines(db: Session = Depends(get_db)):
 # ==========================
 
 @app.post("/work-orders", response_model=WorkOrderResponse)
-def create_work_order(work_order: WorkOrderCreate, db: Session = Depends(get_db)):
+def create_work_order(work_order: WorkOrderCreate):
+
+    db_work_order = write_pipeline.submit(
+        lambda db: _create_work_order(db, work_order),
+        label="work_order"
+    )
+
+    _trigger_refresh()
+
+    return db_work_order
+
+
+def _create_work_order(db, work_order):
 
     production_line = db.query(ProductionLine).filter(
         ProductionLine.id == work_order.production_line_id
@@ -165,19 +689,231 @@ def create_work_order(work_order: WorkOrderCreate, db: Session = Depends(get_db)
         promise_date=work_order.promise_date,
         is_material_ready=work_order.is_material_ready,
         material_ready_date=work_order.material_ready_date,
+        is_npi=work_order.is_npi,
+        engineering_hold=work_order.engineering_hold,
         status=status
     )
 
     db.add(db_work_order)
-    db.commit()
-    db.refresh(db_work_order)
+    db.flush()
+
+    # 产品有工艺路线 → 复制成工单工序（之后可按工单单独调整）
+    routing = db.query(RoutingOperation).filter(
+        RoutingOperation.product_id == work_order.product_id
+    ).order_by(RoutingOperation.sequence).all()
+
+    db.add_all([
+        WorkOrderOperation(
+            work_order_id=db_work_order.id,
+            sequence=op.sequence,
+            operation_name=op.operation_name,
+            production_line_id=op.production_line_id,
+            standard_hours=op.standard_hours
+        )
+        for op in routing
+    ])
 
     return db_work_order
 
 
+@app.patch("/work-orders/{work_order_id}", response_model=WorkOrderResponse)
+def update_work_order(work_order_id: int, update: WorkOrderUpdate):
+
+    work_order = write_pipeline.submit(
+        lambda db: _update_work_order(db, work_order_id, update),
+        label="work_order"
+    )
+
+    _trigger_refresh()
+
+    return work_order
+
+
+def _update_work_order(db, work_order_id, update):
+
+    from queue_engine import PRIORITY_RANK
+
+    work_order = db.query(WorkOrder).filter(
+        WorkOrder.id == work_order_id
+    ).first()
+
+    if not work_order:
+        raise HTTPException(status_code=404, detail="Work order not found")
+
+    if work_order.status == "DONE":
+        raise HTTPException(status_code=400, detail="Work order already completed")
+
+    changes = update.model_dump(exclude_unset=True)
+
+    if changes.get("status") is not None:
+        changes["status"] = changes["status"].value
+
+    if changes.get("status") == "DONE":
+        raise HTTPException(status_code=400, detail="Completion is recorded through production logs")
+
+    if "priority" in changes and changes["priority"] not in PRIORITY_RANK:
+        raise HTTPException(status_code=400, detail="Priority must be HIGH, NORMAL or LOW")
+
+    for field in ("planned_hours", "remaining_hours"):
+        if changes.get(field) is not None and changes[field] < 0:
+            raise HTTPException(status_code=400, detail=f"{field} cannot be negative")
+
+    # 换线：目标产线必须存在
+    if changes.get("production_line_id") not in (None, work_order.production_line_id):
+        target_line = db.query(ProductionLine).filter(
+            ProductionLine.id == changes["production_line_id"]
+        ).first()
+
+        if not target_line:
+            raise HTTPException(status_code=404, detail="Production line not found")
+
+    for field, value in changes.items():
+        if value is not None or field == "material_ready_date":
+            setattr(work_order, field, value)
+
+    # 物料门禁：与建单规则一致
+    if "is_material_ready" in changes and "status" not in changes:
+        if not work_order.is_material_ready and work_order.status in ("OPEN", "RUNNING"):
+            work_order.status = "BLOCKED_MATERIAL"
+        elif work_order.is_material_ready and work_order.status == "BLOCKED_MATERIAL":
+            work_order.status = "RUNNING" if work_order.actual_hours else "OPEN"
+
+    db.flush()
+
+    return work_order
+
+
 @app.get("/work-orders", response_model=list[WorkOrderResponse])
-def get_work_orders(db: Session = Depends(get_db)):
-    return db.query(WorkOrder).all()
+@query_budget(2)
+def get_work_orders(db: Session = Depends(get_read_db)):
+    return list_response(db, WorkOrder, WorkOrderResponse)
+
+
+# ==========================
+# Routing API（工艺路线 / 工单工序）
+# ==========================
+
+def _check_operations(db, operations):
+
+    if not operations:
+        return
+
+    seen = set()
+    for op in operations:
+        if op.standard_hours <= 0:
+            raise HTTPException(status_code=400, detail="standard_hours must be positive")
+        if op.sequence in seen:
+            raise HTTPException(status_code=400, detail="Duplicate operation sequence")
+        seen.add(op.sequence)
+
+    line_ids = {op.production_line_id for op in operations}
+    found = db.scalars(select(ProductionLine.id).where(ProductionLine.id.in_(line_ids))).all()
+
+    if line_ids - set(found):
+        raise HTTPException(status_code=404, detail="Production line not found")
+
+
+@app.get("/products/{product_id}/routing", response_model=list[RoutingOperationResponse])
+@query_budget(2)
+def get_product_routing(product_id: int, db: Session = Depends(get_read_db)):
+
+    if db.get(Product, product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    return list_response(
+        db, RoutingOperation, RoutingOperationResponse,
+        RoutingOperation.product_id == product_id,
+        order_by=RoutingOperation.sequence
+    )
+
+
+@app.put("/products/{product_id}/routing", response_model=list[RoutingOperationResponse])
+def set_product_routing(product_id: int, operations: list[RoutingOperationItem]):
+    return write_pipeline.submit(
+        lambda db: _replace_product_routing(db, product_id, operations),
+        label="routing"
+    )
+
+
+def _replace_product_routing(db, product_id, operations):
+
+    if db.get(Product, product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    _check_operations(db, operations)
+
+    # 整体替换（逐行删除，outbox 才能记录）；已建工单的工序不受影响
+    for old_op in db.query(RoutingOperation).filter(
+        RoutingOperation.product_id == product_id
+    ).all():
+        db.delete(old_op)
+
+    db.flush()
+
+    db_operations = [
+        RoutingOperation(product_id=product_id, **op.model_dump())
+        for op in sorted(operations, key=lambda op: op.sequence)
+    ]
+    db.add_all(db_operations)
+    db.flush()
+
+    return db_operations
+
+
+@app.get("/work-orders/{work_order_id}/operations", response_model=list[WorkOrderOperationResponse])
+@query_budget(2)
+def get_work_order_operations(work_order_id: int, db: Session = Depends(get_read_db)):
+
+    if db.get(WorkOrder, work_order_id) is None:
+        raise HTTPException(status_code=404, detail="Work order not found")
+
+    return list_response(
+        db, WorkOrderOperation, WorkOrderOperationResponse,
+        WorkOrderOperation.work_order_id == work_order_id,
+        order_by=WorkOrderOperation.sequence
+    )
+
+
+@app.put("/work-orders/{work_order_id}/operations", response_model=list[WorkOrderOperationResponse])
+def set_work_order_operations(work_order_id: int, operations: list[RoutingOperationItem]):
+
+    db_operations = write_pipeline.submit(
+        lambda db: _replace_work_order_operations(db, work_order_id, operations),
+        label="routing"
+    )
+
+    _trigger_refresh()
+
+    return db_operations
+
+
+def _replace_work_order_operations(db, work_order_id, operations):
+
+    work_order = db.get(WorkOrder, work_order_id)
+
+    if work_order is None:
+        raise HTTPException(status_code=404, detail="Work order not found")
+
+    if work_order.status == "DONE":
+        raise HTTPException(status_code=400, detail="Work order already completed")
+
+    _check_operations(db, operations)
+
+    for old_op in db.query(WorkOrderOperation).filter(
+        WorkOrderOperation.work_order_id == work_order_id
+    ).all():
+        db.delete(old_op)
+
+    db.flush()
+
+    db_operations = [
+        WorkOrderOperation(work_order_id=work_order_id, **op.model_dump())
+        for op in sorted(operations, key=lambda op: op.sequence)
+    ]
+    db.add_all(db_operations)
+    db.flush()
+
+    return db_operations
 
 
 # ================================
@@ -185,77 +921,670 @@ def get_work_orders(db: Session = Depends(get_db)):
 # ================================
 
 @app.get("/production-lines/{line_id}/capacity")
+@query_budget(6)
 def get_line_capacity(
     line_id: int,
     forecast_days: int = 5,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
 
-    production_line = db.query(ProductionLine).filter(
-        ProductionLine.id == line_id
-    ).first()
+    from capacity_engine import calculate_line_capacity
+    from line_calendar import HORIZON_DAYS, capacity_window_start, load_capacity_vectors
+
+    if forecast_days < 1:
+        raise HTTPException(status_code=400, detail="forecast_days must be positive")
+
+    # 引擎走只读投影（按列取数，不做 ORM hydration）
+    all_lines = load_production_line_rows(db, active_only=True)
+
+    production_line = next(
+        (line for line in all_lines if line.id == line_id),
+        None
+    )
+
+    if not production_line:
+        production_line = load_production_line_row(db, line_id)
+
+    if not production_line:
+        raise HTTPException(status_code=404, detail="Production Line not found")
+
+    # 全厂未完工工单一次取出（Auto Rebalance 需要其他产线负荷）
+    all_work_orders = load_work_order_rows(db)
+
+    work_orders = [
+        wo for wo in all_work_orders
+        if wo.production_line_id == line_id
+    ]
+
+    production_events = load_production_event_rows(db, line_id)
+
+    # 编译好的日历产能向量（缓存未命中才查班次 / 例外日）
+    capacity_vectors = load_capacity_vectors(
+        db,
+        {line.id: line for line in [*all_lines, production_line]}.values(),
+        capacity_window_start(date.today()),
+        max(HORIZON_DAYS, forecast_days)
+    )
+
+    with phase("engine"):
+        result = calculate_line_capacity(
+            production_line,
+            work_orders,
+            production_events,
+            all_lines=all_lines,
+            all_work_orders=all_work_orders,
+            forecast_days=forecast_days,
+            capacity_vectors=capacity_vectors
+        )
+
+    return result
+
+
+# ==========================
+# Dispatch Queue API (Queue Engine)
+# ==========================
+
+@app.get("/production-lines/{line_id}/queue")
+@query_budget(3)
+def get_line_queue(line_id: int, limit: int = 20, db: Session = Depends(get_db)):
+
+    from queue_engine import dispatch_queues
+
+    # 沿 change_records 增量同步，只重读变化的工单
+    dispatch_queues.sync(db)
+
+    length, orders = dispatch_queues.queue(line_id, max(0, limit))
+
+    if not length and not load_production_line_row(db, line_id):
+        raise HTTPException(status_code=404, detail="Production Line not found")
+
+    queue = [
+        {
+            "position": position,
+            "work_order_id": wo.id,
+            "work_order_no": wo.work_order_no,
+            "priority": wo.priority,
+            "promise_date": wo.promise_date,
+            "remaining_hours": wo.remaining_hours,
+            "status": wo.status,
+        }
+        for position, wo in enumerate(orders, start=1)
+    ]
+
+    return FastJSONResponse({
+        "production_line_id": line_id,
+        "length": length,
+        "next": queue[0] if queue else None,
+        "queue": queue,
+    })
+
+
+# ==========================
+# Simulation API
+# ==========================
+
+@app.get("/production-lines/{line_id}/simulation")
+@query_budget(5)
+def simulate_orders(line_id: int, db: Session = Depends(get_read_db)):
+
+    from capacity_engine import simulate_line_orders
+    from line_calendar import capacity_window_start, load_capacity_vectors
+
+    production_line = load_production_line_row(db, line_id)
+
+    if not production_line:
+        raise HTTPException(
+            status_code=404,
+            detail="Production Line not found"
+        )
+
+    work_orders = load_work_order_rows(db, line_id)
+    production_events = load_production_event_rows(db, line_id)
+
+    today = date.today()
+    capacity_vectors = load_capacity_vectors(db, [production_line], capacity_window_start(today))
+
+    with phase("engine"):
+        result = simulate_line_orders(
+            production_line,
+            work_orders,
+            production_events,
+            today=today,
+            capacity_vector=capacity_vectors[line_id]
+        )
+
+    return FastJSONResponse(result)
+
+
+@app.get("/plant/simulation")
+@query_budget(6)
+def simulate_plant_orders(
+    production_line_id: int | None = None,
+    include_operations: bool = False,
+    limit: int = 500,
+    db: Session = Depends(get_read_db),
+):
+
+    from line_calendar import capacity_window_start, load_capacity_vectors
+    from plant_simulation import simulate_plant
+
+    # 全厂工序链一起排（跨产线的先后约束），结果再按产线过滤
+    lines = load_production_line_rows(db)
+    work_orders = load_work_order_rows(db)
+    operations = load_operation_rows(db)
+
+    today = date.today()
+    capacity_vectors = load_capacity_vectors(db, lines, capacity_window_start(today))
+
+    with phase("engine"):
+        result = simulate_plant(
+            lines,
+            work_orders,
+            operations,
+            capacity_vectors=capacity_vectors,
+            today=today
+        )
+
+    orders = result["work_orders"]
+    steps = result["operations"]
+
+    if production_line_id is not None:
+        steps = [op for op in steps if op["production_line_id"] == production_line_id]
+        touched = {op["work_order_id"] for op in steps}
+        orders = [wo for wo in orders if wo["work_order_id"] in touched]
+
+    orders.sort(key=lambda wo: (not wo["will_delay"], -(wo["delay_days"] or 0)))
+    orders = orders[:max(limit, 0)]
+
+    if include_operations:
+        shown = {wo["work_order_id"] for wo in orders}
+        steps = [op for op in steps if op["work_order_id"] in shown]
+
+    return FastJSONResponse({
+        "as_of": result["as_of"],
+        "production_line_id": production_line_id,
+        "summary": result["summary"],
+        "lines": result["lines"],
+        "work_orders": orders,
+        "operations": steps if include_operations else None,
+    })
+
+
+# ==========================
+# Finite Schedule API（有限产能排程 → 甘特时段）
+# ==========================
+
+def _schedule_run_response(run):
+    return {
+        "run_id": run.id,
+        "created_at": run.created_at,
+        "mode": run.mode,
+        "reason": run.reason,
+        "as_of": run.as_of,
+        "time_budget_ms": run.time_budget_ms,
+        "elapsed_ms": run.elapsed_ms,
+        "iterations": run.iterations,
+        "components_solved": run.components_solved,
+        "weighted_tardiness": run.weighted_tardiness,
+        "late_work_orders": run.late_work_orders,
+        "scheduled_work_orders": run.scheduled_work_orders,
+        "unscheduled_work_orders": run.unscheduled_work_orders,
+    }
+
+
+def _run_schedule(db, mode, time_budget_ms, reason):
+
+    from finite_scheduler import MAX_TIME_BUDGET_MS, plan_schedule, save_schedule
+
+    if time_budget_ms is not None and not 0 <= time_budget_ms <= MAX_TIME_BUDGET_MS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"time_budget_ms must be between 0 and {MAX_TIME_BUDGET_MS}"
+        )
+
+    # 求解在请求线程（只读），结果经写入管道落库
+    with phase("engine"):
+        plan = plan_schedule(db, mode=mode, time_budget_ms=time_budget_ms, reason=reason)
+    db.rollback()
+
+    run = write_pipeline.submit(lambda session: save_schedule(session, plan), label="schedule")
+
+    return FastJSONResponse(_schedule_run_response(run))
+
+
+@app.post("/schedule")
+@query_budget(19)
+def create_schedule(time_budget_ms: int | None = None, db: Session = Depends(get_db)):
+    return _run_schedule(db, "FULL", time_budget_ms, "manual")
+
+
+@app.post("/schedule/repair")
+@query_budget(19)
+def repair_schedule(time_budget_ms: int | None = None, db: Session = Depends(get_db)):
+    # 只重排输入变化的产线组；还没排过 → 等同 FULL
+    return _run_schedule(db, "REPAIR", time_budget_ms, "manual")
+
+
+@app.get("/schedule")
+@query_budget(3)
+def get_schedule(
+    production_line_id: int | None = None,
+    work_order_id: int | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+    limit: int = 2000,
+    db: Session = Depends(get_read_db),
+):
+
+    from finite_scheduler import current_run
+
+    run = current_run(db)
+    if run is None:
+        raise HTTPException(status_code=404, detail="No schedule yet, POST /schedule first")
+
+    start_date = start_date or date.today()
+    end_date = end_date or start_date + timedelta(days=14)
+
+    slots = (
+        select(
+            ScheduleSlot.work_order_id,
+            WorkOrder.work_order_no,
+            ScheduleSlot.sequence,
+            ScheduleSlot.operation_name,
+            ScheduleSlot.production_line_id,
+            ScheduleSlot.slot_date,
+            ScheduleSlot.start_at,
+            ScheduleSlot.end_at,
+            ScheduleSlot.hours,
+        )
+        .join(WorkOrder, WorkOrder.id == ScheduleSlot.work_order_id)
+        .where(ScheduleSlot.slot_date >= start_date, ScheduleSlot.slot_date <= end_date)
+        .order_by(ScheduleSlot.production_line_id, ScheduleSlot.start_at)
+        .limit(max(limit, 0))
+    )
+
+    orders = (
+        select(
+            ScheduleOrder.work_order_id,
+            WorkOrder.work_order_no,
+            WorkOrder.production_line_id,
+            WorkOrder.priority,
+            WorkOrder.promise_date,
+            ScheduleOrder.status,
+            ScheduleOrder.start_at,
+            ScheduleOrder.finish_at,
+            ScheduleOrder.tardiness_days,
+        )
+        .join(WorkOrder, WorkOrder.id == ScheduleOrder.work_order_id)
+        .order_by(ScheduleOrder.tardiness_days.desc(), ScheduleOrder.work_order_id)
+        .limit(max(limit, 0))
+    )
+
+    if production_line_id is not None:
+        slots = slots.where(ScheduleSlot.production_line_id == production_line_id)
+        orders = orders.where(ScheduleOrder.work_order_id.in_(
+            select(ScheduleSlot.work_order_id)
+            .where(ScheduleSlot.production_line_id == production_line_id)
+            .union(select(WorkOrder.id).where(WorkOrder.production_line_id == production_line_id))
+        ))
+
+    if work_order_id is not None:
+        slots = slots.where(ScheduleSlot.work_order_id == work_order_id)
+        orders = orders.where(ScheduleOrder.work_order_id == work_order_id)
+
+    return FastJSONResponse({
+        "run": _schedule_run_response(run),
+        "start_date": start_date,
+        "end_date": end_date,
+        "production_line_id": production_line_id,
+        "work_order_id": work_order_id,
+        "work_orders": fetch_dicts(db, orders),
+        "slots": fetch_dicts(db, slots),
+    })
+
+
+
+# ==========================
+# Risk Board API (Batch Risk Engine)
+# ==========================
+
+@app.get("/risk-board")
+@query_budget(5)
+def get_risk_board(
+    risk_level: str | None = None,
+    limit: int = 500,
+    live: bool = False,
+    db: Session = Depends(get_read_db),
+):
+
+    if live:
+        return _live_risk_board(db, risk_level, limit)
+
+    from batch_risk_engine import CONSTRAINT_TYPES, RISK_LEVELS
+
+    # 默认读 forecast_refresh 持久化的评分，不在请求里跑仿真
+    severity = case(
+        {name: i for i, name in enumerate(RISK_LEVELS)},
+        value=WorkOrderForecast.risk_level,
+        else_=0
+    )
+
+    query = select(
+        WorkOrder.id.label("work_order_id"),
+        WorkOrder.work_order_no,
+        WorkOrder.production_line_id,
+        WorkOrder.priority,
+        WorkOrder.status,
+        WorkOrder.promise_date,
+        WorkOrderForecast.estimated_finish_date.label("projected_finish_date"),
+        WorkOrderForecast.risk_level.label("overall_risk_level"),
+        WorkOrderForecast.primary_constraint_type,
+        WorkOrderForecast.delay_days.label("overall_delay_days"),
+    ).join(
+        WorkOrderForecast,
+        WorkOrderForecast.work_order_id == WorkOrder.id
+    ).order_by(
+        severity.desc(),
+        WorkOrderForecast.delay_days.desc()
+    ).limit(limit)
+
+    if risk_level:
+        query = query.where(WorkOrderForecast.risk_level == risk_level)
+
+    counts = db.execute(
+        select(
+            WorkOrderForecast.risk_level,
+            WorkOrderForecast.primary_constraint_type,
+            func.count(),
+            func.max(WorkOrderForecast.computed_at),
+        ).group_by(
+            WorkOrderForecast.risk_level,
+            WorkOrderForecast.primary_constraint_type
+        )
+    ).all()
+
+    levels = {name: 0 for name in RISK_LEVELS}
+    constraints = {name: 0 for name in CONSTRAINT_TYPES if name}
+    computed_at = None
+
+    for level, constraint, n, latest in counts:
+        levels[level] = levels.get(level, 0) + n
+        if constraint:
+            constraints[constraint] = constraints.get(constraint, 0) + n
+        if latest and (computed_at is None or latest > computed_at):
+            computed_at = latest
+
+    return FastJSONResponse({
+        "as_of": computed_at.date() if computed_at else None,
+        "computed_at": computed_at,
+        "open_work_orders": sum(levels.values()),
+        "by_risk_level": levels,
+        "by_constraint": constraints,
+        "orders": fetch_dicts(db, query),
+    })
+
+
+def _live_risk_board(db, risk_level, limit):
+
+    from batch_risk_engine import (
+        CONSTRAINT_TYPES,
+        RISK_LEVELS,
+        build_risk_columns,
+        score_risk_columns,
+        summarize_risk,
+    )
+    from capacity_engine import project_finish_dates
+    from line_calendar import capacity_window_start, load_capacity_vectors
+
+    today = date.today()
+    lines = load_production_line_rows(db)
+    work_orders = load_work_order_rows(db)
+    production_events = load_production_event_rows(db)
+    capacity_vectors = load_capacity_vectors(db, lines, capacity_window_start(today))
+
+    with phase("engine"):
+        projected = project_finish_dates(
+            lines,
+            work_orders,
+            production_events,
+            capacity_vectors=capacity_vectors,
+            today=today
+        )
+        scores = score_risk_columns(build_risk_columns(work_orders, projected))
+
+    levels = scores["risk_level"]
+    delays = scores["delay_days"]
+
+    # 严重程度 → 延误天数 排序
+    order = sorted(
+        range(len(work_orders)),
+        key=lambda i: (-levels[i], -delays[i])
+    )
+
+    if risk_level:
+        wanted = RISK_LEVELS.index(risk_level) if risk_level in RISK_LEVELS else -1
+        order = [i for i in order if levels[i] == wanted]
+
+    board = []
+    for i in order[:limit]:
+        wo = work_orders[i]
+        board.append({
+            "work_order_id": wo.id,
+            "work_order_no": wo.work_order_no,
+            "production_line_id": wo.production_line_id,
+            "priority": wo.priority,
+            "status": wo.status,
+            "promise_date": wo.promise_date,
+            "projected_finish_date": projected.get(wo.id),
+            "overall_risk_level": RISK_LEVELS[levels[i]],
+            "primary_constraint_type": CONSTRAINT_TYPES[scores["constraint"][i]],
+            "overall_delay_days": delays[i],
+        })
+
+    return FastJSONResponse({
+        "as_of": datetime.utcnow().date(),
+        "open_work_orders": len(work_orders),
+        **summarize_risk(scores),
+        "orders": board,
+    })
+
+
+# ==========================
+# Delivery Dashboard (Persisted Forecasts)
+# ==========================
+
+@app.post("/forecasts/refresh")
+@query_budget(14)
+def refresh_forecast_snapshots(db: Session = Depends(get_db)):
+
+    from forecast_store import refresh_forecasts
+
+    with phase("engine"):
+        return FastJSONResponse(refresh_forecasts(db))
+
+
+@app.get("/delivery-dashboard")
+@query_budget(2)
+def get_delivery_dashboard(
+    production_line_id: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+
+    # 只读快照：重算由后台 forecast_refresh 负责（写入后 debounce 触发 + 定时）
+    query = select(
+        WorkOrder.id.label("work_order_id"),
+        WorkOrder.work_order_no,
+        WorkOrder.production_line_id,
+        WorkOrder.priority,
+        WorkOrder.status,
+        WorkOrder.promise_date,
+        WorkOrderForecast.estimated_finish_date,
+        WorkOrderForecast.delay_days,
+        WorkOrderForecast.risk_level,
+        WorkOrderForecast.primary_constraint_type,
+        WorkOrderForecast.computed_at,
+    ).join(
+        WorkOrderForecast,
+        WorkOrderForecast.work_order_id == WorkOrder.id
+    ).order_by(
+        WorkOrderForecast.delay_days.desc(),
+        WorkOrder.promise_date
+    )
+
+    if production_line_id is not None:
+        query = query.where(WorkOrder.production_line_id == production_line_id)
+
+    orders = fetch_dicts(db, query)
+
+    return FastJSONResponse({
+        "computed_at": max((row["computed_at"] for row in orders), default=None),
+        "refresh_job": scheduler.job_summary(plant_job("forecast_refresh")),
+        "orders": orders,
+    })
+
+
+@app.get("/forecast-accuracy")
+@query_budget(2)
+def get_forecast_accuracy(
+    lead_days: int = 0,
+    tolerance_days: int = 1,
+    db: Session = Depends(get_read_db),
+):
+
+    from forecast_store import forecast_accuracy
+
+    return forecast_accuracy(db, lead_days=lead_days, tolerance_days=tolerance_days)
+
+
+# ==========================
+# Progress Series API（燃尽图：每单一行打包序列）
+# ==========================
+
+def _progress_query():
+    return select(
+        WorkOrder.id.label("work_order_id"),
+        WorkOrder.work_order_no,
+        WorkOrder.production_line_id,
+        WorkOrder.status,
+        WorkOrder.planned_hours,
+        WorkOrder.promise_date,
+        WorkOrderProgress.points,
+    )
+
+
+def _progress_response(row, days):
+    points = decode_series(row["points"])
+    if days is not None:
+        points = points[-days:] if days > 0 else []
+    return dict(row, points=points)
+
+
+@app.get("/work-orders/{work_order_id}/progress")
+@query_budget(1)
+def get_work_order_progress(
+    work_order_id: int,
+    days: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+
+    rows = fetch_dicts(db, _progress_query().outerjoin(
+        WorkOrderProgress,
+        WorkOrderProgress.work_order_id == WorkOrder.id
+    ).where(WorkOrder.id == work_order_id))
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="Work order not found")
+
+    return FastJSONResponse(_progress_response(rows[0], days))
 
-    if not production_line:
-        raise HTTPException(status_code=404, detail="Production Line not found")
 
-    work_orders = db.query(WorkOrder).filter(
+@app.get("/production-lines/{line_id}/progress")
+@query_budget(1)
+def get_line_progress(
+    line_id: int,
+    include_done: bool = False,
+    days: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+
+    query = _progress_query().join(
+        WorkOrderProgress,
+        WorkOrderProgress.work_order_id == WorkOrder.id
+    ).where(
         WorkOrder.production_line_id == line_id
-    ).all()
+    ).order_by(WorkOrder.promise_date, WorkOrder.id)
 
-    production_events = db.query(ProductionEvent).filter(
-        ProductionEvent.production_line_id == line_id,
-        ProductionEvent.is_resolved == False
-    ).all()
+    if not include_done:
+        query = query.where(WorkOrder.status != "DONE")
 
+    return FastJSONResponse({
+        "production_line_id": line_id,
+        "orders": [_progress_response(row, days) for row in fetch_dicts(db, query)],
+    })
 
-    result = calculate_line_capacity(
-       production_line,
-       work_orders,
-       production_events,
-       forecast_days
-)
 
-    return result
+@app.post("/production-log", response_model=WorkOrderResponse)
+@query_budget(18)
+def log_production(
+    log: ProductionLogCreate,
+    db: Session = Depends(get_db),
+    idempotency_key: str | None = Header(default=None),
+):
 
+    from idempotency import (
+        StoredResult,
+        find_stored_result,
+        recent_keys,
+        replay,
+        request_hash,
+    )
 
-# ==========================
-# Simulation API
-# ==========================
+    key = idempotency_key or log.idempotency_key
 
-@app.get("/production-lines/{line_id}/simulation")
-def simulate_orders(line_id: int, db: Session = Depends(get_db)):
+    if not key:
+        work_order, _ = write_pipeline.submit(
+            lambda session: _apply_production_log(session, log),
+            label="production_log"
+        )
+        _trigger_refresh()
+        return work_order
 
-    production_line = db.query(ProductionLine).filter(
-        ProductionLine.id == line_id
-    ).first()
+    digest = request_hash(log)
 
-    if not production_line:
-        raise HTTPException(
-            status_code=404,
-            detail="Production Line not found"
+    # 最近 key 缓存命中：直接重放，不查库
+    stored = recent_keys.get(key)
+    if stored is not None:
+        return replay(stored, digest)
+
+    try:
+        _, response = write_pipeline.submit(
+            lambda session: _apply_production_log(session, log, key, digest),
+            label="production_log"
         )
 
-    work_orders = db.query(WorkOrder).filter(
-        WorkOrder.production_line_id == line_id
-    ).all()
+    except (HTTPException, IntegrityError) as exc:
+        # 队列满：还没写，直接让客户端退避
+        if isinstance(exc, HTTPException) and exc.status_code == 429:
+            raise
 
-    production_events = db.query(ProductionEvent).filter(
-        ProductionEvent.production_line_id == line_id,
-        ProductionEvent.is_resolved == False
-    ).all()
+        # 首次提交已生效：唯一索引冲突，或工单已被首次提交推进到 DONE
+        db.rollback()
+        stored = find_stored_result(db, key)
 
-    result = simulate_line_orders(
-        production_line,
-        work_orders,
-        production_events
-    )
+        if stored is not None:
+            return replay(stored, digest)
 
-    return result
+        if isinstance(exc, IntegrityError):
+            raise HTTPException(status_code=500, detail="Production log failed")
+        raise
 
+    recent_keys.put(key, StoredResult(digest, response))
+    _trigger_refresh()
 
+    return FastJSONResponse(response)
 
-@app.post("/production-log", response_model=WorkOrderResponse)
-def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
+
+def _apply_production_log(db, log, idempotency_key=None, request_digest=None):
 
     # ==========================
     # 基础检查
@@ -276,7 +1605,13 @@ def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
     if work_order.status in ["DONE", "BLOCKED", "BLOCKED_MATERIAL"]:
         raise HTTPException(status_code=400, detail="Work order not executable")
 
-    if work_order.production_line_id != log.production_line_id:
+    # 多工序工单：在任一工序的产线上报工都算本工单
+    if work_order.production_line_id != log.production_line_id and db.scalar(
+        select(WorkOrderOperation.id).where(
+            WorkOrderOperation.work_order_id == work_order.id,
+            WorkOrderOperation.production_line_id == log.production_line_id
+        ).limit(1)
+    ) is None:
         raise HTTPException(status_code=400, detail="Production line mismatch")
 
 
@@ -290,25 +1625,28 @@ def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
     # 1️⃣ 扣原料 (SAP 261)
     # ==========================================================
 
-    bom_items = db.query(BOM).filter(
-        BOM.product_id == work_order.product_id
-    ).all()
+    # 展开后的 BOM 向量（多层 + 损耗已算好）+ 原料库存一次 JOIN 取出
+    bom_items = db.query(BOMFlatRequirement, RawMaterialInventory).outerjoin(
+        RawMaterialInventory,
+        RawMaterialInventory.raw_material_id == BOMFlatRequirement.raw_material_id
+    ).options(raiseload("*")).filter(
+        BOMFlatRequirement.product_id == work_order.product_id
+    ).order_by(BOMFlatRequirement.raw_material_id).all()
 
     if not bom_items:
         raise HTTPException(status_code=400, detail="No BOM defined")
 
-    for item in bom_items:
+    consumption_hours = produced_hours + log.scrap_hours
 
-        consumption_hours = produced_hours + log.scrap_hours
+    if log.rework_consumes_material:
+        consumption_hours += log.rework_hours
 
-        if log.rework_consumes_material:
-            consumption_hours += log.rework_hours
+    material_rows = []
+    ledger_rows = []
 
-        required_qty = consumption_hours * item.quantity_required
+    for item, material_inventory in bom_items:
 
-        material_inventory = db.query(RawMaterialInventory).filter(
-            RawMaterialInventory.raw_material_id == item.raw_material_id
-        ).first()
+        required_qty = consumption_hours * item.quantity
 
         if not material_inventory:
             raise HTTPException(status_code=400, detail="Raw material inventory missing")
@@ -321,14 +1659,14 @@ def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
 
         material_inventory.quantity_on_hand -= required_qty
 
-        db.add(MaterialTransaction(
+        material_rows.append(dict(
             raw_material_id=item.raw_material_id,
             work_order_id=work_order.id,
             quantity=required_qty,
             transaction_type="CONSUME"
         ))
 
-        db.add(InventoryTransaction(
+        ledger_rows.append(dict(
             item_type="RAW",
             item_id=item.raw_material_id,
             transaction_type="CONSUME",
@@ -336,6 +1674,27 @@ def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
             reference_id=work_order.id
         ))
 
+    # 交易记录批量写入（一条 executemany，不随 BOM 行数增长）
+    material_ids = db.scalars(
+        insert(MaterialTransaction).returning(MaterialTransaction.id),
+        material_rows
+    ).all()
+    ledger_ids = db.scalars(
+        insert(InventoryTransaction).returning(InventoryTransaction.id),
+        ledger_rows
+    ).all()
+
+    record_inserts(db, MaterialTransaction, material_ids, material_rows[0])
+    record_inserts(db, InventoryTransaction, ledger_ids, ledger_rows[0])
+
+    # 批次追溯：按收货时间 FIFO 分配原料批次 → 本工单产出批次
+    output_lot = allocate_material_lots(
+        db,
+        work_order,
+        [(row["raw_material_id"], row["quantity"]) for row in material_rows],
+        material_ids
+    )
+
 
     # ==========================================================
     # 2️⃣ 更新工单工时
@@ -376,6 +1735,7 @@ def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
         receive_qty = 1
 
         inventory.quantity_on_hand += receive_qty
+        receive_output_lot(output_lot, receive_qty)
 
         db.add(InventoryTransaction(
             item_type="FINISHED",
@@ -387,9 +1747,22 @@ def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
 
 
     # ==========================================================
-    # 4️⃣ 写生产日志
+    # 4️⃣ 进度曲线：报工日期的点（燃尽图，与回填同口径）
+    # ==========================================================
+
+    record_log_progress(db, work_order, log.log_date, produced_hours)
+
+
+    # ==========================================================
+    # 5️⃣ 写生产日志
     # ==========================================================
 
+    # 带 key 时把本次返回结果一起存下（重放用）
+    response = None
+    if idempotency_key:
+        from idempotency import snapshot
+        response = WorkOrderResponse.model_validate(work_order).model_dump(mode="json")
+
     db.add(ProductionLog(
         production_line_id=log.production_line_id,
         work_order_id=log.work_order_id,
@@ -397,31 +1770,126 @@ def log_production(log: ProductionLogCreate, db: Session = Depends(get_db)):
         scrap_hours=log.scrap_hours,
         rework_hours=log.rework_hours,
         rework_consumes_material=log.rework_consumes_material,
-        log_date=log.log_date
+        log_date=log.log_date,
+        idempotency_key=idempotency_key,
+        request_hash=request_digest,
+        response_snapshot=snapshot(response) if response is not None else None
     ))
 
 
     # ==========================================================
-    # 5️⃣ Commit
+    # 6️⃣ Flush（由写入管道 / 终端同步统一提交）
     # ==========================================================
 
-    try:
-        db.commit()
-        db.refresh(work_order)
-    except:
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Production log failed")
+    db.flush()
+
+    return work_order, response
+
+
+
+
+
 
-    return work_order
 
+# ==========================
+# Terminal Sync API (Offline-first Batch Upload)
+# ==========================
+
+@app.post("/terminal-sync")
+def terminal_sync(
+    batch: TerminalSyncRequest = Depends(read_sync_request),
+    db: Session = Depends(get_db),
+):
+
+    from terminal_sync import line_work_order_state
+
+    if not load_production_line_row(db, batch.production_line_id):
+        raise HTTPException(status_code=404, detail="Production line not found")
+
+    # 整批作为一次写入进管道（与其它写入一起提交）
+    watermark, results, touched = write_pipeline.submit(
+        lambda session: _apply_terminal_batch(session, batch),
+        label="terminal_sync"
+    )
+
+    if touched:
+        _trigger_refresh()
+
+    return FastJSONResponse({
+        "terminal_id": batch.terminal_id,
+        "acknowledged_seq": watermark,
+        "results": results,
+        "work_orders": fetch_dicts(
+            db,
+            line_work_order_state(batch.production_line_id, touched)
+        ),
+    })
+
+
+def _apply_terminal_batch(db, batch):
+
+    from idempotency import request_hash
+    from terminal_sync import lock_sync_state, terminal_log_key
+
+    state = lock_sync_state(db, batch.terminal_id, batch.production_line_id)
+    watermark = state.last_seq
 
+    results = []
+    touched = set()
 
+    for item in sorted(batch.logs, key=lambda item: item.seq):
 
+        if item.seq <= watermark:
+            results.append({"seq": item.seq, "status": "duplicate"})
+            continue
 
+        log = ProductionLogCreate(
+            production_line_id=batch.production_line_id,
+            **item.model_dump(exclude={"seq"})
+        )
+
+        try:
+            # 每条日志一个 SAVEPOINT：失败只回滚这一条
+            with db.begin_nested():
+                work_order, _ = _apply_production_log(
+                    db,
+                    log,
+                    terminal_log_key(batch.terminal_id, item.seq),
+                    request_hash(log)
+                )
+            results.append({
+                "seq": item.seq,
+                "status": "applied",
+                "remaining_hours": work_order.remaining_hours,
+            })
+            touched.add(item.work_order_id)
+
+        except HTTPException as exc:
+            results.append({"seq": item.seq, "status": "rejected", "detail": exc.detail})
+
+        except IntegrityError:
+            # 同一 key 已生效（水位丢失或曾单条上传）
+            results.append({"seq": item.seq, "status": "duplicate"})
+
+        watermark = item.seq
+
+    state.last_seq = watermark
+    db.flush()
+
+    return watermark, results, touched
 
 
 @app.post("/production-events/{event_id}/resolve")
-def resolve_event(event_id: int, db: Session = Depends(get_db)):
+def resolve_event(event_id: int):
+
+    write_pipeline.submit(lambda db: _resolve_event(db, event_id), label="production_event")
+
+    _trigger_refresh()
+
+    return {"message": "Event resolved", "event_id": event_id}
+
+
+def _resolve_event(db, event_id):
 
     event = db.query(ProductionEvent).filter(
         ProductionEvent.id == event_id
@@ -436,15 +1904,26 @@ def resolve_event(event_id: int, db: Session = Depends(get_db)):
     event.is_resolved = True
     event.resolved_at = datetime.utcnow()
 
-    db.commit()
-    db.refresh(event)
+    db.flush()
 
-    return {"message": "Event resolved", "event_id": event.id}
+    record_event_resolved(db, event)
 
 
 
 @app.post("/production-events", response_model=ProductionEventResponse)
-def create_production_event(event: ProductionEventCreate, db: Session = Depends(get_db)):
+def create_production_event(event: ProductionEventCreate):
+
+    db_event = write_pipeline.submit(
+        lambda session: _create_production_event(session, event),
+        label="production_event"
+    )
+
+    _trigger_refresh()
+
+    return db_event
+
+
+def _create_production_event(db, event):
 
     if event.impact_hours <= 0:
         raise HTTPException(status_code=400, detail="Impact hours must be positive")
@@ -468,18 +1947,117 @@ def create_production_event(event: ProductionEventCreate, db: Session = Depends(
     )
 
     db.add(db_event)
-    db.commit()
-    db.refresh(db_event)
+    db.flush()
+
+    record_event_created(db, db_event)
 
     return db_event
 
 
+# ==========================
+# Event Analytics API（读汇总表，不扫 production_events）
+# ==========================
+
+EVENT_SUMMARY_GROUPS = ("event_type", "production_line", "line_type")
+EVENT_METRICS = ("loss_hours", "event_count")
+
+
+def _check_choice(name, value, choices):
+    if value not in choices:
+        raise HTTPException(status_code=400, detail=f"{name} must be one of: {', '.join(choices)}")
+
+
+@app.get("/event-analytics/summary")
+@query_budget(1)
+def get_event_summary(
+    group_by: str = "event_type",
+    start: date | None = None,
+    end: date | None = None,
+    production_line_id: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+
+    _check_choice("group_by", group_by, EVENT_SUMMARY_GROUPS)
+
+    return FastJSONResponse(event_summary(db, group_by, start, end, production_line_id))
+
+
+@app.get("/event-analytics/pareto")
+@query_budget(1)
+def get_event_pareto(
+    metric: str = "loss_hours",
+    start: date | None = None,
+    end: date | None = None,
+    production_line_id: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+
+    _check_choice("metric", metric, EVENT_METRICS)
+
+    return FastJSONResponse(event_pareto(db, metric, start, end, production_line_id))
+
+
+@app.get("/event-analytics/causes")
+@query_budget(1)
+def get_event_causes(
+    production_line_id: int | None = None,
+    event_type: str | None = None,
+    metric: str = "event_count",
+    limit: int = 10,
+    db: Session = Depends(get_read_db),
+):
+
+    _check_choice("metric", metric, EVENT_METRICS)
+
+    return FastJSONResponse(top_causes(db, production_line_id, event_type, metric, limit))
+
+
+@app.get("/event-analytics/timeline")
+@query_budget(1)
+def get_event_timeline(
+    start: date | None = None,
+    end: date | None = None,
+    granularity: str = "day",
+    rolling_periods: int = 7,
+    production_line_id: int | None = None,
+    event_type: str | None = None,
+    db: Session = Depends(get_read_db),
+):
+
+    _check_choice("granularity", granularity, GRANULARITIES)
+
+    if rolling_periods < 1:
+        raise HTTPException(status_code=400, detail="rolling_periods must be positive")
+
+    start, end = default_window(start, end)
+
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+
+    if granularity == "day" and (end - start).days >= MAX_TIMELINE_PERIODS:
+        raise HTTPException(status_code=400, detail="Range too long for daily buckets, use week or month")
+
+    return FastJSONResponse(loss_timeline(
+        db,
+        start,
+        end,
+        granularity=granularity,
+        rolling_periods=rolling_periods,
+        production_line_id=production_line_id,
+        event_type=event_type,
+    ))
+
+
 # ==========================================================
 # Inventory API
 # ==========================================================
 
 @app.post("/inventory", response_model=InventoryResponse)
-def create_inventory(record: InventoryCreate, db: Session = Depends(get_db)):
+def create_inventory(record: InventoryCreate):
+    return write_pipeline.submit(lambda db: _create_inventory(db, record), label="inventory")
+
+
+def _create_inventory(db, record):
 
     existing = db.query(Inventory).filter(
         Inventory.product_id == record.product_id
@@ -494,15 +2072,15 @@ def create_inventory(record: InventoryCreate, db: Session = Depends(get_db)):
     )
 
     db.add(inventory)
-    db.commit()
-    db.refresh(inventory)
+    db.flush()
 
     return inventory
 
 
 @app.get("/inventory", response_model=list[InventoryResponse])
-def get_inventory(db: Session = Depends(get_db)):
-    return db.query(Inventory).all()
+@query_budget(2)
+def get_inventory(db: Session = Depends(get_read_db)):
+    return list_response(db, Inventory, InventoryResponse)
 
 
 
@@ -511,7 +2089,18 @@ def get_inventory(db: Session = Depends(get_db)):
 # ==========================================================
 
 @app.post("/ship/{sales_order_id}")
-def ship_order(sales_order_id: int, db: Session = Depends(get_db)):
+@query_budget(9)
+def ship_order(sales_order_id: int):
+
+    write_pipeline.submit(lambda db: _ship_order(db, sales_order_id), label="shipment")
+
+    return {
+        "message": "Order shipped successfully",
+        "sales_order_id": sales_order_id
+    }
+
+
+def _ship_order(db, sales_order_id):
 
     sales_order = db.query(SalesOrder).filter(
         SalesOrder.id == sales_order_id
@@ -539,12 +2128,17 @@ def ship_order(sales_order_id: int, db: Session = Depends(get_db)):
                 detail=f"Work order {wo.work_order_no} not completed"
             )
 
-    # 扣库存
+    # 扣库存（成品库存一次取出）
+    inventories = {
+        inventory.product_id: inventory
+        for inventory in db.query(Inventory).filter(
+            Inventory.product_id.in_({wo.product_id for wo in work_orders})
+        ).all()
+    }
+
     for wo in work_orders:
 
-        inventory = db.query(Inventory).filter(
-            Inventory.product_id == wo.product_id
-        ).first()
+        inventory = inventories.get(wo.product_id)
 
         if not inventory:
             raise HTTPException(
@@ -560,15 +2154,13 @@ def ship_order(sales_order_id: int, db: Session = Depends(get_db)):
 
         inventory.quantity_on_hand -= 1
 
+    # 批次追溯：每个工单发出自己的产出批次
+    ship_output_lots(db, sales_order, work_orders)
+
     sales_order.status = "SHIPPED"
     sales_order.shipment_date = datetime.utcnow().date()
 
-    db.commit()
-
-    return {
-        "message": "Order shipped successfully",
-        "sales_order_id": sales_order.id
-    }
+    db.flush()
 
 
 
@@ -577,17 +2169,12 @@ def ship_order(sales_order_id: int, db: Session = Depends(get_db)):
 # Raw Material API
 # ==========================================================
 
-from models import RawMaterial, RawMaterialInventory, BOM
-from schemas import (
-    RawMaterialCreate,
-    RawMaterialResponse,
-    BOMCreate,
-    BOMResponse,
-)
+@app.post("/raw-materials", response_model=RawMaterialResponse)
+def create_raw_material(material: RawMaterialCreate):
+    return write_pipeline.submit(lambda db: _create_raw_material(db, material), label="raw_material")
 
 
-@app.post("/raw-materials", response_model=RawMaterialResponse)
-def create_raw_material(material: RawMaterialCreate, db: Session = Depends(get_db)):
+def _create_raw_material(db, material):
 
     # 防重复 material_code
     existing = db.query(RawMaterial).filter(
@@ -605,24 +2192,150 @@ def create_raw_material(material: RawMaterialCreate, db: Session = Depends(get_d
     )
 
     db.add(db_material)
-    db.commit()
-    db.refresh(db_material)
+    db.flush()
 
-    # 自动创建库存记录
+    # 自动创建库存记录（与原料同一事务：不会出现没有库存行的原料）
     inventory = RawMaterialInventory(
         raw_material_id=db_material.id,
         quantity_on_hand=0
     )
 
     db.add(inventory)
-    db.commit()
+    db.flush()
 
     return db_material
 
 
 @app.get("/raw-materials", response_model=list[RawMaterialResponse])
-def get_raw_materials(db: Session = Depends(get_db)):
-    return db.query(RawMaterial).all()
+@query_budget(2)
+def get_raw_materials(db: Session = Depends(get_read_db)):
+    return list_response(db, RawMaterial, RawMaterialResponse)
+
+
+# ==========================================================
+# Lot API（原料收货批次 + 批次追溯）
+# ==========================================================
+
+@app.post("/raw-material-lots", response_model=LotResponse)
+def receive_material_lot(receipt: MaterialLotCreate):
+
+    return write_pipeline.submit(lambda db: _receive_material_lot(db, receipt), label="material_lot")
+
+
+def _receive_material_lot(db, receipt):
+
+    if receipt.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+
+    inventory = db.query(RawMaterialInventory).filter(
+        RawMaterialInventory.raw_material_id == receipt.raw_material_id
+    ).first()
+
+    if not inventory:
+        raise HTTPException(status_code=404, detail="Raw material not found")
+
+    existing = db.query(Lot.id).filter(
+        Lot.lot_type == "RAW",
+        Lot.item_id == receipt.raw_material_id,
+        Lot.lot_no == receipt.lot_no
+    ).first()
+
+    if existing:
+        raise HTTPException(status_code=400, detail="Lot number already exists for this material")
+
+    lot = Lot(
+        lot_type="RAW",
+        item_id=receipt.raw_material_id,
+        lot_no=receipt.lot_no,
+        supplier=receipt.supplier,
+        quantity=receipt.quantity,
+        quantity_remaining=receipt.quantity,
+        received_at=receipt.received_at or datetime.utcnow()
+    )
+
+    db.add(lot)
+    db.flush()
+
+    # 收货 (SAP 101)
+    inventory.quantity_on_hand += receipt.quantity
+
+    db.add(InventoryTransaction(
+        item_type="RAW",
+        item_id=receipt.raw_material_id,
+        transaction_type="RECEIVE",
+        quantity=receipt.quantity,
+        reference_id=lot.id
+    ))
+
+    db.flush()
+
+    return lot
+
+
+@app.get("/lots", response_model=list[LotResponse])
+@query_budget(2)
+def get_lots(
+    lot_type: str | None = None,
+    item_id: int | None = None,
+    lot_no: str | None = None,
+    open_only: bool = False,
+    db: Session = Depends(get_read_db),
+):
+
+    criteria = []
+    if lot_type is not None:
+        criteria.append(Lot.lot_type == lot_type)
+    if item_id is not None:
+        criteria.append(Lot.item_id == item_id)
+    if lot_no is not None:
+        criteria.append(Lot.lot_no == lot_no)
+    if open_only:
+        criteria.append(Lot.quantity_remaining > 0)
+
+    return list_response(db, Lot, LotResponse, *criteria, order_by=Lot.received_at)
+
+
+@app.get("/lots/{lot_id}/trace/forward")
+@query_budget(3)
+def trace_lot_forward(lot_id: int, db: Session = Depends(get_read_db)):
+
+    from lot_genealogy import trace_forward
+
+    result = trace_forward(db, lot_id)
+
+    if result is None:
+        raise HTTPException(status_code=404, detail="Lot not found")
+
+    return FastJSONResponse(result)
+
+
+@app.get("/lots/{lot_id}/trace/backward")
+@query_budget(2)
+def trace_lot_backward(lot_id: int, db: Session = Depends(get_read_db)):
+
+    from lot_genealogy import trace_backward
+
+    result = trace_backward(db, [lot_id])
+
+    if not any(lot["lot_id"] == lot_id for lot in result["lots"]):
+        raise HTTPException(status_code=404, detail="Lot not found")
+
+    return FastJSONResponse(result)
+
+
+@app.get("/sales-orders/{sales_order_id}/trace")
+@query_budget(3)
+def trace_sales_order(sales_order_id: int, db: Session = Depends(get_read_db)):
+
+    from lot_genealogy import shipped_lot_ids, trace_backward
+
+    lot_ids = shipped_lot_ids(db, sales_order_id)
+
+    return FastJSONResponse({
+        "sales_order_id": sales_order_id,
+        "shipped_lot_ids": lot_ids,
+        **trace_backward(db, lot_ids),
+    })
 
 
 # ==========================================================
@@ -630,7 +2343,11 @@ def get_raw_materials(db: Session = Depends(get_db)):
 # ==========================================================
 
 @app.post("/boms", response_model=BOMResponse)
-def create_bom(bom: BOMCreate, db: Session = Depends(get_db)):
+def create_bom(bom: BOMCreate):
+    return write_pipeline.submit(lambda db: _create_bom(db, bom), label="bom")
+
+
+def _create_bom(db, bom):
 
     # 检查 product 是否存在
     product = db.query(Product).filter(
@@ -648,39 +2365,150 @@ def create_bom(bom: BOMCreate, db: Session = Depends(get_db)):
     if not material:
         raise HTTPException(status_code=404, detail="Raw material not found")
 
-    # 创建 BOM
+    _check_bom_quantities(bom)
+
+    # 创建 BOM（flush 时重算该产品及所有上级的展开向量）
     db_bom = BOM(
         product_id=bom.product_id,
         raw_material_id=bom.raw_material_id,
-        quantity_required=bom.quantity_required
+        quantity_required=bom.quantity_required,
+        scrap_rate=bom.scrap_rate
     )
 
     db.add(db_bom)
-    db.commit()
-    db.refresh(db_bom)
+    db.flush()
 
     return db_bom
 
 
+def _check_bom_quantities(line):
+
+    if line.quantity_required <= 0:
+        raise HTTPException(status_code=400, detail="quantity_required must be positive")
+
+    if not 0 <= line.scrap_rate < 1:
+        raise HTTPException(status_code=400, detail="scrap_rate must be in [0, 1)")
+
+
 @app.get("/boms", response_model=list[BOMResponse])
-def get_boms(db: Session = Depends(get_db)):
-    return db.query(BOM).all()
+@query_budget(2)
+def get_boms(db: Session = Depends(get_read_db)):
+    return list_response(db, BOM, BOMResponse)
+
+
+@app.delete("/boms/{bom_id}")
+def delete_bom(bom_id: int):
+
+    write_pipeline.submit(lambda db: _delete_bom(db, bom_id), label="bom")
+
+    return {"message": "BOM line deleted", "bom_id": bom_id}
+
+
+def _delete_bom(db, bom_id):
+
+    bom = db.query(BOM).filter(BOM.id == bom_id).first()
+
+    if not bom:
+        raise HTTPException(status_code=404, detail="BOM line not found")
+
+    db.delete(bom)
+    db.flush()
 
 
 # ==========================================================
-# Inventory Transaction API (SAP Movement History)
+# Multi-level BOM（半成品）
 # ==========================================================
 
-from models import InventoryTransaction
+@app.post("/bom-subassemblies", response_model=BOMSubassemblyResponse)
+def create_bom_subassembly(line: BOMSubassemblyCreate):
+    return write_pipeline.submit(lambda db: _create_bom_subassembly(db, line), label="bom")
 
 
-@app.get("/inventory-transactions")
-def get_inventory_transactions(db: Session = Depends(get_db)):
+def _create_bom_subassembly(db, line):
 
-    return db.query(InventoryTransaction).order_by(
-        InventoryTransaction.created_at.desc()
+    found = db.scalars(
+        select(Product.id).where(Product.id.in_([line.product_id, line.component_product_id]))
     ).all()
 
+    if {line.product_id, line.component_product_id} - set(found):
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    _check_bom_quantities(line)
+
+    # 产品已经在半成品的下级里 → 成环
+    if would_create_cycle(db, line.product_id, line.component_product_id):
+        raise HTTPException(status_code=400, detail="BOM cycle: product is already a component of this sub-assembly")
+
+    db_line = BOMSubassembly(**line.model_dump())
+
+    db.add(db_line)
+    db.flush()
+
+    return db_line
+
+
+@app.get("/bom-subassemblies", response_model=list[BOMSubassemblyResponse])
+@query_budget(2)
+def get_bom_subassemblies(db: Session = Depends(get_read_db)):
+    return list_response(db, BOMSubassembly, BOMSubassemblyResponse)
+
+
+@app.delete("/bom-subassemblies/{line_id}")
+def delete_bom_subassembly(line_id: int):
+
+    write_pipeline.submit(lambda db: _delete_bom_subassembly(db, line_id), label="bom")
+
+    return {"message": "Sub-assembly line deleted", "line_id": line_id}
+
+
+def _delete_bom_subassembly(db, line_id):
+
+    line = db.query(BOMSubassembly).filter(BOMSubassembly.id == line_id).first()
+
+    if not line:
+        raise HTTPException(status_code=404, detail="Sub-assembly line not found")
+
+    db.delete(line)
+    db.flush()
+
+
+@app.get("/products/{product_id}/bom/flat")
+@query_budget(2)
+def get_flat_bom(product_id: int, db: Session = Depends(get_read_db)):
+
+    if db.get(Product, product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    return FastJSONResponse({
+        "product_id": product_id,
+        "materials": flat_requirements(db, product_id),
+    })
+
+
+@app.get("/material-requirements")
+@query_budget(1)
+def get_material_requirements(production_line_id: int | None = None, db: Session = Depends(get_read_db)):
+    return FastJSONResponse(material_requirements(db, production_line_id))
+
+
+# ==========================================================
+# Inventory Transaction API (SAP Movement History)
+# ==========================================================
+
+@app.get(
+    "/inventory-transactions",
+    response_model=list[InventoryTransactionResponse]
+)
+@query_budget(2)
+def get_inventory_transactions(db: Session = Depends(get_read_db)):
+
+    return list_response(
+        db,
+        InventoryTransaction,
+        InventoryTransactionResponse,
+        order_by=InventoryTransaction.created_at.desc()
+    )
+
 
 
 
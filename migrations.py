@@ -0,0 +1,304 @@
+"""
+Versioned schema migrations.
+
+    python migrations.py upgrade     # apply pending migrations
+    python migrations.py current     # print DB version / code version
+    python migrations.py check       # exit 1 if the DB is behind
+
+Every plant database in MES_PLANTS is handled (see plants.py).
+
+The app never runs DDL on import; startup only compares the stored
+version with SCHEMA_VERSION (see check_schema_version). Set
+MES_AUTO_MIGRATE=1 to upgrade at startup in development.
+"""
+
+import sys
+
+from sqlalchemy import Column, Integer, MetaData, Table, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from database import engine as default_engine
+from models import Base
+
+
+# ==========================================================
+# Version Table
+# ==========================================================
+
+version_metadata = MetaData()
+
+schema_version_table = Table(
+    "schema_version",
+    version_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+# ==========================================================
+# Helpers（每一步都可重复执行）
+# ==========================================================
+
+def create_tables(connection, *table_names):
+    tables = [Base.metadata.tables[name] for name in table_names]
+    Base.metadata.create_all(bind=connection, tables=tables, checkfirst=True)
+
+
+def add_column(connection, table_name, column_name, ddl):
+    existing = {
+        column["name"]
+        for column in inspect(connection).get_columns(table_name)
+    }
+
+    if column_name in existing:
+        return
+
+    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl}"))
+
+
+# ==========================================================
+# Migrations
+# ==========================================================
+
+def m001_baseline(connection):
+    create_tables(
+        connection,
+        "products",
+        "sales_orders",
+        "production_lines",
+        "work_orders",
+        "production_logs",
+        "production_events",
+        "inventories",
+        "boms",
+        "raw_material_inventories",
+        "raw_materials",
+        "material_transactions",
+        "inventory_transactions",
+    )
+
+
+def m002_work_order_risk_flags(connection):
+    add_column(connection, "work_orders", "is_npi", "BOOLEAN NOT NULL DEFAULT 0")
+    add_column(connection, "work_orders", "engineering_hold", "BOOLEAN NOT NULL DEFAULT 0")
+
+
+def m003_forecast_snapshots(connection):
+    create_tables(connection, "work_order_forecasts", "work_order_forecast_history")
+
+
+def m004_change_records(connection):
+    create_tables(connection, "change_records")
+
+
+def m005_line_calendar(connection):
+    add_column(connection, "production_lines", "calendar_version", "INTEGER NOT NULL DEFAULT 0")
+    create_tables(connection, "line_shift_patterns", "line_calendar_exceptions")
+
+
+def m006_production_log_idempotency(connection):
+    add_column(connection, "production_logs", "idempotency_key", "VARCHAR")
+    add_column(connection, "production_logs", "request_hash", "VARCHAR")
+    add_column(connection, "production_logs", "response_snapshot", "VARCHAR")
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_production_logs_idempotency_key "
+        "ON production_logs (idempotency_key)"
+    ))
+
+
+def m007_terminal_sync_state(connection):
+    create_tables(connection, "terminal_sync_state")
+
+
+def m008_work_order_progress(connection):
+    from progress_series import backfill_progress
+
+    create_tables(connection, "work_order_progress")
+    backfill_progress(connection)
+
+
+def m009_event_rollups(connection):
+    from event_analytics import rebuild_event_rollups
+
+    create_tables(connection, "event_daily_rollups", "event_cause_rollups")
+    rebuild_event_rollups(connection)
+
+
+def m010_search_index(connection):
+    from search_index import rebuild_search_index
+
+    # SQLite → FTS5 虚拟表；其它数据库搜索走 LIKE 回退，无 DDL
+    rebuild_search_index(connection)
+
+
+def m011_lot_genealogy(connection):
+    from lot_genealogy import backfill_lots
+
+    create_tables(connection, "lots", "lot_edges", "lot_shipments")
+    backfill_lots(connection)
+
+
+def m012_multi_level_bom(connection):
+    from bom_explosion import rebuild_flat_requirements
+
+    create_tables(connection, "bom_subassemblies", "bom_flat_requirements")
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_boms_product ON boms (product_id)"))
+    rebuild_flat_requirements(connection)
+
+
+def m013_routings(connection):
+    create_tables(connection, "routing_operations", "work_order_operations")
+
+
+def m014_finite_schedule(connection):
+    create_tables(connection, "schedule_runs", "schedule_orders", "schedule_slots", "schedule_line_states")
+
+
+MIGRATIONS = [
+    (1, "baseline schema", m001_baseline),
+    (2, "work order risk flags", m002_work_order_risk_flags),
+    (3, "forecast snapshots", m003_forecast_snapshots),
+    (4, "change record outbox", m004_change_records),
+    (5, "line calendar", m005_line_calendar),
+    (6, "production log idempotency keys", m006_production_log_idempotency),
+    (7, "terminal sync watermarks", m007_terminal_sync_state),
+    (8, "work order progress series", m008_work_order_progress),
+    (9, "event analytics rollups", m009_event_rollups),
+    (10, "search index", m010_search_index),
+    (11, "lot genealogy", m011_lot_genealogy),
+    (12, "multi-level BOM explosion cache", m012_multi_level_bom),
+    (13, "routings and work order operations", m013_routings),
+    (14, "finite capacity schedule", m014_finite_schedule),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# ==========================================================
+# Runner
+# ==========================================================
+
+def current_version(connection):
+    if not inspect(connection).has_table("schema_version"):
+        return 0
+
+    version = connection.execute(
+        select(schema_version_table.c.version).where(schema_version_table.c.id == 1)
+    ).scalar()
+
+    return version or 0
+
+
+def _ensure_version_table(bind):
+    # IF NOT EXISTS：并发启动时建表不冲突
+    with bind.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version "
+            "(id INTEGER NOT NULL PRIMARY KEY, version INTEGER NOT NULL)"
+        ))
+
+    try:
+        with bind.begin() as connection:
+            exists = connection.execute(
+                select(schema_version_table.c.id).where(schema_version_table.c.id == 1)
+            ).first()
+            if not exists:
+                connection.execute(schema_version_table.insert().values(id=1, version=0))
+    except IntegrityError:
+        # 另一个进程刚插入了同一行
+        pass
+
+
+def upgrade(bind=None, target=None):
+    bind = bind or default_engine
+    target = target or SCHEMA_VERSION
+
+    _ensure_version_table(bind)
+
+    applied = []
+
+    with bind.begin() as connection:
+
+        # 先写锁版本行：多个 worker 同时启动时串行执行 DDL
+        connection.execute(
+            schema_version_table.update()
+            .where(schema_version_table.c.id == 1)
+            .values(version=schema_version_table.c.version)
+        )
+
+        version = current_version(connection)
+
+        for number, description, migrate in MIGRATIONS:
+            if number <= version or number > target:
+                continue
+
+            migrate(connection)
+            applied.append((number, description))
+
+            connection.execute(
+                schema_version_table.update()
+                .where(schema_version_table.c.id == 1)
+                .values(version=number)
+            )
+
+    return applied
+
+
+def check_schema_version(bind=None):
+    bind = bind or default_engine
+
+    with bind.connect() as connection:
+        version = current_version(connection)
+
+    if version < SCHEMA_VERSION:
+        raise SchemaOutOfDate(
+            f"Database schema version {version} < required {SCHEMA_VERSION}; "
+            f"run `python migrations.py upgrade`"
+        )
+
+    return version
+
+
+# ==========================================================
+# CLI
+# ==========================================================
+
+def main(argv):
+    from plants import plants
+
+    command = argv[1] if len(argv) > 1 else "upgrade"
+    status = 0
+
+    # 多工厂：每个工厂的库各自升级 / 检查
+    for plant in plants.all():
+        prefix = f"[{plant.code}] " if len(plants.all()) > 1 else ""
+
+        if command == "upgrade":
+            applied = upgrade(plant.engine)
+            for number, description in applied:
+                print(f"{prefix}applied {number:03d} {description}")
+            if not applied:
+                print(f"{prefix}already at version {SCHEMA_VERSION}")
+            continue
+
+        with plant.engine.connect() as connection:
+            version = current_version(connection)
+
+        if command == "current":
+            print(f"{prefix}database {version} / code {SCHEMA_VERSION}")
+        elif command == "check":
+            if version < SCHEMA_VERSION:
+                status = 1
+        else:
+            print(f"unknown command: {command}")
+            return 2
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
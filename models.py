@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -50,6 +50,54 @@ class ProductionLine(Base):
 
     is_active = Column(Boolean, nullable=False, default=True)
 
+    # 班次 / 例外日改动时 +1（产能向量缓存键的一部分）
+    calendar_version = Column(Integer, nullable=False, default=0)
+
+
+
+# ==========================================================
+# Line Calendar（班次模式 + 例外日）
+# ==========================================================
+# 没有班次记录的产线 = 每天 working_hours_per_day（旧行为）
+
+class LineShiftPattern(Base):
+    __tablename__ = "line_shift_patterns"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), nullable=False, index=True)
+
+    weekday = Column(Integer, nullable=False)
+    # 0 = Monday … 6 = Sunday
+
+    shift_name = Column(String, nullable=False)
+    hours = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_line_shift_patterns_line_day_shift", "production_line_id", "weekday", "shift_name", unique=True),
+    )
+
+
+class LineCalendarException(Base):
+    __tablename__ = "line_calendar_exceptions"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), nullable=False)
+
+    exception_date = Column(Date, nullable=False)
+
+    exception_type = Column(String, nullable=False)
+    # HOLIDAY     → 当天 0 工时
+    # MAINTENANCE → 扣减 hours（为空 = 整天停机）
+    # EXTRA_SHIFT → 增加 hours
+
+    hours = Column(Float, nullable=True)
+    description = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_line_calendar_exceptions_line_date", "production_line_id", "exception_date"),
+    )
 
 
 # ==============================
@@ -91,6 +139,12 @@ class WorkOrder(Base):
     is_material_ready = Column(Boolean, nullable=False, default=False)
     material_ready_date = Column(Date, nullable=True)
 
+    # ==========================
+    # Risk Flags
+    # ==========================
+    is_npi = Column(Boolean, nullable=False, default=False)
+    engineering_hold = Column(Boolean, nullable=False, default=False)
+
     # ==========================
     # Status Machine
     # ==========================
@@ -137,9 +191,18 @@ class ProductionLog(Base):
     log_date = Column(Date, nullable=False)
     created_datetime = Column(DateTime, default=datetime.utcnow)
 
+    # 终端重试去重：同一 key 只生效一次，重放返回首次结果
+    idempotency_key = Column(String, nullable=True)
+    request_hash = Column(String, nullable=True)
+    response_snapshot = Column(String, nullable=True)
+
     production_line = relationship("ProductionLine")
     work_order = relationship("WorkOrder")
 
+    __table_args__ = (
+        Index("ux_production_logs_idempotency_key", "idempotency_key", unique=True),
+    )
+
 
 # ==========================================================
 # Production Event（异常事件）
@@ -228,6 +291,39 @@ class BOM(Base):
     product = relationship("Product")
     raw_material = relationship("RawMaterial")
 
+    __table_args__ = (
+        Index("ix_boms_product", "product_id"),
+    )
+
+
+class BOMSubassembly(Base):
+    __tablename__ = "bom_subassemblies"
+
+    # 多层 BOM：product 用 component_product（半成品），半成品自己再有 BOM
+    id = Column(Integer, primary_key=True, index=True)
+
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    component_product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+
+    quantity_required = Column(Float, nullable=False)
+    scrap_rate = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_bom_subassemblies_product", "product_id"),
+        Index("ix_bom_subassemblies_component", "component_product_id"),
+    )
+
+
+class BOMFlatRequirement(Base):
+    __tablename__ = "bom_flat_requirements"
+
+    # 展开后的单位用量（逐层 数量 × (1 + 损耗率) 连乘，多路径相加），见 bom_explosion.py
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    raw_material_id = Column(Integer, ForeignKey("raw_materials.id"), primary_key=True)
+
+    quantity = Column(Float, nullable=False)
+    computed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 
 # ==========================================================
 # Raw Material Inventory
@@ -316,4 +412,337 @@ class InventoryTransaction(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+# ==========================================================
+# Work Order Forecast（交期预测快照，按输入哈希增量重算）
+# ==========================================================
+
+class WorkOrderForecast(Base):
+    __tablename__ = "work_order_forecasts"
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), primary_key=True)
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), nullable=False, index=True)
+
+    # 工单自身 + 队列前序 + 产线配置/事件 + 日期 的哈希
+    inputs_hash = Column(String, nullable=False)
+
+    estimated_finish_date = Column(Date, nullable=True)
+    delay_days = Column(Integer, nullable=False, default=0)
+    risk_level = Column(String, nullable=False)
+    primary_constraint_type = Column(String, nullable=True)
+
+    computed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class WorkOrderForecastHistory(Base):
+    __tablename__ = "work_order_forecast_history"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), nullable=False)
+    snapshot_date = Column(Date, nullable=False)
+
+    inputs_hash = Column(String, nullable=False)
+    estimated_finish_date = Column(Date, nullable=True)
+    delay_days = Column(Integer, nullable=False, default=0)
+    risk_level = Column(String, nullable=False)
+    primary_constraint_type = Column(String, nullable=True)
+
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_forecast_history_wo_date", "work_order_id", "snapshot_date", unique=True),
+    )
+
+
+# ==========================================================
+# Change Record（事务内 outbox：下游按游标拉增量）
+# ==========================================================
+
+class ChangeRecord(Base):
+    __tablename__ = "change_records"
+
+    # 自增 id 即游标
+    id = Column(Integer, primary_key=True, index=True)
+
+    entity = Column(String, nullable=False)
+    # 表名：work_orders / production_logs / ...
+
+    entity_id = Column(Integer, nullable=False)
+
+    op = Column(String, nullable=False)
+    # INSERT / UPDATE / DELETE
+
+    changed_fields = Column(String, nullable=False, default="[]")
+    # JSON 数组：字段名
+
+    version = Column(Integer, nullable=False)
+    # 同一实体的第 N 次变更
+
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_change_records_entity", "entity", "entity_id", "version"),
+    )
+
+
+# ==========================================================
+# Terminal Sync State（离线终端批量上传的确认水位）
+# ==========================================================
+
+class TerminalSyncState(Base):
+    __tablename__ = "terminal_sync_state"
+
+    terminal_id = Column(String, primary_key=True)
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), nullable=False)
+
+    # 已处理（成功或拒绝）的最大本地序号
+    last_seq = Column(Integer, nullable=False, default=0)
+
+    last_sync_at = Column(DateTime, nullable=True)
+
+
+# ==========================================================
+# Work Order Progress（每个工单一行：按天打包的进度 / 交期时间序列）
+# ==========================================================
+
+class WorkOrderProgress(Base):
+    __tablename__ = "work_order_progress"
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), primary_key=True)
+
+    # 定长记录数组（格式见 progress_series.POINT），按日期递增，每天最多一条
+    points = Column(LargeBinary, nullable=False)
+
+    point_count = Column(Integer, nullable=False, default=0)
+    last_date = Column(Date, nullable=True)
+
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# ==========================================================
+# Event Rollups（停机 / 异常事件增量汇总：建单 / 解决时更新）
+# ==========================================================
+
+class EventDailyRollup(Base):
+    __tablename__ = "event_daily_rollups"
+
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), primary_key=True)
+    event_type = Column(String, primary_key=True)
+    event_date = Column(Date, primary_key=True)
+
+    event_count = Column(Integer, nullable=False, default=0)
+    loss_hours = Column(Float, nullable=False, default=0)
+
+    # MTTR = repair_seconds / resolved_count（按事件发生日归集）
+    resolved_count = Column(Integer, nullable=False, default=0)
+    repair_seconds = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_event_daily_rollups_date", "event_date"),
+    )
+
+
+class EventCauseRollup(Base):
+    __tablename__ = "event_cause_rollups"
+
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), primary_key=True)
+    event_type = Column(String, primary_key=True)
+    cause = Column(String, primary_key=True)     # 归一化后的 description（见 event_analytics.cause_key）
+
+    event_count = Column(Integer, nullable=False, default=0)
+    loss_hours = Column(Float, nullable=False, default=0)
+    resolved_count = Column(Integer, nullable=False, default=0)
+    repair_seconds = Column(Float, nullable=False, default=0)
+
+    first_date = Column(Date, nullable=False)
+    last_date = Column(Date, nullable=False)
+
+
+# ==========================================================
+# Lots（批次追溯：原料批次 → 工单产出批次 → 发货）
+# ==========================================================
+
+class Lot(Base):
+    __tablename__ = "lots"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    lot_type = Column(String, nullable=False)
+    # RAW      → item_id = raw_material_id（收货批次）
+    # FINISHED → item_id = product_id（工单产出批次，lot_no = 工单号）
+
+    item_id = Column(Integer, nullable=False)
+    lot_no = Column(String, nullable=False)
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), nullable=True)
+    supplier = Column(String, nullable=True)
+
+    quantity = Column(Float, nullable=False, default=0)
+    quantity_remaining = Column(Float, nullable=False, default=0)
+
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ux_lots_type_item_lot_no", "lot_type", "item_id", "lot_no", unique=True),
+        Index("ix_lots_fifo", "lot_type", "item_id", "received_at", "id"),
+        Index("ix_lots_work_order", "work_order_id"),
+    )
+
+
+class LotEdge(Base):
+    __tablename__ = "lot_edges"
+
+    # 投入批次 → 产出批次（每次报工每个批次一行）
+    id = Column(Integer, primary_key=True, index=True)
+
+    parent_lot_id = Column(Integer, ForeignKey("lots.id"), nullable=False)
+    child_lot_id = Column(Integer, ForeignKey("lots.id"), nullable=False)
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), nullable=False)
+    material_transaction_id = Column(Integer, ForeignKey("material_transactions.id"), nullable=True)
+
+    quantity = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_lot_edges_parent_child", "parent_lot_id", "child_lot_id"),
+        Index("ix_lot_edges_child_parent", "child_lot_id", "parent_lot_id"),
+    )
+
+
+class LotShipment(Base):
+    __tablename__ = "lot_shipments"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    lot_id = Column(Integer, ForeignKey("lots.id"), nullable=False)
+    sales_order_id = Column(Integer, ForeignKey("sales_orders.id"), nullable=False)
+
+    quantity = Column(Float, nullable=False)
+    shipped_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_lot_shipments_lot", "lot_id", "sales_order_id"),
+        Index("ix_lot_shipments_sales_order", "sales_order_id", "lot_id"),
+    )
+
+
+# ==========================================================
+# Routing（工艺路线：产品 → 有序工序，每道工序指定产线和标准工时）
+# ==========================================================
+
+class RoutingOperation(Base):
+    __tablename__ = "routing_operations"
+
+    id = Column(Integer, primary_key=True, index=True)
+
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)
+
+    operation_name = Column(String, nullable=False)
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), nullable=False)
+    standard_hours = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ux_routing_operations_product_sequence", "product_id", "sequence", unique=True),
+    )
+
+
+class WorkOrderOperation(Base):
+    __tablename__ = "work_order_operations"
+
+    # 建单时从工艺路线复制；没有工序的工单 = 本产线一道工序（旧行为）
+    id = Column(Integer, primary_key=True, index=True)
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)
+
+    operation_name = Column(String, nullable=False)
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), nullable=False)
+
+    # 工序间的工时比例：工单 (actual + remaining) 按标准工时比例拆到各工序
+    standard_hours = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ux_work_order_operations_sequence", "work_order_id", "sequence", unique=True),
+        Index("ix_work_order_operations_line", "production_line_id"),
+    )
+
+
+# ==========================================================
+# Finite Schedule（有限产能排程结果：当前一版，按连通产线组增量修复）
+# ==========================================================
+
+class ScheduleRun(Base):
+    __tablename__ = "schedule_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    mode = Column(String, nullable=False)
+    # FULL（从头排）/ REPAIR（沿用上一版顺序，只重排输入变化的产线组）
+
+    reason = Column(String, nullable=True)
+    as_of = Column(Date, nullable=False)
+
+    time_budget_ms = Column(Integer, nullable=False)
+    elapsed_ms = Column(Integer, nullable=False, default=0)
+    iterations = Column(Integer, nullable=False, default=0)
+    components_solved = Column(Integer, nullable=False, default=0)
+
+    weighted_tardiness = Column(Float, nullable=False, default=0)
+    late_work_orders = Column(Integer, nullable=False, default=0)
+    scheduled_work_orders = Column(Integer, nullable=False, default=0)
+    unscheduled_work_orders = Column(Integer, nullable=False, default=0)
+
+
+class ScheduleOrder(Base):
+    __tablename__ = "schedule_orders"
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), primary_key=True)
+
+    status = Column(String, nullable=False)
+    # SCHEDULED / WAITING_MATERIAL（未齐套且没有齐套日期）/ BLOCKED / NO_CAPACITY
+
+    rank = Column(Float, nullable=True)          # 组内派工顺序（修复时的起点）
+    weight = Column(Float, nullable=False)
+
+    start_at = Column(DateTime, nullable=True)
+    finish_at = Column(DateTime, nullable=True)
+    tardiness_days = Column(Integer, nullable=True)
+
+    run_id = Column(Integer, ForeignKey("schedule_runs.id"), nullable=False)
+
+
+class ScheduleSlot(Base):
+    __tablename__ = "schedule_slots"
+
+    # 一道工序在一天里的一段（跨天的工序拆成多段）
+    id = Column(Integer, primary_key=True, index=True)
+
+    work_order_id = Column(Integer, ForeignKey("work_orders.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)
+    operation_name = Column(String, nullable=True)
+
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), nullable=False)
+    slot_date = Column(Date, nullable=False)
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    hours = Column(Float, nullable=False)
+
+    run_id = Column(Integer, ForeignKey("schedule_runs.id"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_schedule_slots_line_start", "production_line_id", "start_at"),
+        Index("ix_schedule_slots_work_order", "work_order_id", "sequence"),
+        Index("ix_schedule_slots_date", "slot_date"),
+    )
+
+
+class ScheduleLineState(Base):
+    __tablename__ = "schedule_line_states"
 
+    # 上次排这条产线时的输入哈希：不变 → 修复时跳过它所在的产线组
+    production_line_id = Column(Integer, ForeignKey("production_lines.id"), primary_key=True)
+    inputs_hash = Column(String, nullable=False)
+    run_id = Column(Integer, ForeignKey("schedule_runs.id"), nullable=False)
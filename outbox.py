@@ -0,0 +1,290 @@
+import asyncio
+import json
+import threading
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, String, bindparam, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from models import ChangeRecord
+from plants import PlantLocal
+
+
+# ==========================================================
+# Transactional Outbox（变更记录与业务写入同一事务）
+# ==========================================================
+#
+# before_flush / after_flush：记下本次 flush 的 UPDATE、DELETE / INSERT；
+# before_commit：一次 executemany 写入 change_records，随业务数据一起提交。
+# 一个事务无论 flush 几次，只多一条语句。
+# Core 批量 insert() 不经过 flush → 调用方用 record_inserts() 补记。
+#
+# version = 该实体已有最大 version + 1（INSERT ... SELECT 原子计算）。
+# 游标 = 自增 id：SQLite 单写者，id 顺序即提交顺序。
+# 只对 SQLite 成立：Postgres 的序列号在 INSERT 时分配，并发事务可能
+# 小 id 后提交 → 已读到更大游标的下游会漏掉它。MES_PLANTS 里的 Postgres 工厂
+# 暂不保证 /changes 完整（需改成按提交顺序的游标，如 xid8 / 逻辑复制）。
+# 原子性依赖 database.install_sqlite_transactions：SAVEPOINT 在真正的事务里，
+# 批内业务行和变更记录同一次 COMMIT 提交或回滚。
+# 下游：GET /changes?since=<cursor>，或 outbox_relay.py 转发到文件。
+
+IGNORED_TABLES = {"change_records"}
+
+# 长轮询：提交后本进程内立即唤醒；其他进程写入靠定期重查兜底
+LONG_POLL_MAX_SECONDS = 30
+LONG_POLL_RECHECK_SECONDS = 1.0
+LONG_POLL_MAX_QUERIES = int(LONG_POLL_MAX_SECONDS / LONG_POLL_RECHECK_SECONDS) + 2
+
+_changes = ChangeRecord.__table__
+
+_RECORD_STATEMENT = insert(_changes).from_select(
+    ["entity", "entity_id", "op", "changed_fields", "version", "created_at"],
+    select(
+        bindparam("entity", type_=String),
+        bindparam("entity_id", type_=Integer),
+        bindparam("op", type_=String),
+        bindparam("changed_fields", type_=String),
+        func.coalesce(func.max(_changes.c.version), 0) + 1,
+        bindparam("created_at", type_=DateTime),
+    )
+    .where(_changes.c.entity == bindparam("entity", type_=String))
+    .where(_changes.c.entity_id == bindparam("entity_id", type_=Integer))
+)
+
+
+# ==========================================================
+# Capture
+# ==========================================================
+
+def _change_row(obj, op, now):
+
+    state = inspect(obj)
+    mapper = state.mapper
+    table = mapper.local_table.name
+
+    if table in IGNORED_TABLES:
+        return None
+
+    if op == "UPDATE":
+        fields = [
+            attr.key for attr in mapper.column_attrs
+            if state.attrs[attr.key].history.has_changes()
+        ]
+        if not fields:
+            return None
+    elif op == "INSERT":
+        # 只看已在对象上的值，不触发刷新查询
+        fields = [
+            attr.key for attr in mapper.column_attrs
+            if state.dict.get(attr.key) is not None
+        ]
+    else:
+        fields = []
+
+    return {
+        "entity": table,
+        "entity_id": mapper.primary_key_from_instance(obj)[0],
+        "op": op,
+        "changed_fields": json.dumps(fields, separators=(",", ":")),
+        "created_at": now,
+    }
+
+
+def _buffer(session, rows):
+    if rows:
+        session.info.setdefault("outbox_rows", []).extend(rows)
+
+
+def _before_flush(session, flush_context, instances):
+    # UPDATE / DELETE 在 flush 前取：此时属性历史完整（SQL 表达式赋值 flush 后即过期）
+    now = datetime.utcnow()
+    rows = []
+
+    for objects, op in ((session.dirty, "UPDATE"), (session.deleted, "DELETE")):
+        for obj in objects:
+            row = _change_row(obj, op, now)
+            if row is not None:
+                rows.append(row)
+
+    _buffer(session, rows)
+
+
+def _after_flush(session, flush_context):
+    # INSERT 在 flush 后取：主键已生成
+    now = datetime.utcnow()
+    rows = []
+
+    for obj in session.new:
+        row = _change_row(obj, "INSERT", now)
+        if row is not None:
+            rows.append(row)
+
+    _buffer(session, rows)
+
+
+def _before_commit(session):
+    # SAVEPOINT 释放也会触发：只在最外层提交时写 outbox
+    if session.in_nested_transaction():
+        return
+
+    # 先把剩余改动 flush 进缓冲，再统一写 outbox
+    session.flush()
+
+    rows = session.info.pop("outbox_rows", None)
+    if not rows:
+        return
+
+    # 同一实体在一个事务内改多次 → 各占一个 version，按顺序写
+    session.connection().execute(_RECORD_STATEMENT, rows)
+    session.info["outbox_pending"] = True
+
+
+def _after_commit(session):
+    session.info.pop("outbox_marks", None)
+    if session.info.pop("outbox_pending", False):
+        change_feed.notify()
+
+
+def _after_transaction_create(session, transaction):
+    # SAVEPOINT：记住缓冲区位置，回滚时只丢弃这之后的记录
+    if transaction.nested:
+        marks = session.info.setdefault("outbox_marks", {})
+        marks[transaction] = len(session.info.get("outbox_rows", ()))
+
+
+def _after_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        mark = session.info.get("outbox_marks", {}).pop(previous_transaction, None)
+        if mark is not None and "outbox_rows" in session.info:
+            del session.info["outbox_rows"][mark:]
+        return
+
+    session.info.pop("outbox_rows", None)
+    session.info.pop("outbox_marks", None)
+    session.info.pop("outbox_pending", None)
+
+
+def record_inserts(session, model, ids, fields):
+    """Change records for rows written with Core insert() (no flush)."""
+    now = datetime.utcnow()
+    changed_fields = json.dumps(list(fields), separators=(",", ":"))
+
+    _buffer(session, [
+        {
+            "entity": model.__tablename__,
+            "entity_id": entity_id,
+            "op": "INSERT",
+            "changed_fields": changed_fields,
+            "created_at": now,
+        }
+        for entity_id in ids
+    ])
+
+
+def install_outbox():
+    if event.contains(Session, "after_flush", _after_flush):
+        return
+    event.listen(Session, "before_flush", _before_flush)
+    event.listen(Session, "after_flush", _after_flush)
+    event.listen(Session, "before_commit", _before_commit)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_transaction_create", _after_transaction_create)
+    event.listen(Session, "after_soft_rollback", _after_rollback)
+
+
+# ==========================================================
+# Feed
+# ==========================================================
+
+class ChangeFeed:
+
+    # 长轮询在事件循环上等（wait_async），不占线程池；notify 可能来自写线程 → call_soon_threadsafe
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._async_waiters = set()     # {(loop, asyncio.Event)}
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def notify(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+            waiters = list(self._async_waiters)
+
+        for loop, ready in waiters:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass        # 事件循环已关闭
+
+    def wait(self, generation, timeout):
+        with self._condition:
+            return self._condition.wait_for(lambda: self._generation != generation, timeout)
+
+    async def wait_async(self, generation, timeout):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+
+        with self._condition:
+            if self._generation != generation:
+                return True
+            self._async_waiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+
+
+change_feed = PlantLocal(ChangeFeed)
+
+
+def read_changes(db, since=0, limit=500, entity=None):
+
+    query = (
+        select(
+            ChangeRecord.id,
+            ChangeRecord.entity,
+            ChangeRecord.entity_id,
+            ChangeRecord.op,
+            ChangeRecord.changed_fields,
+            ChangeRecord.version,
+            ChangeRecord.created_at,
+        )
+        .where(ChangeRecord.id > since)
+        .order_by(ChangeRecord.id)
+        .limit(limit + 1)
+    )
+
+    if entity:
+        query = query.where(ChangeRecord.entity == entity)
+
+    rows = db.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = [
+        {
+            "cursor": row.id,
+            "entity": row.entity,
+            "entity_id": row.entity_id,
+            "op": row.op,
+            "changed_fields": json.loads(row.changed_fields),
+            "version": row.version,
+            "created_at": row.created_at,
+        }
+        for row in rows
+    ]
+
+    return {
+        "changes": changes,
+        "next_cursor": changes[-1]["cursor"] if changes else since,
+        "has_more": has_more,
+    }
@@ -0,0 +1,118 @@
+"""
+Outbox relay: change_records → append-only JSONL file.
+
+    python outbox_relay.py --out changes.jsonl [--follow] [--batch 1000]
+
+A local stand-in for a message broker. Each change record is written as
+one JSON line; the last relayed cursor is kept next to the file
+(<out>.cursor) and only advanced after the lines are fsynced, so a crash
+replays at most one batch (consumers dedupe on "cursor").
+
+With MES_OUTBOX_FILE set, the API process registers the same relay as
+the `outbox_relay` background job instead.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from outbox import read_changes
+from plants import DEFAULT_PLANT, current_plant, plants
+
+
+def _cursor_path(out_path):
+    return out_path + ".cursor"
+
+
+def load_cursor(out_path):
+    try:
+        with open(_cursor_path(out_path)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def save_cursor(out_path, cursor):
+    tmp = _cursor_path(out_path) + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(str(cursor))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _cursor_path(out_path))
+
+
+def relay_once(db, out_path, batch=1000):
+
+    cursor = load_cursor(out_path)
+    relayed = 0
+
+    while True:
+        page = read_changes(db, since=cursor, limit=batch)
+        if not page["changes"]:
+            break
+
+        with open(out_path, "a", encoding="utf-8") as f:
+            for change in page["changes"]:
+                f.write(json.dumps(change, default=str, separators=(",", ":")))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        cursor = page["next_cursor"]
+        save_cursor(out_path, cursor)
+        relayed += len(page["changes"])
+
+        if not page["has_more"]:
+            break
+
+    return {"relayed": relayed, "cursor": cursor}
+
+
+def plant_relay_path(base, plant):
+    # 每个工厂一个输出文件：默认工厂用原路径，其它工厂加 .<code> 后缀
+    return base if plant is plants.default else f"{base}.{plant.code}"
+
+
+def run_relay_job():
+    plant = current_plant()
+    db = plant.SessionLocal()
+    try:
+        return relay_once(db, plant_relay_path(os.environ["MES_OUTBOX_FILE"], plant))
+    finally:
+        db.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Relay MES change records to a JSONL file")
+    parser.add_argument("--out", default="changes.jsonl")
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--follow", action="store_true")
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--plant", default=DEFAULT_PLANT)
+    args = parser.parse_args(argv[1:])
+
+    plant = plants.get(args.plant)
+    if plant is None:
+        print(f"unknown plant: {args.plant}")
+        return 2
+
+    while True:
+        db = plant.SessionLocal()
+        try:
+            result = relay_once(db, args.out, args.batch)
+        finally:
+            db.close()
+
+        if result["relayed"]:
+            print(f"relayed {result['relayed']} changes (cursor {result['cursor']})")
+
+        if not args.follow:
+            return 0
+
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,305 @@
+import heapq
+import math
+from bisect import bisect_left
+from datetime import date, timedelta
+from itertools import accumulate
+
+from queue_engine import dispatch_key
+
+
+# ==========================================================
+# Plant Simulation（多工序工单：跨产线的离散事件仿真）
+# ==========================================================
+#
+# 工单 = 有序工序链（work_order_operations）；没有工序的工单 = 本产线一道工序（旧行为）。
+# 每条产线同一时间只做一道工序（不抢占）；工序 k 完工后，工序 k+1 才在它的产线上排队。
+#
+# 事件驱动，全局事件堆 (时间, 类型, 序号, ...)：
+#   READY     工序可开工 → 进该产线的就绪堆（dispatch_key，与派工队列同一顺序）
+#   DONE      工序完工   → 产线空闲，下一道工序 READY
+#   DISPATCH  同一时刻的 READY / DONE 都处理完后，空闲产线从就绪堆取下一道
+#
+# 时间 = 距窗口起点（明天 0 点）的天数（浮点）。产线每天的工时在当天内均匀分布，
+# 工时 ↔ 时间 用累计产能向量 + bisect 换算（LineClock，O(log 天数)），
+# 超出向量范围按平均产能外推（与 capacity_engine.finish_day_offset 同口径）。
+# N 道工序 O(N log N)：几万道工序秒级以内（bench/bench_plant_simulation.py）。
+#
+# 与 simulate_line_orders 同口径：只排 未完工 + 物料齐套 的工单，事件工时不占产能；
+# 没有工序的工厂结果与逐线仿真一致。已报工时按工序顺序冲抵（前面的工序先完成）。
+
+READY, DONE, DISPATCH = 0, 1, 2
+
+EPSILON = 1e-9
+FIRST_WORK_HOURS = 1e-6     # 开工日 = 第一点工时实际落在哪天（跳过开工时刻起的休息日）
+
+
+class LineClock:
+    """Work hours ↔ simulation time for one line's capacity vector."""
+
+    __slots__ = ("vector", "cumulative", "horizon", "rate")
+
+    def __init__(self, vector=None, daily_hours=0.0):
+        if vector:
+            self.vector = vector
+            self.cumulative = list(accumulate(vector))
+            self.horizon = len(vector)
+            self.rate = self.cumulative[-1] / self.horizon
+        else:
+            self.vector = ()
+            self.cumulative = []
+            self.horizon = 0
+            self.rate = daily_hours
+
+    def work_at(self, t):
+        """Capacity hours available from time 0 up to time t."""
+        if t >= self.horizon:
+            done = self.cumulative[-1] if self.horizon else 0.0
+            return done + (t - self.horizon) * self.rate
+
+        day = int(t)
+        before = self.cumulative[day - 1] if day else 0.0
+        return before + (t - day) * self.vector[day]
+
+    def time_at(self, work):
+        """Earliest time at which `work` capacity hours have been available."""
+        if work <= EPSILON:
+            return 0.0
+
+        if self.horizon and work <= self.cumulative[-1] + EPSILON:
+            day = bisect_left(self.cumulative, work - EPSILON)
+            before = self.cumulative[day - 1] if day else 0.0
+            return day + max(work - before, 0.0) / self.vector[day]
+
+        if self.rate <= 0:
+            return math.inf
+
+        done = self.cumulative[-1] if self.horizon else 0.0
+        return self.horizon + (work - done) / self.rate
+
+    def finish(self, start, hours):
+        if math.isinf(start):
+            return start
+        return self.time_at(self.work_at(start) + hours)
+
+
+def day_of(t, today):
+    """Calendar date for simulation time t (window starts tomorrow)."""
+    if math.isinf(t):
+        return None
+    return today + timedelta(days=max(math.ceil(t - EPSILON), 0))
+
+
+def operation_hours(wo, operations):
+    """Remaining hours per operation: (actual + remaining) split by standard hours, actual consumed in order."""
+
+    total_weight = sum(op.standard_hours for op in operations)
+    total_hours = (wo.actual_hours or 0.0) + wo.remaining_hours
+    done = wo.actual_hours or 0.0
+
+    remaining = []
+    for op in operations:
+        planned = total_hours * op.standard_hours / total_weight if total_weight > 0 else 0.0
+        consumed = min(planned, max(done, 0.0))
+        done -= consumed
+        remaining.append(planned - consumed)
+
+    return remaining
+
+
+def build_chain(wo, operations=None):
+    """[(line_id, remaining hours, sequence, name)]; no operations = one step on the work order's line."""
+    if not operations:
+        return [(wo.production_line_id, wo.remaining_hours, 1, None)]
+    return [
+        (op.production_line_id, hours, op.sequence, op.operation_name)
+        for op, hours in zip(operations, operation_hours(wo, operations))
+    ]
+
+
+def run_chains(chains, keys, clocks, releases=None):
+    """Event loop over operation chains on single-server lines.
+
+    chains[i]   = [(line_id, hours, sequence, name)] in precedence order
+    keys[i]     = dispatch priority of chain i (smaller goes first)
+    releases[i] = earliest time chain i may start (default 0)
+
+    Returns (starts, finishes, busy_hours, events processed); a start is the
+    time the first work hour actually lands (rest days skipped).
+    """
+
+    starts = [[None] * len(chain) for chain in chains]
+    finishes = [[None] * len(chain) for chain in chains]
+
+    events = []
+    counter = 0
+    ready = {}           # line_id → [(dispatch_key, sequence, order_index, op_index)]
+    busy = set()
+    dispatching = set()
+    busy_hours = {}
+    processed = 0
+
+    def push(t, kind, a, b=None):
+        nonlocal counter
+        counter += 1
+        heapq.heappush(events, (t, kind, counter, a, b))
+
+    def release(index, op_index, t):
+        """Next operation with work left becomes ready at t (finished ones are skipped)."""
+        chain = chains[index]
+        while op_index < len(chain) and chain[op_index][1] <= EPSILON:
+            starts[index][op_index] = finishes[index][op_index] = t
+            op_index += 1
+        if op_index < len(chain):
+            push(t, READY, index, op_index)
+
+    for index in range(len(chains)):
+        release(index, 0, releases[index] if releases else 0.0)
+
+    while events:
+        t, kind, _, a, b = heapq.heappop(events)
+        processed += 1
+
+        if kind == READY:
+            line_id, _, sequence, _ = chains[a][b]
+            heapq.heappush(ready.setdefault(line_id, []), (keys[a], sequence, a, b))
+            if line_id not in busy and line_id not in dispatching:
+                dispatching.add(line_id)
+                push(t, DISPATCH, line_id)
+
+        elif kind == DONE:
+            line_id = chains[a][b][0]
+            busy.discard(line_id)
+            finishes[a][b] = t
+            release(a, b + 1, t)
+            if line_id not in dispatching:
+                dispatching.add(line_id)
+                push(t, DISPATCH, line_id)
+
+        else:
+            line_id = a
+            dispatching.discard(line_id)
+            queue = ready.get(line_id)
+            if line_id in busy or not queue:
+                continue
+
+            _, _, index, op_index = heapq.heappop(queue)
+            hours = chains[index][op_index][1]
+            clock = clocks.get(line_id)
+
+            starts[index][op_index] = clock.finish(t, FIRST_WORK_HOURS) if clock else math.inf
+            busy.add(line_id)
+            busy_hours[line_id] = busy_hours.get(line_id, 0.0) + hours
+            push(clock.finish(t, hours) if clock else math.inf, DONE, index, op_index)
+
+    return starts, finishes, busy_hours, processed
+
+
+def simulate_plant(
+    production_lines,
+    work_orders,
+    operations=None,
+    capacity_vectors=None,
+    today=None,
+):
+    """Event-driven schedule of every open operation chain across all lines.
+
+    operations: {work_order_id: [op, ...]} ordered by sequence; op has
+    sequence / operation_name / production_line_id / standard_hours.
+    """
+
+    today = today or date.today()
+    operations = operations or {}
+    capacity_vectors = capacity_vectors or {}
+
+    clocks = {
+        line.id: LineClock(
+            capacity_vectors.get(line.id),
+            line.working_hours_per_day * line.efficiency_rate,
+        )
+        for line in production_lines
+    }
+    names = {line.id: line.line_name for line in production_lines}
+
+    orders = [wo for wo in work_orders if wo.status != "DONE" and wo.is_material_ready]
+
+    # 每个工单的工序链：[(line_id, hours, sequence, name)]
+    chains = []
+    keys = []
+    for wo in orders:
+        chains.append(build_chain(wo, operations.get(wo.id)))
+        keys.append(dispatch_key(wo))
+
+    starts, finishes, busy_hours, processed = run_chains(chains, keys, clocks)
+
+    # -------------------------------
+    # 结果
+    # -------------------------------
+
+    order_results = []
+    operation_results = []
+    line_finish = {}
+
+    for index, wo in enumerate(orders):
+        chain = chains[index]
+        finish = max(finishes[index])
+        estimated_finish = day_of(finish, today)
+
+        delay_days = (estimated_finish - wo.promise_date).days if estimated_finish else None
+
+        order_results.append({
+            "work_order_id": wo.id,
+            "work_order_no": wo.work_order_no,
+            "priority": wo.priority,
+            "remaining_hours": wo.remaining_hours,
+            "operations": len(chain),
+            "estimated_finish_date": estimated_finish,
+            "promise_date": wo.promise_date,
+            "delay_days": max(delay_days, 0) if delay_days is not None else None,
+            "will_delay": delay_days is None or delay_days > 0,
+        })
+
+        for op_index, (line_id, hours, sequence, name) in enumerate(chain):
+            op_finish = finishes[index][op_index]
+            completed = hours <= EPSILON
+
+            if not completed and not math.isinf(op_finish):
+                line_finish[line_id] = max(line_finish.get(line_id, 0.0), op_finish)
+
+            operation_results.append({
+                "work_order_id": wo.id,
+                "work_order_no": wo.work_order_no,
+                "sequence": sequence,
+                "operation_name": name,
+                "production_line_id": line_id,
+                "remaining_hours": round(hours, 4),
+                "completed": completed,
+                "start_date": None if completed else day_of(starts[index][op_index], today),
+                "finish_date": None if completed else day_of(op_finish, today),
+            })
+
+    lines = [
+        {
+            "production_line_id": line_id,
+            "line_name": names.get(line_id),
+            "scheduled_hours": round(hours, 2),
+            "last_finish_date": day_of(line_finish[line_id], today) if line_id in line_finish else None,
+        }
+        for line_id, hours in sorted(busy_hours.items())
+    ]
+
+    finished = [row["estimated_finish_date"] for row in order_results if row["estimated_finish_date"]]
+
+    return {
+        "as_of": today,
+        "work_orders": order_results,
+        "operations": operation_results,
+        "lines": lines,
+        "summary": {
+            "work_orders": len(order_results),
+            "operations": len(operation_results),
+            "late_work_orders": sum(1 for row in order_results if row["will_delay"]),
+            "unschedulable_work_orders": len(order_results) - len(finished),
+            "makespan_date": max(finished) if finished else None,
+            "events": processed,
+        },
+    }
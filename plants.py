@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from sqlalchemy.orm import sessionmaker
+
+from database import SessionLocal, engine, make_engine
+
+
+# ==========================================================
+# Plants（多工厂：每个工厂一个库、一个 engine、一套缓存）
+# ==========================================================
+#
+# MES_PLANTS="SZ=sqlite:///./plant_sz.db,HK=postgresql://..."
+#   未配置 → 只有一个工厂 MES_DEFAULT_PLANT（默认 "default"），用 MES_DATABASE_URL，旧行为不变
+#
+# 请求路由（PlantRoutingMiddleware）：
+#   /plants/{code}/work-orders        → 路径前缀，去掉前缀后照常路由
+#   X-Plant-Id: {code}                → 请求头
+#   都没有                            → 默认工厂
+#
+# get_db / get_read_db / 缓存（capacity_cache、dispatch_queues、recent_keys、change_feed）
+# 都按 current_plant() 取各自实例：一个工厂忙，不会占用其它工厂的连接池和锁。
+# 扩容 = 在 MES_PLANTS 里加一个工厂，再跑 python migrations.py upgrade。
+# 非 SQLite 工厂：变更流游标（自增 id）不保证提交顺序，见 outbox.py。
+
+DEFAULT_PLANT = os.getenv("MES_DEFAULT_PLANT", "default")
+PLANT_HEADER = "X-Plant-Id"
+
+FANOUT_WORKERS = int(os.getenv("MES_PLANT_FANOUT_WORKERS", "8"))
+FANOUT_TIMEOUT_SECONDS = float(os.getenv("MES_PLANT_FANOUT_TIMEOUT_SECONDS", "5"))
+
+
+def _engine_for(url):
+    return make_engine(url)
+
+
+def parse_plants(spec):
+    plants = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        code, _, url = item.partition("=")
+        if not url:
+            raise ValueError(f"MES_PLANTS entry needs CODE=URL: {item!r}")
+        plants.append((code.strip(), url.strip()))
+    return plants
+
+
+class Plant:
+
+    def __init__(self, code, bind, session_factory):
+        self.code = code
+        self.engine = bind
+        self.SessionLocal = session_factory
+
+        self._lock = threading.Lock()
+        self._scoped = {}
+        self._read_model = None
+        self._read_model_built = False
+
+    def scoped(self, key, factory):
+        with self._lock:
+            instance = self._scoped.get(key)
+            if instance is None:
+                instance = self._scoped[key] = factory()
+            return instance
+
+    @property
+    def read_model(self):
+        with self._lock:
+            if not self._read_model_built:
+                from read_model import build_read_model
+
+                self._read_model = build_read_model(self.engine, default=self is plants.default)
+                self._read_model_built = True
+            return self._read_model
+
+
+class PlantRegistry:
+
+    def __init__(self):
+        self._plants = OrderedDict()
+        self.default = None
+
+    def configure(self, default_code, extra_plants):
+        self._plants = OrderedDict()
+        self.default = Plant(default_code, engine, SessionLocal)
+        self._plants[default_code] = self.default
+
+        for code, url in extra_plants:
+            if code in self._plants:
+                raise ValueError(f"Duplicate plant code: {code}")
+            bind = _engine_for(url)
+            self._plants[code] = Plant(
+                code,
+                bind,
+                sessionmaker(autocommit=False, autoflush=False, bind=bind),
+            )
+
+    def get(self, code):
+        return self._plants.get(code)
+
+    def all(self):
+        return list(self._plants.values())
+
+    def codes(self):
+        return list(self._plants)
+
+
+plants = PlantRegistry()
+plants.configure(DEFAULT_PLANT, parse_plants(os.getenv("MES_PLANTS")))
+
+
+# -------------------------------
+# 当前工厂（每个请求 / 每个 job 一份）
+# -------------------------------
+
+_current_plant = ContextVar("mes_plant", default=None)
+
+
+def current_plant():
+    return _current_plant.get() or plants.default
+
+
+@contextmanager
+def use_plant(plant):
+    token = _current_plant.set(plant)
+    try:
+        yield plant
+    finally:
+        _current_plant.reset(token)
+
+
+def plant_job(name, plant=None):
+    """Scheduler job name for a plant; the default plant keeps the bare name."""
+    plant = plant or current_plant()
+    return name if plant is plants.default else f"{name}@{plant.code}"
+
+
+class PlantLocal:
+    """One instance per plant, created on first use; attribute access goes to the current plant's."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def instance(self, plant=None):
+        return (plant or current_plant()).scoped(self, self._factory)
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
+
+    def __len__(self):
+        return len(self.instance())
+
+
+# -------------------------------
+# 请求路由
+# -------------------------------
+
+class PlantRoutingMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        code = None
+        parts = scope["path"].split("/", 3)
+
+        if len(parts) == 4 and parts[1] == "plants" and parts[2] and parts[3]:
+            code = parts[2]
+            path = "/" + parts[3]
+            scope = dict(scope, path=path, raw_path=path.encode("utf-8"))
+        else:
+            for name, value in scope["headers"]:
+                if name == b"x-plant-id":
+                    code = value.decode("latin-1")
+                    break
+
+        plant = plants.default if code is None else plants.get(code)
+
+        if plant is None:
+            body = json.dumps({"detail": f"Unknown plant: {code}"}).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 404,
+                "headers": [(b"content-type", b"application/json")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        with use_plant(plant):
+            await self.app(scope, receive, send)
+
+
+# -------------------------------
+# 跨工厂汇总：并发扇出，慢工厂超时不拖累其它工厂
+# -------------------------------
+
+_fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="mes-plant")
+
+
+def _run_in_plant(plant, func):
+    with use_plant(plant):
+        return func(plant)
+
+
+def fan_out(func, timeout=FANOUT_TIMEOUT_SECONDS):
+    """{plant_code: func(plant)} for every plant, run concurrently."""
+
+    futures = {
+        plant.code: _fanout_pool.submit(copy_context().run, _run_in_plant, plant, func)
+        for plant in plants.all()
+    }
+
+    wait(futures.values(), timeout=timeout)
+
+    results = {}
+    for code, future in futures.items():
+        if not future.done():
+            future.cancel()
+            results[code] = {"status": "timeout"}
+        elif future.exception() is not None:
+            results[code] = {"status": "error", "detail": str(future.exception())}
+        else:
+            results[code] = {"status": "ok", **future.result()}
+
+    return results
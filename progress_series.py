@@ -0,0 +1,254 @@
+import os
+import struct
+from datetime import date, datetime
+
+from sqlalchemy import delete, insert, select, update
+
+from models import (
+    ProductionLog,
+    WorkOrder,
+    WorkOrderForecast,
+    WorkOrderForecastHistory,
+    WorkOrderProgress,
+)
+
+
+# ==========================================================
+# Progress Series（工单燃尽 / 交期漂移：每单一行，按天打包）
+# ==========================================================
+#
+# 每个点 20 字节（小端）：
+#   日期 ordinal | 累计工时 | 剩余工时 | 预测完工 ordinal（0 = 无预测）| 延误天数
+#
+# 写入时机：
+#   每次报工        → 报工日期（log_date）的点（预测沿用当前 work_order_forecasts），
+#                     与迁移回填（backfill_progress）同一个日期口径
+#   每次预测刷新    → 重算过的工单写今天的点（带新预测）
+# 同一天多次写入只保留最后一次；最多保留 MAX_POINTS 天。
+# 补录（log_date 早于最后一个点）：插到该日，之后各点的累计 / 剩余工时一并平移。
+# 读燃尽图 = 读一行 + struct 解包，不扫 production_logs。
+
+POINT = struct.Struct("<iffii")
+NO_FINISH = 0
+
+MAX_POINTS = int(os.getenv("MES_PROGRESS_MAX_POINTS", "730"))
+
+
+def make_point(day, actual_hours, remaining_hours, finish_date, delay_days):
+    return (
+        day.toordinal(),
+        actual_hours or 0.0,
+        remaining_hours or 0.0,
+        finish_date.toordinal() if finish_date else NO_FINISH,
+        int(delay_days or 0),
+    )
+
+
+def merge_point(blob, point, hours=0.0):
+    """Merge one point by day: the same day replaces, a later day appends.
+
+    An earlier day (back-dated log) is inserted in place: its totals are the
+    previous day's plus `hours`, and every later point shifts by `hours`.
+    """
+
+    blob = blob or b""
+    day = point[0]
+    last_day = POINT.unpack_from(blob, len(blob) - POINT.size)[0] if blob else None
+
+    if last_day is None or day > last_day:
+        blob += POINT.pack(*point)
+    elif day == last_day:
+        blob = blob[:-POINT.size] + POINT.pack(*point)
+    else:
+        blob = _insert_back_dated(blob, point, hours)
+
+    excess = len(blob) // POINT.size - MAX_POINTS
+    if excess > 0:
+        blob = blob[excess * POINT.size:]
+
+    return blob
+
+
+def _insert_back_dated(blob, point, hours):
+    day, actual, remaining, finish, delay = point
+
+    before = [p for p in POINT.iter_unpack(blob) if p[0] <= day]
+    after = [p for p in POINT.iter_unpack(blob) if p[0] > day]
+
+    if before:
+        # 当天已有点 / 前一天的点 + 本次工时
+        _, base_actual, base_remaining, finish, delay = before[-1]
+        point = (day, base_actual + hours, max(base_remaining - hours, 0.0), finish, delay)
+        before = [p for p in before if p[0] != day]
+    else:
+        # 比已有的点都早：只有本次工时
+        point = (day, hours, remaining + actual - hours, finish, delay)
+
+    after = [
+        (later, later_actual + hours, max(later_remaining - hours, 0.0), later_finish, later_delay)
+        for later, later_actual, later_remaining, later_finish, later_delay in after
+    ]
+
+    return b"".join(POINT.pack(*p) for p in before + [point] + after)
+
+
+def decode_series(blob):
+    return [
+        {
+            "date": date.fromordinal(day),
+            "actual_hours": round(actual, 2),
+            "remaining_hours": round(remaining, 2),
+            "projected_finish": date.fromordinal(finish) if finish != NO_FINISH else None,
+            "delay_days": delay,
+        }
+        for day, actual, remaining, finish, delay in POINT.iter_unpack(blob or b"")
+    ]
+
+
+def _write_points(db, existing, points, hours=0.0):
+    """existing: {wo_id: blob or None}; points: {wo_id: point}. Two statements at most."""
+
+    now = datetime.utcnow()
+    updates = []
+    inserts = []
+
+    for wo_id, point in points.items():
+        blob = existing.get(wo_id)
+        merged = merge_point(blob, point, hours)
+        row = dict(
+            work_order_id=wo_id,
+            points=merged,
+            last_date=date.fromordinal(POINT.unpack_from(merged, len(merged) - POINT.size)[0]),
+            updated_at=now,
+        )
+        row["point_count"] = len(row["points"]) // POINT.size
+        (updates if blob is not None else inserts).append(row)
+
+    # 派生数据：Core 批量写，不经过 flush（不进 outbox）
+    if updates:
+        db.execute(update(WorkOrderProgress), updates)
+    if inserts:
+        db.execute(insert(WorkOrderProgress), inserts)
+
+
+# -------------------------------
+# 写入：报工 / 预测刷新
+# -------------------------------
+
+def record_log_progress(db, work_order, log_date, produced_hours):
+
+    row = db.execute(
+        select(
+            WorkOrderProgress.points,
+            WorkOrderForecast.estimated_finish_date,
+            WorkOrderForecast.delay_days,
+        )
+        .select_from(WorkOrder)
+        .outerjoin(WorkOrderProgress, WorkOrderProgress.work_order_id == WorkOrder.id)
+        .outerjoin(WorkOrderForecast, WorkOrderForecast.work_order_id == WorkOrder.id)
+        .where(WorkOrder.id == work_order.id)
+    ).one()
+
+    if work_order.status == "DONE":
+        # 与回填一致：完工日取 completed_at
+        finish = work_order.completed_at.date() if work_order.completed_at else log_date
+        delay = max((finish - work_order.promise_date).days, 0)
+    else:
+        finish = row.estimated_finish_date
+        delay = row.delay_days
+
+    point = make_point(log_date, work_order.actual_hours, work_order.remaining_hours, finish, delay)
+
+    _write_points(db, {work_order.id: row.points}, {work_order.id: point}, produced_hours)
+
+
+def record_forecast_progress(db, work_orders, forecasts, today):
+    """work_orders: rows with actual/remaining hours; forecasts: {wo_id: (finish, delay_days)}."""
+
+    if not work_orders:
+        return
+
+    ids = [wo.id for wo in work_orders]
+    existing = dict(db.execute(
+        select(WorkOrderProgress.work_order_id, WorkOrderProgress.points)
+        .where(WorkOrderProgress.work_order_id.in_(ids))
+    ).all())
+
+    points = {
+        wo.id: make_point(today, wo.actual_hours, wo.remaining_hours, *forecasts[wo.id])
+        for wo in work_orders
+    }
+
+    _write_points(db, existing, points)
+
+
+# -------------------------------
+# 迁移：用已有报工 + 预测历史回填
+# -------------------------------
+
+def backfill_progress(connection):
+
+    connection.execute(delete(WorkOrderProgress))
+
+    orders = {
+        row.id: row
+        for row in connection.execute(select(
+            WorkOrder.id,
+            WorkOrder.planned_hours,
+            WorkOrder.promise_date,
+            WorkOrder.status,
+            WorkOrder.completed_at,
+        ))
+    }
+
+    produced = {}
+    for wo_id, log_date, hours in connection.execute(
+        select(ProductionLog.work_order_id, ProductionLog.log_date, ProductionLog.produced_hours)
+    ):
+        day_hours = produced.setdefault(wo_id, {})
+        day_hours[log_date] = day_hours.get(log_date, 0.0) + hours
+
+    forecasts = {}
+    for wo_id, snapshot_date, finish, delay in connection.execute(
+        select(
+            WorkOrderForecastHistory.work_order_id,
+            WorkOrderForecastHistory.snapshot_date,
+            WorkOrderForecastHistory.estimated_finish_date,
+            WorkOrderForecastHistory.delay_days,
+        )
+    ):
+        forecasts.setdefault(wo_id, {})[snapshot_date] = (finish, delay)
+
+    rows = []
+    now = datetime.utcnow()
+
+    for wo_id, wo in orders.items():
+        day_hours = produced.get(wo_id, {})
+        day_forecasts = forecasts.get(wo_id, {})
+        days = sorted(set(day_hours) | set(day_forecasts))
+        if not days:
+            continue
+
+        blob = b""
+        actual = 0.0
+        finish, delay = None, 0
+        completed = wo.completed_at.date() if wo.completed_at else None
+
+        for day in days:
+            actual += day_hours.get(day, 0.0)
+            finish, delay = day_forecasts.get(day, (finish, delay))
+            if completed is not None and day >= completed:
+                finish, delay = completed, max((completed - wo.promise_date).days, 0)
+            remaining = max(wo.planned_hours - actual, 0.0)
+            blob = merge_point(blob, make_point(day, actual, remaining, finish, delay))
+
+        rows.append(dict(
+            work_order_id=wo_id,
+            points=blob,
+            point_count=len(blob) // POINT.size,
+            last_date=days[-1],
+            updated_at=now,
+        ))
+
+    if rows:
+        connection.execute(insert(WorkOrderProgress), rows)
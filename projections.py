@@ -0,0 +1,176 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from models import ProductionEvent, ProductionLine, WorkOrder, WorkOrderOperation
+
+
+# ==========================================================
+# Read-only Projections（引擎专用轻量行）
+# ==========================================================
+#
+# 引擎只读少数字段，不需要 ORM identity map / change tracking。
+# 这里按列 SELECT，直接装进 __slots__ dataclass。
+# capacity_engine 的函数对 ORM 对象和这些行一视同仁（按属性读取）。
+
+
+@dataclass(frozen=True, slots=True)
+class WorkOrderRow:
+    id: int
+    work_order_no: str
+    production_line_id: int
+    remaining_hours: float
+    status: str
+    is_material_ready: bool
+    priority: str
+    promise_date: date
+    is_npi: bool
+    engineering_hold: bool
+    created_datetime: datetime
+    actual_hours: float = 0.0
+    material_ready_date: date | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class ProductionLineRow:
+    id: int
+    line_name: str
+    working_hours_per_day: float
+    efficiency_rate: float
+    is_active: bool
+    calendar_version: int
+
+
+@dataclass(frozen=True, slots=True)
+class ProductionEventRow:
+    id: int
+    production_line_id: int
+    event_type: str
+    impact_hours: float
+    event_date: date
+    is_resolved: bool
+
+
+@dataclass(frozen=True, slots=True)
+class OperationRow:
+    work_order_id: int
+    sequence: int
+    operation_name: str
+    production_line_id: int
+    standard_hours: float
+
+
+WORK_ORDER_ROW_COLUMNS = (
+    WorkOrder.id,
+    WorkOrder.work_order_no,
+    WorkOrder.production_line_id,
+    WorkOrder.remaining_hours,
+    WorkOrder.status,
+    WorkOrder.is_material_ready,
+    WorkOrder.priority,
+    WorkOrder.promise_date,
+    WorkOrder.is_npi,
+    WorkOrder.engineering_hold,
+    WorkOrder.created_datetime,
+    WorkOrder.actual_hours,
+    WorkOrder.material_ready_date,
+)
+
+PRODUCTION_LINE_ROW_COLUMNS = (
+    ProductionLine.id,
+    ProductionLine.line_name,
+    ProductionLine.working_hours_per_day,
+    ProductionLine.efficiency_rate,
+    ProductionLine.is_active,
+    ProductionLine.calendar_version,
+)
+
+OPERATION_ROW_COLUMNS = (
+    WorkOrderOperation.work_order_id,
+    WorkOrderOperation.sequence,
+    WorkOrderOperation.operation_name,
+    WorkOrderOperation.production_line_id,
+    WorkOrderOperation.standard_hours,
+)
+
+PRODUCTION_EVENT_ROW_COLUMNS = (
+    ProductionEvent.id,
+    ProductionEvent.production_line_id,
+    ProductionEvent.event_type,
+    ProductionEvent.impact_hours,
+    ProductionEvent.event_date,
+    ProductionEvent.is_resolved,
+)
+
+
+# ==========================================================
+# Loaders
+# ==========================================================
+
+def load_work_order_rows(db, line_id=None, open_only=True):
+
+    query = select(*WORK_ORDER_ROW_COLUMNS)
+
+    if line_id is not None:
+        query = query.where(WorkOrder.production_line_id == line_id)
+
+    if open_only:
+        query = query.where(WorkOrder.status != "DONE")
+
+    return [WorkOrderRow(*row) for row in db.execute(query)]
+
+
+def load_production_line_rows(db, active_only=False):
+
+    query = select(*PRODUCTION_LINE_ROW_COLUMNS)
+
+    if active_only:
+        query = query.where(ProductionLine.is_active == True)
+
+    return [ProductionLineRow(*row) for row in db.execute(query)]
+
+
+def load_production_line_row(db, line_id):
+
+    row = db.execute(
+        select(*PRODUCTION_LINE_ROW_COLUMNS).where(ProductionLine.id == line_id)
+    ).first()
+
+    if row is None:
+        return None
+
+    return ProductionLineRow(*row)
+
+
+def load_production_event_rows(db, line_id=None, unresolved_only=True):
+
+    query = select(*PRODUCTION_EVENT_ROW_COLUMNS)
+
+    if line_id is not None:
+        query = query.where(ProductionEvent.production_line_id == line_id)
+
+    if unresolved_only:
+        query = query.where(ProductionEvent.is_resolved == False)
+
+    return [ProductionEventRow(*row) for row in db.execute(query)]
+
+
+def load_operation_rows(db, open_only=True):
+    """{work_order_id: [OperationRow]} ordered by sequence."""
+
+    query = select(*OPERATION_ROW_COLUMNS).order_by(
+        WorkOrderOperation.work_order_id,
+        WorkOrderOperation.sequence
+    )
+
+    if open_only:
+        query = query.join(WorkOrder, WorkOrder.id == WorkOrderOperation.work_order_id).where(
+            WorkOrder.status != "DONE"
+        )
+
+    operations = {}
+    for row in db.execute(query):
+        operations.setdefault(row.work_order_id, []).append(OperationRow(*row))
+
+    return operations
@@ -0,0 +1,279 @@
+import heapq
+import threading
+
+from sqlalchemy import func, or_, select
+
+from models import ChangeRecord, WorkOrder
+from plants import PlantLocal
+
+
+# ==========================================================
+# Queue Engine（产线派工队列）
+# ==========================================================
+#
+# 全系统唯一的派工顺序：
+#   (优先级, 承诺日, 创建时间, id)  越小越先做
+#
+# simulate_line_orders / forecast_store / 派工队列都用 dispatch_key；
+# Auto Rebalance 从队尾（最不急的）挑单转出。
+
+PRIORITY_RANK = {"HIGH": 1, "NORMAL": 2, "LOW": 3}
+
+DISPATCHABLE_STATUSES = ("OPEN", "RUNNING")
+
+
+def dispatch_key(wo):
+    return (
+        PRIORITY_RANK.get(wo.priority, 2),
+        wo.promise_date,
+        wo.created_datetime,
+        wo.id,
+    )
+
+
+def is_dispatchable(wo):
+    return str(wo.status) in DISPATCHABLE_STATUSES and bool(wo.is_material_ready)
+
+
+# ==========================================================
+# Indexed Heap（O(log n) 插入 / 改键 / 删除）
+# ==========================================================
+
+class IndexedHeap:
+
+    def __init__(self):
+        self._heap = []          # [(key, item_id)]
+        self._position = {}      # item_id → index in _heap
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, item_id):
+        return item_id in self._position
+
+    def push(self, item_id, key):
+        if item_id in self._position:
+            self.update(item_id, key)
+            return
+        self._heap.append((key, item_id))
+        self._position[item_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def update(self, item_id, key):
+        index = self._position[item_id]
+        old_key = self._heap[index][0]
+        self._heap[index] = (key, item_id)
+        if key < old_key:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+
+    def remove(self, item_id):
+        index = self._position.pop(item_id, None)
+        if index is None:
+            return False
+
+        last = self._heap.pop()
+        if index < len(self._heap):
+            self._heap[index] = last
+            self._position[last[1]] = index
+            self._sift_up(index)
+            self._sift_down(self._position[last[1]])
+
+        return True
+
+    def peek(self):
+        return self._heap[0][1] if self._heap else None
+
+    def pop(self):
+        item_id = self.peek()
+        if item_id is not None:
+            self.remove(item_id)
+        return item_id
+
+    def smallest(self, n):
+        """First n item ids in order, without disturbing the heap."""
+        if n >= len(self._heap):
+            return [item_id for _, item_id in sorted(self._heap)]
+
+        # 从堆顶向下扩展的前沿：只访问 O(n) 个节点
+        result = []
+        frontier = [(self._heap[0][0], 0)] if self._heap else []
+
+        while frontier and len(result) < n:
+            _, index = heapq.heappop(frontier)
+            result.append(self._heap[index][1])
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (self._heap[child][0], child))
+
+        return result
+
+    # -------------------------------
+    # 内部：上浮 / 下沉并维护位置索引
+    # -------------------------------
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._position[heap[i][1]] = i
+        self._position[heap[j][1]] = j
+
+    def _sift_up(self, index):
+        heap = self._heap
+        while index > 0:
+            parent = (index - 1) // 2
+            if heap[index][0] < heap[parent][0]:
+                self._swap(index, parent)
+                index = parent
+            else:
+                break
+
+    def _sift_down(self, index):
+        heap = self._heap
+        size = len(heap)
+        while True:
+            smallest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and heap[child][0] < heap[smallest][0]:
+                    smallest = child
+            if smallest == index:
+                break
+            self._swap(index, smallest)
+            index = smallest
+
+
+# ==========================================================
+# Dispatch Queues（每条产线一个堆）
+# ==========================================================
+#
+# 首次使用时从库里建堆；之后沿 change_records 游标增量同步：
+# 只重读变化过的工单 → 插入 / 改键 / 删除 / 换线，其它进程的写入也能看到。
+
+QUEUE_COLUMNS = (
+    WorkOrder.id,
+    WorkOrder.work_order_no,
+    WorkOrder.production_line_id,
+    WorkOrder.priority,
+    WorkOrder.promise_date,
+    WorkOrder.created_datetime,
+    WorkOrder.remaining_hours,
+    WorkOrder.status,
+    WorkOrder.is_material_ready,
+)
+
+
+class DispatchQueues:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heaps = {}         # line_id → IndexedHeap
+        self._orders = {}        # wo_id → row
+        self._cursor = None      # 已同步到的 change_records.id
+
+    # -------------------------------
+    # 单工单变更
+    # -------------------------------
+
+    def upsert(self, wo):
+        current = self._orders.get(wo.id)
+
+        if current is not None and current.production_line_id != wo.production_line_id:
+            self._heaps[current.production_line_id].remove(wo.id)
+
+        if not is_dispatchable(wo):
+            self.remove(wo.id)
+            return
+
+        self._orders[wo.id] = wo
+        self._heaps.setdefault(wo.production_line_id, IndexedHeap()).push(wo.id, dispatch_key(wo))
+
+    def remove(self, wo_id):
+        current = self._orders.pop(wo_id, None)
+        if current is not None:
+            self._heaps[current.production_line_id].remove(wo_id)
+
+    # -------------------------------
+    # 与数据库同步
+    # -------------------------------
+
+    def _rebuild(self, db):
+        cursor = db.execute(select(func.max(ChangeRecord.id))).scalar() or 0
+
+        self._heaps = {}
+        self._orders = {}
+        for row in db.execute(
+            select(*QUEUE_COLUMNS)
+            .where(WorkOrder.status.in_(DISPATCHABLE_STATUSES))
+            .where(WorkOrder.is_material_ready == True)
+        ):
+            self.upsert(row)
+
+        self._cursor = cursor
+
+    def _catch_up(self, db):
+        # 连同最新一条（不论哪张表）一起取：游标推进到扫过的最大 id，
+        # 没有工单变化时下次也不用从旧游标重扫其它表的变更
+        latest = select(func.max(ChangeRecord.id)).scalar_subquery()
+        changes = db.execute(
+            select(ChangeRecord.id, ChangeRecord.entity, ChangeRecord.entity_id)
+            .where(ChangeRecord.id > self._cursor)
+            .where(or_(ChangeRecord.entity == WorkOrder.__tablename__, ChangeRecord.id == latest))
+            .order_by(ChangeRecord.id)
+        ).all()
+
+        if not changes:
+            return
+
+        changed_ids = {
+            change.entity_id for change in changes
+            if change.entity == WorkOrder.__tablename__
+        }
+        if changed_ids:
+            rows = {
+                row.id: row
+                for row in db.execute(select(*QUEUE_COLUMNS).where(WorkOrder.id.in_(changed_ids)))
+            }
+
+            for wo_id in changed_ids:
+                row = rows.get(wo_id)
+                if row is None:
+                    self.remove(wo_id)
+                else:
+                    self.upsert(row)
+
+        self._cursor = changes[-1].id
+
+    def sync(self, db):
+        with self._lock:
+            if self._cursor is None:
+                self._rebuild(db)
+            else:
+                self._catch_up(db)
+
+    def reset(self):
+        with self._lock:
+            self._heaps = {}
+            self._orders = {}
+            self._cursor = None
+
+    # -------------------------------
+    # 读取
+    # -------------------------------
+
+    def queue(self, line_id, limit=None):
+        with self._lock:
+            heap = self._heaps.get(line_id)
+            if heap is None:
+                return 0, []
+            ids = heap.smallest(len(heap) if limit is None else limit)
+            return len(heap), [self._orders[wo_id] for wo_id in ids]
+
+    def next(self, line_id):
+        with self._lock:
+            heap = self._heaps.get(line_id)
+            wo_id = heap.peek() if heap else None
+            return self._orders.get(wo_id) if wo_id is not None else None
+
+
+dispatch_queues = PlantLocal(DispatchQueues)
@@ -0,0 +1,218 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from fastapi import Request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import get_db
+from instrumentation import metrics
+from plants import current_plant
+
+
+# ==========================================================
+# Read Model（看板读 / 写入分离）
+# ==========================================================
+#
+# MES_READ_MODE：
+#   primary  → 全部读写走主库（默认，旧行为）
+#   snapshot → SQLite：读接口走只读快照文件（backup API 整库复制）。
+#              复制只在 job 线程做（read_snapshot_refresh，每 MES_READ_MAX_STALENESS_SECONDS / 2），
+#              分步复制（每步 MES_READ_SNAPSHOT_PAGES 页，步间 sleep），不长时间占住主库；
+#              读请求永远只读上一份快照，从不自己复制（还没有快照 → 读主库）
+#   replica  → 读接口走 MES_READ_DATABASE_URL（复制延迟由数据库自己保证；仅默认工厂）
+#
+# 每个工厂一个读模型（Plant.read_model）。写接口永远走主库（get_db）。
+# 刚写完就要看到结果的页面：请求头 X-Read-Your-Writes: true → 这一次读主库。
+
+logger = logging.getLogger("mini_mes.read_model")
+
+READ_MODE = os.getenv("MES_READ_MODE", "primary")
+READ_DATABASE_URL = os.getenv("MES_READ_DATABASE_URL")
+SNAPSHOT_PATH = os.getenv("MES_READ_SNAPSHOT_PATH")
+MAX_STALENESS_SECONDS = float(os.getenv("MES_READ_MAX_STALENESS_SECONDS", "5"))
+SNAPSHOT_PAGES = int(os.getenv("MES_READ_SNAPSHOT_PAGES", "256"))
+SNAPSHOT_STEP_SLEEP_SECONDS = float(os.getenv("MES_READ_SNAPSHOT_STEP_SLEEP_MS", "5")) / 1000
+
+READ_YOUR_WRITES_HEADER = "X-Read-Your-Writes"
+
+metrics.describe("mes_read_requests_total", "Read-model sessions by source")
+metrics.describe("mes_read_snapshot_refresh_total", "Snapshot refreshes by outcome")
+metrics.describe("mes_read_snapshot_refresh_seconds", "Snapshot copy time")
+metrics.describe("mes_read_snapshot_age_seconds", "Snapshot age when last served")
+metrics.describe("mes_read_snapshot_stale_total", "Reads served from a snapshot older than the staleness target")
+
+
+class SnapshotReadModel:
+
+    source = "snapshot"
+
+    def __init__(self, primary_path, snapshot_path, max_staleness):
+        self.primary_path = primary_path
+        self.snapshot_path = snapshot_path
+        self.max_staleness = max_staleness
+
+        self._lock = threading.Lock()
+        self._primary_stamp = None      # 主库文件 (mtime, size)：没变就不复制
+
+        # NullPool：每个 Session 新开连接，os.replace 换文件后立刻看到新快照
+        self.engine = create_engine(
+            f"sqlite:///file:{snapshot_path}?mode=ro&uri=true",
+            poolclass=NullPool,
+            connect_args={"check_same_thread": False},
+        )
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+    def age(self):
+        # 用快照文件的 mtime：独立 worker 进程刷新的快照，API 进程也认
+        try:
+            return max(time.time() - os.stat(self.snapshot_path).st_mtime, 0.0)
+        except FileNotFoundError:
+            return None
+
+    def _stamp(self):
+        stamp = []
+        for suffix in ("", "-wal"):
+            try:
+                stat = os.stat(self.primary_path + suffix)
+            except FileNotFoundError:
+                continue
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def refresh(self, force=False):
+        with self._lock:
+            stamp = self._stamp()
+
+            if not force and stamp == self._primary_stamp and os.path.exists(self.snapshot_path):
+                os.utime(self.snapshot_path)
+                metrics.inc("mes_read_snapshot_refresh_total", {"outcome": "unchanged"})
+                return False
+
+            started = time.perf_counter()
+            temp_path = self.snapshot_path + ".tmp"
+
+            source = sqlite3.connect(self.primary_path)
+            target = sqlite3.connect(temp_path)
+            try:
+                # 分步：每步之间主库的写线程可以提交（WAL：读不挡写）
+                source.backup(target, pages=SNAPSHOT_PAGES, sleep=SNAPSHOT_STEP_SLEEP_SECONDS)
+                # 快照只读：不要 WAL（只读打开时没有 -shm 可用）
+                target.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                target.close()
+                source.close()
+
+            os.replace(temp_path, self.snapshot_path)
+
+            self._primary_stamp = stamp
+
+            metrics.inc("mes_read_snapshot_refresh_total", {"outcome": "copied"})
+            metrics.observe("mes_read_snapshot_refresh_seconds", value=time.perf_counter() - started)
+            return True
+
+    def session(self):
+        age = self.age()
+        if age is None:
+            # 第一份快照还没做出来
+            return current_plant().SessionLocal()
+
+        if age > self.max_staleness:
+            metrics.inc("mes_read_snapshot_stale_total")
+        metrics.set("mes_read_snapshot_age_seconds", value=age)
+        return self.SessionLocal()
+
+    def status(self):
+        return {
+            "mode": self.source,
+            "path": self.snapshot_path,
+            "max_staleness_seconds": self.max_staleness,
+            "age_seconds": self.age(),
+        }
+
+
+class ReplicaReadModel:
+
+    source = "replica"
+
+    def __init__(self, url):
+        self.engine = create_engine(url)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+    def refresh(self, force=False):
+        return False
+
+    def session(self):
+        return self.SessionLocal()
+
+    def status(self):
+        return {"mode": self.source}
+
+
+def build_read_model(bind, mode=READ_MODE, default=True):
+
+    if mode == "replica":
+        if not READ_DATABASE_URL or not default:
+            logger.warning("MES_READ_MODE=replica: no MES_READ_DATABASE_URL for this plant; reading from primary")
+            return None
+        return ReplicaReadModel(READ_DATABASE_URL)
+
+    if mode == "snapshot":
+        if bind.url.get_backend_name() != "sqlite" or not bind.url.database:
+            logger.warning("MES_READ_MODE=snapshot needs a file-based SQLite primary; reading from primary")
+            return None
+        primary_path = os.path.abspath(bind.url.database)
+        return SnapshotReadModel(
+            primary_path,
+            (default and SNAPSHOT_PATH) or primary_path + ".read",
+            MAX_STALENESS_SECONDS,
+        )
+
+    return None
+
+
+def read_model_status():
+    read_model = current_plant().read_model
+    if read_model is None:
+        return {"mode": "primary"}
+    return read_model.status()
+
+
+def wants_primary(request):
+    value = request.headers.get(READ_YOUR_WRITES_HEADER, "")
+    return value.lower() in ("1", "true", "yes")
+
+
+def get_read_db(request: Request):
+
+    read_model = current_plant().read_model
+
+    if read_model is None or wants_primary(request):
+        metrics.inc("mes_read_requests_total", {"source": "primary"})
+        yield from get_db()
+        return
+
+    metrics.inc("mes_read_requests_total", {"source": read_model.source})
+
+    db = read_model.session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def read_session(plant=None):
+    """Read-model session outside a request (fan-out, jobs)."""
+    plant = plant or current_plant()
+    if plant.read_model is None:
+        return plant.SessionLocal()
+    return plant.read_model.session()
+
+
+def run_snapshot_refresh():
+    read_model = current_plant().read_model
+    return {"copied": read_model.refresh()} if read_model is not None else {"copied": False}
@@ -22,8 +22,8 @@ def calculate_work_order_risk(work_order):
         }
 
     # 2️⃣ 逾期
-    if work_order.production_due_date < date.today():
-        delay = (date.today() - work_order.production_due_date).days
+    if work_order.promise_date < date.today():
+        delay = (date.today() - work_order.promise_date).days
         return {
             "overall_risk_level": "CRITICAL",
             "primary_constraint_type": "OVERDUE",
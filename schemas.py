@@ -66,6 +66,69 @@ class ProductionLineCreate(BaseModel):
 class ProductionLineResponse(ProductionLineCreate):
     id: int
     is_active: bool
+    calendar_version: int
+
+    class Config:
+        from_attributes = True
+
+
+# ==========================================================
+# Line Calendar
+# ==========================================================
+
+class ShiftPatternItem(BaseModel):
+    weekday: int
+    # 0 = Monday … 6 = Sunday
+    shift_name: str
+    hours: float
+
+
+class ShiftPatternResponse(ShiftPatternItem):
+    id: int
+    production_line_id: int
+
+    class Config:
+        from_attributes = True
+
+
+# ==========================================================
+# Routing（工艺路线 / 工单工序）
+# ==========================================================
+
+class RoutingOperationItem(BaseModel):
+    sequence: int
+    operation_name: str
+    production_line_id: int
+    standard_hours: float
+
+
+class RoutingOperationResponse(RoutingOperationItem):
+    id: int
+    product_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class WorkOrderOperationResponse(RoutingOperationItem):
+    id: int
+    work_order_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class LineCalendarExceptionCreate(BaseModel):
+    exception_date: date
+    exception_type: str
+    # HOLIDAY / MAINTENANCE / EXTRA_SHIFT
+    hours: Optional[float] = None
+    description: Optional[str] = None
+
+
+class LineCalendarExceptionResponse(LineCalendarExceptionCreate):
+    id: int
+    production_line_id: int
 
     class Config:
         from_attributes = True
@@ -85,6 +148,8 @@ class WorkOrderCreate(BaseModel):
     promise_date: date
     is_material_ready: bool = False
     material_ready_date: Optional[date] = None
+    is_npi: bool = False
+    engineering_hold: bool = False
 
 
 class WorkOrderUpdate(BaseModel):
@@ -93,6 +158,11 @@ class WorkOrderUpdate(BaseModel):
     priority: Optional[str] = None
     promise_date: Optional[date] = None
     status: Optional[WorkOrderStatus] = None
+    production_line_id: Optional[int] = None
+    is_material_ready: Optional[bool] = None
+    material_ready_date: Optional[date] = None
+    is_npi: Optional[bool] = None
+    engineering_hold: Optional[bool] = None
 
 
 class WorkOrderResponse(BaseModel):
@@ -113,6 +183,9 @@ class WorkOrderResponse(BaseModel):
     is_material_ready: bool
     material_ready_date: Optional[date]
 
+    is_npi: bool
+    engineering_hold: bool
+
     created_datetime: datetime
     started_at: Optional[datetime]
     completed_at: Optional[datetime]
@@ -133,6 +206,8 @@ class ProductionLogCreate(BaseModel):
     rework_hours: float = 0
     rework_consumes_material: bool = False   # ✅ 加这一行
     log_date: date
+    idempotency_key: Optional[str] = None
+    # 也可用请求头 Idempotency-Key
 
 
 class ProductionLogResponse(ProductionLogCreate):
@@ -142,6 +217,27 @@ class ProductionLogResponse(ProductionLogCreate):
         from_attributes = True
 
 
+# ==========================================================
+# Terminal Sync（离线终端批量上传）
+# ==========================================================
+
+class TerminalLogItem(BaseModel):
+    seq: int
+    # 终端本地递增序号
+    work_order_id: int
+    produced_hours: float
+    scrap_hours: float = 0
+    rework_hours: float = 0
+    rework_consumes_material: bool = False
+    log_date: date
+
+
+class TerminalSyncRequest(BaseModel):
+    terminal_id: str
+    production_line_id: int
+    logs: list[TerminalLogItem] = []
+
+
 # ==========================================================
 # Production Event Schema
 # ==========================================================
@@ -226,6 +322,7 @@ class BOMCreate(BaseModel):
     product_id: int
     raw_material_id: int
     quantity_required: float
+    scrap_rate: float = 0
 
 
 class BOMResponse(BOMCreate):
@@ -235,7 +332,66 @@ class BOMResponse(BOMCreate):
         from_attributes = True
 
 
+class BOMSubassemblyCreate(BaseModel):
+    product_id: int
+    component_product_id: int
+    quantity_required: float
+    scrap_rate: float = 0
+
+
+class BOMSubassemblyResponse(BOMSubassemblyCreate):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+
+
+
+
+
+
+
+# ==========================================================
+# Inventory Transaction Schema
+# ==========================================================
+
+class InventoryTransactionResponse(BaseModel):
+    id: int
+    item_type: str
+    item_id: int
+    transaction_type: str
+    quantity: float
+    reference_id: Optional[int]
+    created_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+
+# ==========================================================
+# Lot Schema（批次追溯）
+# ==========================================================
 
+class MaterialLotCreate(BaseModel):
+    raw_material_id: int
+    lot_no: str
+    quantity: float
+    supplier: Optional[str] = None
+    received_at: Optional[datetime] = None
+    # 为空 = 现在；FIFO 按收货时间分配
 
 
+class LotResponse(BaseModel):
+    id: int
+    lot_type: str
+    item_id: int
+    lot_no: str
+    work_order_id: Optional[int]
+    supplier: Optional[str]
+    quantity: float
+    quantity_remaining: float
+    received_at: datetime
 
+    class Config:
+        from_attributes = True
@@ -0,0 +1,264 @@
+import re
+import threading
+
+from sqlalchemy import event, inspect, or_, select, text
+from sqlalchemy.orm import Session
+
+from models import Product, RawMaterial, SalesOrder, WorkOrder
+
+
+# ==========================================================
+# Search Index（工单 / 销售单 / 客户 / 型号 / 物料 全文 + 前缀搜索）
+# ==========================================================
+#
+# SQLite：FTS5 虚拟表 search_index（前缀索引 1–6 字符，输入即搜）
+#   rowid = entity_id * 4 + 类型编号 → 改 / 删只按 rowid 定位，不扫表
+#   编号类字段按整体（"WO-2024-001"）和拆分（"WO 2024 001"）各索引一次：
+#   输入 "WO-20" 或 "2024" 都能命中
+#
+# 不按 bm25 全量排序（"wo" 在百万行里命中几十万，排序要几百 ms）：
+#   按 rowid 倒序（新记录优先）取前 CANDIDATES 条 → 内存里按 完全相同 / 编号前缀 / 长度 排序
+#   100 万行：任意前缀 < 1ms（bench/bench_search.py）
+#
+# 同步：after_flush 钩子，同一事务内写索引（SAVEPOINT 回滚时索引一起回滚）。
+# 只对 ORM flush 生效；Core 批量 insert 这几张表的地方需要自己调 rebuild_search_index。
+#
+# 非 SQLite / 没有 FTS5 / 未迁移：回退到 LIKE（编号前缀、名称包含），功能相同，慢一些。
+
+SEARCH_TABLE = "search_index"
+
+# 类型编号不可改（参与 rowid 计算）
+ENTITIES = {
+    "work_order": (0, WorkOrder, "work_order_no", ()),
+    "sales_order": (1, SalesOrder, "order_no", ("customer_name",)),
+    "product": (2, Product, "model_no", ("model_description", "product_family")),
+    "raw_material": (3, RawMaterial, "material_code", ("material_name",)),
+}
+
+_BY_MODEL = {model: (name, code, title, details) for name, (code, model, title, details) in ENTITIES.items()}
+_BY_CODE = {code: name for name, (code, _, _, _) in ENTITIES.items()}
+
+_SPLIT = re.compile(r"[-_./]+")
+
+CREATE_STATEMENT = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "label UNINDEXED, title, detail, "
+    "tokenize = \"unicode61 remove_diacritics 2 tokenchars '-_./'\", "
+    "prefix = '1 2 3 4 5 6'"
+    ")"
+)
+
+_INSERT = text(
+    f"INSERT INTO {SEARCH_TABLE} (rowid, label, title, detail) "
+    "VALUES (:rowid, :label, :title, :detail)"
+)
+
+MAX_LIMIT = 100
+CANDIDATES = 200
+
+_available = {}
+_available_lock = threading.Lock()
+
+
+def fts_available(bind):
+    """search_index exists on this engine (checked once per engine)."""
+
+    engine = getattr(bind, "engine", bind)
+
+    with _available_lock:
+        if engine not in _available:
+            _available[engine] = engine.dialect.name == "sqlite" and _has_table(engine)
+        return _available[engine]
+
+
+def _has_table(engine):
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": SEARCH_TABLE}
+        ).first() is not None
+
+
+def _rowid(code, entity_id):
+    return entity_id * len(ENTITIES) + code
+
+
+def _document(code, entity_id, obj_or_row, title_field, detail_fields):
+    label = getattr(obj_or_row, title_field) or ""
+    split = _SPLIT.sub(" ", label)
+    details = [getattr(obj_or_row, field) or "" for field in detail_fields]
+    return {
+        "rowid": _rowid(code, entity_id),
+        "label": label,
+        "title": f"{label} {split}" if split != label else label,
+        "detail": " ".join(filter(None, details)),
+    }
+
+
+# -------------------------------
+# 同步（flush 钩子）
+# -------------------------------
+
+def _after_flush(session, flush_context):
+
+    changed = []
+    removed = []
+
+    for obj in session.new:
+        entry = _BY_MODEL.get(type(obj))
+        if entry is not None:
+            changed.append((entry, obj))
+
+    for obj in session.dirty:
+        entry = _BY_MODEL.get(type(obj))
+        if entry is None:
+            continue
+        _, _, title_field, detail_fields = entry
+        state = inspect(obj)
+        if any(state.attrs[field].history.has_changes() for field in (title_field, *detail_fields)):
+            changed.append((entry, obj))
+
+    for obj in session.deleted:
+        entry = _BY_MODEL.get(type(obj))
+        if entry is not None:
+            removed.append(_rowid(entry[1], obj.id))
+
+    if not changed and not removed:
+        return
+
+    connection = session.connection()
+    if not fts_available(connection):
+        return
+
+    removed.extend(_rowid(code, obj.id) for (_, code, _, _), obj in changed)
+
+    connection.execute(
+        text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :rowid"),
+        [{"rowid": rowid} for rowid in removed]
+    )
+
+    if changed:
+        connection.execute(_INSERT, [
+            _document(code, obj.id, obj, title_field, detail_fields)
+            for (_, code, title_field, detail_fields), obj in changed
+        ])
+
+
+def install_search_index():
+    if event.contains(Session, "after_flush", _after_flush):
+        return
+    event.listen(Session, "after_flush", _after_flush)
+
+
+def rebuild_search_index(connection):
+    """Create (SQLite) and fill search_index from the source tables."""
+
+    if connection.dialect.name != "sqlite":
+        return False
+
+    connection.execute(text(CREATE_STATEMENT))
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+
+    for code, model, title_field, detail_fields in ENTITIES.values():
+        columns = [model.id, getattr(model, title_field), *(getattr(model, f) for f in detail_fields)]
+        result = connection.execute(select(*columns)).yield_per(10000)
+
+        for chunk in result.partitions():
+            connection.execute(_INSERT, [
+                _document(code, row.id, row, title_field, detail_fields)
+                for row in chunk
+            ])
+
+    connection.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+
+    with _available_lock:
+        _available.pop(connection.engine, None)
+
+    return True
+
+
+# -------------------------------
+# 查询
+# -------------------------------
+
+def match_expression(query):
+    """Every whitespace-separated term must match as a prefix."""
+    terms = query.split()
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
+def _fts_search(db, query, types, limit):
+
+    codes = [ENTITIES[name][0] for name in types]
+
+    statement = (
+        f"SELECT rowid, label, detail FROM {SEARCH_TABLE} "
+        f"WHERE {SEARCH_TABLE} MATCH :match "
+    )
+    if len(codes) < len(ENTITIES):
+        statement += f"AND rowid % {len(ENTITIES)} IN ({', '.join(str(code) for code in codes)}) "
+    statement += "ORDER BY rowid DESC LIMIT :candidates"
+
+    rows = db.execute(
+        text(statement),
+        {"match": match_expression(query), "candidates": max(CANDIDATES, limit)}
+    ).all()
+
+    return [
+        {
+            "type": _BY_CODE[rowid % len(ENTITIES)],
+            "id": rowid // len(ENTITIES),
+            "title": label,
+            "detail": detail or None,
+        }
+        for rowid, label, detail in _rank(rows, query)[:limit]
+    ]
+
+
+def _rank(rows, query):
+    """Exact code first, then code prefix, then shorter codes; newest first within ties."""
+    needle = query.strip().lower()
+
+    def key(row):
+        label = (row.label or "").lower()
+        return (label != needle, not label.startswith(needle), len(label))
+
+    return sorted(rows, key=key)
+
+
+def _like_search(db, query, types, limit):
+
+    results = []
+    pattern = query.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    for name in types:
+        _, model, title_field, detail_fields = ENTITIES[name]
+        title_column = getattr(model, title_field)
+        detail_columns = [getattr(model, field) for field in detail_fields]
+
+        criteria = [title_column.ilike(f"{pattern}%", escape="\\")]
+        criteria += [column.ilike(f"%{pattern}%", escape="\\") for column in detail_columns]
+
+        rows = db.execute(
+            select(model.id, title_column, *detail_columns)
+            .where(or_(*criteria))
+            .order_by(title_column)
+            .limit(limit)
+        ).all()
+
+        for row in rows:
+            details = " ".join(filter(None, row[2:]))
+            results.append({"type": name, "id": row[0], "title": row[1], "detail": details or None})
+
+    return results[:limit]
+
+
+def search(db, query, types=None, limit=20):
+
+    types = list(types or ENTITIES)
+    limit = min(max(limit, 1), MAX_LIMIT)
+
+    if fts_available(db.get_bind()):
+        return {"backend": "fts5", "results": _fts_search(db, query, types, limit)}
+
+    return {"backend": "like", "results": _like_search(db, query, types, limit)}
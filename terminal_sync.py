@@ -0,0 +1,126 @@
+import os
+import zlib
+from datetime import datetime
+
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from fast_json import schema_columns
+from models import TerminalSyncState, WorkOrder
+from schemas import TerminalSyncRequest, WorkOrderResponse
+
+
+# ==========================================================
+# Terminal Sync（离线终端：一次上传积压日志，一次拿回产线状态）
+# ==========================================================
+#
+# 终端本地给每条日志编递增 seq，重连后把未确认的日志整批上传
+# （可 gzip：Content-Encoding: gzip）。服务端：
+#   1. 锁住该终端的水位行（terminal_sync_state.last_seq）
+#   2. 按 seq 顺序逐条执行；seq <= 水位 → duplicate，直接跳过
+#   3. 每条日志一个 SAVEPOINT：业务校验失败只拒绝这一条
+#   4. 整批一次提交，返回新水位 + 该产线工单最新状态
+#
+# 每条日志的幂等 key = terminal:<terminal_id>:<seq>，
+# 水位丢失或与单条 POST /production-log 混用时也不会重复扣料。
+
+MAX_BATCH_LOGS = int(os.getenv("MES_TERMINAL_SYNC_MAX_LOGS", "1000"))
+MAX_BODY_BYTES = int(os.getenv("MES_TERMINAL_SYNC_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+def _gunzip(body):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    try:
+        data = decompressor.decompress(body, MAX_BODY_BYTES)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+
+    if decompressor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail="Sync batch too large")
+
+    return data
+
+
+async def read_sync_request(request: Request) -> TerminalSyncRequest:
+
+    body = await request.body()
+
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        body = _gunzip(body)
+    elif len(body) > MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail="Sync batch too large")
+
+    try:
+        batch = TerminalSyncRequest.model_validate_json(body)
+    except ValidationError as exc:
+        raise RequestValidationError(exc.errors())
+
+    if len(batch.logs) > MAX_BATCH_LOGS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BATCH_LOGS} logs per sync batch"
+        )
+
+    return batch
+
+
+def terminal_log_key(terminal_id, seq):
+    return f"terminal:{terminal_id}:{seq}"
+
+
+def lock_sync_state(db, terminal_id, production_line_id):
+
+    now = datetime.utcnow()
+
+    # 先写后读：拿到写锁后再读水位，同一终端的并发同步串行化
+    locked = db.execute(
+        update(TerminalSyncState)
+        .where(TerminalSyncState.terminal_id == terminal_id)
+        .values(last_sync_at=now)
+    ).rowcount
+
+    if not locked:
+        state = TerminalSyncState(
+            terminal_id=terminal_id,
+            production_line_id=production_line_id,
+            last_seq=0,
+            last_sync_at=now,
+        )
+        try:
+            with db.begin_nested():
+                db.add(state)
+        except IntegrityError:
+            # 同一终端的首次同步并发：另一请求刚建好水位行
+            return lock_sync_state(db, terminal_id, production_line_id)
+
+        return state
+
+    state = db.execute(
+        select(TerminalSyncState)
+        .where(TerminalSyncState.terminal_id == terminal_id)
+        .execution_options(populate_existing=True)
+    ).scalar_one()
+
+    if state.production_line_id != production_line_id:
+        state.production_line_id = production_line_id
+
+    return state
+
+
+def line_work_order_state(production_line_id, touched_ids=()):
+    """Open work orders on the line, plus any the batch touched (may be DONE now)."""
+
+    condition = WorkOrder.status != "DONE"
+    if touched_ids:
+        condition = or_(condition, WorkOrder.id.in_(touched_ids))
+
+    return (
+        select(*schema_columns(WorkOrder, WorkOrderResponse))
+        .where(WorkOrder.production_line_id == production_line_id)
+        .where(condition)
+        .order_by(WorkOrder.id)
+    )
@@ -0,0 +1,99 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试库：导入任何业务模块之前指定（database.engine 在导入时创建）
+_tmp = tempfile.mkdtemp(prefix="mes-tests-")
+os.environ["MES_DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'mes.db')}"
+os.environ.setdefault("MES_WRITE_PIPELINE", "1")
+os.environ.setdefault("MES_SCHEDULER", "off")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import upgrade  # noqa: E402
+from outbox import install_outbox  # noqa: E402
+
+upgrade()
+install_outbox()
+
+
+@pytest.fixture
+def db():
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def commit_batch():
+    """Run funcs as one write-pipeline batch on the test thread."""
+    from plants import plants
+    from write_pipeline import WritePipeline, _WriteItem
+
+    pipeline = WritePipeline()
+    pipeline._plant = plants.default
+
+    def run(*funcs):
+        batch = [_WriteItem(func, "test") for func in funcs]
+        for item in batch:
+            item.future.set_running_or_notify_cancel()
+        pipeline._commit_batch(batch)
+        return batch
+
+    return run
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("write_pipeline.time.sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def work_order(db):
+    """An OPEN work order with a one-material BOM and plenty of stock."""
+    import uuid
+    from datetime import date
+
+    import models
+
+    tag = uuid.uuid4().hex[:8]
+
+    line = models.ProductionLine(line_name=f"L-{tag}", working_hours_per_day=8, efficiency_rate=1)
+    product = models.Product(model_no=f"M-{tag}")
+    material = models.RawMaterial(material_code=f"RM-{tag}", material_name="test", unit="pc")
+    order = models.SalesOrder(order_no=f"SO-{tag}", customer_name="ACME", order_date=date.today())
+    db.add_all([line, product, material, order])
+    db.flush()
+
+    db.add(models.RawMaterialInventory(raw_material_id=material.id, quantity_on_hand=1000))
+    db.add(models.BOMFlatRequirement(product_id=product.id, raw_material_id=material.id, quantity=1))
+
+    work_order = models.WorkOrder(
+        work_order_no=f"WO-{tag}",
+        sales_order_id=order.id,
+        product_id=product.id,
+        production_line_id=line.id,
+        planned_hours=100,
+        remaining_hours=100,
+        promise_date=date.today(),
+        is_material_ready=True,
+    )
+    db.add(work_order)
+    db.commit()
+    return work_order
+
+
+@pytest.fixture
+def client():
+    # 不进 lifespan：测试里不起后台 job
+    from fastapi.testclient import TestClient
+
+    import main
+
+    return TestClient(main.app)
@@ -0,0 +1,75 @@
+import uuid
+from datetime import date
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+import main
+from idempotency import REPLAY_HEADER, recent_keys
+from models import ProductionLog
+from schemas import ProductionLogCreate
+
+
+def _log(work_order, hours=1):
+    return {
+        "production_line_id": work_order.production_line_id,
+        "work_order_id": work_order.id,
+        "produced_hours": hours,
+        "log_date": date.today().isoformat(),
+    }
+
+
+def _logs(db, work_order):
+    db.rollback()
+    return db.scalar(
+        select(func.count()).select_from(ProductionLog).where(ProductionLog.work_order_id == work_order.id)
+    )
+
+
+def test_retry_replays_first_response(db, work_order, client):
+    key = uuid.uuid4().hex
+
+    first = client.post("/production-log", json=_log(work_order), headers={"Idempotency-Key": key})
+    second = client.post("/production-log", json=_log(work_order), headers={"Idempotency-Key": key})
+
+    assert first.status_code == second.status_code == 200
+    assert REPLAY_HEADER not in first.headers
+    assert second.headers[REPLAY_HEADER] == "true"
+    assert second.json() == first.json()
+    assert _logs(db, work_order) == 1
+
+
+def test_replay_from_database_after_restart(db, work_order, client):
+    key = uuid.uuid4().hex
+
+    first = client.post("/production-log", json=_log(work_order), headers={"Idempotency-Key": key})
+    # 进程重启：最近 key 缓存没了，靠唯一索引 + 库里的首次结果
+    recent_keys._entries.clear()
+    second = client.post("/production-log", json=_log(work_order), headers={"Idempotency-Key": key})
+
+    assert second.headers[REPLAY_HEADER] == "true"
+    assert second.json()["remaining_hours"] == first.json()["remaining_hours"]
+    assert _logs(db, work_order) == 1
+
+
+def test_key_reused_for_different_request(db, work_order, client):
+    key = uuid.uuid4().hex
+
+    client.post("/production-log", json=_log(work_order), headers={"Idempotency-Key": key})
+    response = client.post("/production-log", json=_log(work_order, hours=2), headers={"Idempotency-Key": key})
+
+    assert response.status_code == 409
+    assert _logs(db, work_order) == 1
+
+
+def test_same_key_twice_in_one_batch(db, work_order, commit_batch):
+    # 两次重试进了同一批：第二条撞唯一索引，只回滚它自己的 SAVEPOINT
+    key = uuid.uuid4().hex
+    log = ProductionLogCreate(**_log(work_order))
+    write = lambda session: main._apply_production_log(session, log, key, "digest")
+
+    first, second = commit_batch(write, write)
+
+    assert first.future.result(0)
+    assert isinstance(second.future.exception(0), IntegrityError)
+    assert _logs(db, work_order) == 1
@@ -0,0 +1,61 @@
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from models import ChangeRecord, RawMaterial
+
+
+def _add_material(code):
+    def write(db):
+        material = RawMaterial(material_code=code, material_name="outbox", unit="pc")
+        db.add(material)
+        db.flush()
+        return material.id
+    return write
+
+
+def _materials(db, *codes):
+    return db.scalars(select(RawMaterial.id).where(RawMaterial.material_code.in_(codes))).all()
+
+
+def _changes(db, ids):
+    return db.scalar(
+        select(func.count()).select_from(ChangeRecord)
+        .where(ChangeRecord.entity == "raw_materials", ChangeRecord.entity_id.in_(ids))
+    )
+
+
+def test_outbox_commits_with_the_batch(db, commit_batch):
+    batch = commit_batch(_add_material("ob-1"), _add_material("ob-2"))
+    ids = [item.future.result(0) for item in batch]
+
+    assert sorted(_materials(db, "ob-1", "ob-2")) == sorted(ids)
+    assert _changes(db, ids) == 2
+
+
+def test_outbox_rolls_back_with_the_batch(db, commit_batch, no_backoff):
+    seen = []
+
+    def add_then_lock(session):
+        seen.append(_add_material("ob-locked")(session))
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    commit_batch(_add_material("ob-3"), add_then_lock)
+
+    assert _materials(db, "ob-3", "ob-locked") == []
+    # 回滚掉的 id 上也不能留下变更记录
+    assert _changes(db, seen) == 0
+
+
+def test_outbox_drops_rejected_write_only(db, commit_batch):
+    rejected = []
+
+    def invalid(session):
+        rejected.append(_add_material("ob-bad")(session))
+        raise HTTPException(status_code=400, detail="bad")
+
+    ok, _ = commit_batch(_add_material("ob-4"), invalid)
+
+    assert _changes(db, [ok.future.result(0)]) == 1
+    assert _materials(db, "ob-bad") == []
+    assert _changes(db, rejected) == 0
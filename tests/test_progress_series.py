@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+from sqlalchemy import select
+
+import main
+from database import engine
+from models import WorkOrderProgress
+from progress_series import backfill_progress, decode_series, make_point, merge_point
+from schemas import ProductionLogCreate
+
+
+def _days(blob):
+    return [(point["date"].day, point["actual_hours"], point["remaining_hours"]) for point in decode_series(blob)]
+
+
+def test_same_day_replaces_and_later_day_appends():
+    day = date(2026, 3, 10)
+    blob = merge_point(None, make_point(day, 1, 9, None, 0))
+    blob = merge_point(blob, make_point(day, 3, 7, None, 0))
+    blob = merge_point(blob, make_point(day + timedelta(days=2), 4, 6, None, 0))
+
+    assert _days(blob) == [(10, 3, 7), (12, 4, 6)]
+
+
+def test_back_dated_point_shifts_later_points():
+    day = date(2026, 3, 10)
+    blob = merge_point(None, make_point(day, 1, 9, None, 0))
+    blob = merge_point(blob, make_point(day + timedelta(days=2), 3, 7, None, 0))
+
+    # 补录 11 日 2 小时：当前累计 5 / 剩余 5
+    blob = merge_point(blob, make_point(day + timedelta(days=1), 5, 5, None, 0), hours=2)
+    assert _days(blob) == [(10, 1, 9), (11, 3, 7), (12, 5, 5)]
+
+    # 再补 10 日 1 小时：同日合并，之后各点平移
+    blob = merge_point(blob, make_point(day, 6, 4, None, 0), hours=1)
+    assert _days(blob) == [(10, 2, 8), (11, 4, 6), (12, 6, 4)]
+
+    # 比所有点都早
+    blob = merge_point(blob, make_point(day - timedelta(days=1), 7, 3, None, 0), hours=1)
+    assert _days(blob) == [(9, 1, 9), (10, 3, 7), (11, 5, 5), (12, 7, 3)]
+
+
+def test_live_points_match_backfill(db, work_order, commit_batch):
+    today = date.today()
+    logs = [(today - timedelta(days=2), 1), (today, 2), (today - timedelta(days=1), 3), (today, 1)]
+
+    for log_date, hours in logs:
+        log = ProductionLogCreate(
+            production_line_id=work_order.production_line_id,
+            work_order_id=work_order.id,
+            produced_hours=hours,
+            log_date=log_date,
+        )
+        (item,) = commit_batch(lambda session, log=log: main._apply_production_log(session, log))
+        item.future.result(0)
+
+    db.rollback()
+    live = db.scalar(select(WorkOrderProgress.points).where(WorkOrderProgress.work_order_id == work_order.id))
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        backfill_progress(connection)
+        rebuilt = connection.scalar(
+            select(WorkOrderProgress.points).where(WorkOrderProgress.work_order_id == work_order.id)
+        )
+        transaction.rollback()
+
+    assert decode_series(live) == decode_series(rebuilt)
+    assert [point["actual_hours"] for point in decode_series(live)] == [1, 4, 7]
@@ -0,0 +1,40 @@
+from sqlalchemy import func, select
+
+from models import ChangeRecord, RawMaterial, WorkOrder
+from queue_engine import DispatchQueues
+
+
+def _sync(queues, db):
+    db.rollback()   # 新的读事务：看到写线程刚提交的变更
+    queues.sync(db)
+
+
+def _latest_change(db):
+    return db.scalar(select(func.max(ChangeRecord.id)))
+
+
+def test_cursor_skips_past_other_entities(db, work_order, commit_batch):
+    queues = DispatchQueues()
+    _sync(queues, db)
+
+    def add_material(session):
+        session.add(RawMaterial(material_code=f"Q-{work_order.id}", material_name="q", unit="pc"))
+    commit_batch(add_material)
+
+    _sync(queues, db)
+    assert queues._cursor == _latest_change(db)
+
+
+def test_catch_up_applies_work_order_changes(db, work_order, commit_batch):
+    queues = DispatchQueues()
+    _sync(queues, db)
+    line_id = work_order.production_line_id
+    assert queues.queue(line_id)[0] == 1
+
+    def hold(session):
+        session.get(WorkOrder, work_order.id).is_material_ready = False
+    commit_batch(hold)
+
+    _sync(queues, db)
+    assert queues.queue(line_id)[0] == 0
+    assert queues._cursor == _latest_change(db)
@@ -0,0 +1,102 @@
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+import main
+from models import ProductionLog, TerminalSyncState
+from schemas import TerminalSyncRequest
+
+
+def _batch(work_order, terminal_id, seqs):
+    return TerminalSyncRequest(
+        terminal_id=terminal_id,
+        production_line_id=work_order.production_line_id,
+        logs=[
+            {"seq": seq, "work_order_id": work_order.id, "produced_hours": 1, "log_date": date.today()}
+            for seq in seqs
+        ],
+    )
+
+
+def _fail_at(monkeypatch, n, times):
+    # 第 n 次报工抛“库被锁”，共 times 次（整批重试时计数继续）
+    apply = main._apply_production_log
+    calls = []
+
+    def flaky(db, *args, **kwargs):
+        calls.append(1)
+        if len(calls) % n == 0 and len(calls) // n <= times:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return apply(db, *args, **kwargs)
+
+    monkeypatch.setattr(main, "_apply_production_log", flaky)
+
+
+def _state(db, work_order, terminal_id):
+    db.rollback()   # 结束测试会话的读事务（WAL 快照），看到写线程刚提交的数据
+    logs = db.scalar(
+        select(func.count()).select_from(ProductionLog).where(ProductionLog.work_order_id == work_order.id)
+    )
+    watermark = db.scalar(select(TerminalSyncState.last_seq).where(TerminalSyncState.terminal_id == terminal_id))
+    return logs, watermark, work_order.remaining_hours
+
+
+def _sync(commit_batch, *batches):
+    items = commit_batch(*[
+        lambda session, batch=batch: main._apply_terminal_batch(session, batch)
+        for batch in batches
+    ])
+    return items[-1].future
+
+
+def test_batch_and_watermark_commit_together(db, work_order, commit_batch):
+    future = _sync(commit_batch, _batch(work_order, "T-ok", [1, 2, 3]))
+
+    watermark, results, _ = future.result(0)
+    assert watermark == 3
+    assert [result["status"] for result in results] == ["applied"] * 3
+    assert _state(db, work_order, "T-ok") == (3, 3, 97)
+
+    # 重传：水位以下全部 duplicate，不再扣
+    watermark, results, _ = _sync(commit_batch, _batch(work_order, "T-ok", [2, 3, 4])).result(0)
+    assert watermark == 4
+    assert [result["status"] for result in results] == ["duplicate", "duplicate", "applied"]
+    assert _state(db, work_order, "T-ok") == (4, 4, 96)
+
+
+def test_failure_at_nth_log_rolls_back_whole_batch(db, work_order, commit_batch, monkeypatch, no_backoff):
+    # 同一批里先有另一台终端的同步；本终端第 2 条日志一直失败
+    _fail_at(monkeypatch, 3, times=99)
+
+    future = _sync(
+        commit_batch,
+        _batch(work_order, "T-first", [1]),
+        _batch(work_order, "T-fail", [1, 2, 3, 4]),
+    )
+
+    with pytest.raises(HTTPException) as exc:
+        future.result(0)
+    assert exc.value.status_code == 503
+    # 已 RELEASE 的 SAVEPOINT 也要回滚：两台终端的日志、水位都不留
+    assert _state(db, work_order, "T-fail") == (0, None, 100)
+    assert _state(db, work_order, "T-first")[1] is None
+
+
+def test_retry_after_nth_log_failure_applies_once(db, work_order, commit_batch, monkeypatch, no_backoff):
+    _fail_at(monkeypatch, 3, times=1)
+
+    future = _sync(
+        commit_batch,
+        _batch(work_order, "T-before", [1]),
+        _batch(work_order, "T-retry", [1, 2, 3, 4]),
+    )
+
+    watermark, results, _ = future.result(0)
+    assert watermark == 4
+    assert [result["status"] for result in results] == ["applied"] * 4
+    # 整批重试：每条日志只落一次
+    assert _state(db, work_order, "T-retry") == (5, 4, 95)
+    assert _state(db, work_order, "T-before")[1] == 1
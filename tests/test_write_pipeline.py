@@ -0,0 +1,79 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from models import ProductionLine
+
+
+def _add_line(name):
+    def write(db):
+        line = ProductionLine(line_name=name, working_hours_per_day=8, efficiency_rate=1)
+        db.add(line)
+        db.flush()
+        return line.id
+    return write
+
+
+def _locked(db):
+    raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+
+def _count(db, name):
+    return db.scalar(select(func.count()).select_from(ProductionLine).where(ProductionLine.line_name == name))
+
+
+def test_savepoint_release_does_not_commit(db):
+    from database import SessionLocal
+
+    session = SessionLocal()
+    with session.begin_nested():
+        session.add(ProductionLine(line_name="released", working_hours_per_day=8, efficiency_rate=1))
+    session.rollback()
+    session.close()
+
+    assert _count(db, "released") == 0
+
+
+def test_batch_is_one_transaction(db, commit_batch, no_backoff):
+    # 第二条一直被锁：整批放弃，第一条已 RELEASE 的写入也不能留下
+    batch = commit_batch(_add_line("batch-a"), _locked)
+
+    for item in batch:
+        with pytest.raises(HTTPException) as exc:
+            item.future.result(0)
+        assert exc.value.status_code == 503
+
+    assert _count(db, "batch-a") == 0
+
+
+def test_batch_retry_does_not_duplicate(db, commit_batch, no_backoff):
+    attempts = []
+
+    def locked_once(session):
+        attempts.append(1)
+        if len(attempts) == 1:
+            _locked(session)
+        return _add_line("retry-b")(session)
+
+    batch = commit_batch(_add_line("retry-a"), locked_once)
+
+    assert all(item.future.result(0) for item in batch)
+    assert len(attempts) == 2
+    assert _count(db, "retry-a") == 1
+    assert _count(db, "retry-b") == 1
+
+
+def test_failed_write_rolls_back_alone(db, commit_batch):
+
+    def invalid(session):
+        _add_line("invalid")(session)
+        raise HTTPException(status_code=400, detail="bad")
+
+    ok, bad = commit_batch(_add_line("kept"), invalid)
+
+    assert ok.future.result(0)
+    with pytest.raises(HTTPException):
+        bad.future.result(0)
+    assert _count(db, "kept") == 1
+    assert _count(db, "invalid") == 0
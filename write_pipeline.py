@@ -0,0 +1,294 @@
+import contextvars
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from instrumentation import QUERY_COUNT_BUCKETS, metrics, phase
+from plants import PlantLocal, current_plant, use_plant
+
+
+# ==========================================================
+# Write Pipeline（写入准入控制 + 单写者批量提交）
+# ==========================================================
+#
+# 换班高峰几百台终端同时写：SQLite 只有一个写锁，
+# 多线程各自 commit → 抢锁超时 → 500。
+#
+# 改为每个工厂一个有界队列 + 一个写线程：
+#   1. 请求线程 submit(func)：队列满 → 429 + Retry-After（不排队、不占连接）
+#   2. 写线程取出第一条后再等 BATCH_WINDOW（默认 2ms），
+#      连同期间到达的写入（最多 MAX_BATCH）放进同一事务执行，
+#      每条一个 SAVEPOINT：业务校验失败只回滚这一条
+#   3. 整批一次 COMMIT，之后才通知各请求（成功即已落盘）
+#   4. 库被其它进程锁住 → 整批重试；重试用尽 / 等待超时 → 503 + Retry-After
+#
+# func(session) 只做 flush，不 commit；返回值原样交给请求线程
+# （Session 关闭时不过期对象，返回 ORM 对象也能序列化）。
+# 所有写接口和后台任务（预测刷新、排程修复）的写入都走这里（单写者：进程内不再互相抢 SQLite 写锁）；
+# 后台任务先在自己的线程里只读计算，写线程里只做落库。
+# func 里不要 commit / rollback：失败直接抛异常，SAVEPOINT 负责回滚。
+# MES_WRITE_PIPELINE=0 → 请求线程内直接执行并提交（同样的 func，不排队）。
+
+logger = logging.getLogger("mini_mes.write_pipeline")
+
+PIPELINE_ENABLED = os.getenv("MES_WRITE_PIPELINE", "1") == "1"
+QUEUE_SIZE = int(os.getenv("MES_WRITE_QUEUE_SIZE", "1000"))
+MAX_BATCH = int(os.getenv("MES_WRITE_MAX_BATCH", "200"))
+WAIT_TIMEOUT_SECONDS = float(os.getenv("MES_WRITE_TIMEOUT_SECONDS", "10"))
+COMMIT_RETRIES = int(os.getenv("MES_WRITE_COMMIT_RETRIES", "3"))
+
+# 攒批窗口：拿到第一条后最多再等这么久，让同时到达的写入进同一次提交
+# 0 = 只取已在队列里的（不额外等待）
+BATCH_WINDOW_SECONDS = float(os.getenv("MES_WRITE_BATCH_WINDOW_MS", "2")) / 1000
+
+MAX_RETRY_AFTER_SECONDS = 30
+
+# 写事务一开始就拿 SQLite 写锁（见 database.install_sqlite_transactions；其它库忽略）
+WRITE_TRANSACTION = {"sqlite_begin": "IMMEDIATE"}
+
+metrics.describe("mes_write_queue_depth", "Writes waiting for the writer thread")
+metrics.describe("mes_write_batch_size", "Writes per group commit")
+metrics.describe("mes_write_commit_seconds", "Group commit time (all writes in the batch)")
+metrics.describe("mes_write_wait_seconds", "Time from submit to committed result")
+metrics.describe("mes_write_rejected_total", "Writes refused by admission control")
+metrics.describe("mes_write_commit_retries_total", "Batches retried because the database was locked")
+
+
+class _WriteItem:
+
+    __slots__ = ("func", "label", "future", "submitted_at", "context")
+
+    def __init__(self, func, label):
+        self.func = func
+        self.label = label
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+        # 提交方的 contextvars（请求统计）：写线程里执行的 SQL 记到这个请求上（Server-Timing / 查询预算）
+        self.context = contextvars.copy_context()
+
+
+class WritePipeline:
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._plant = None
+        self._throughput = None      # 写入 / 秒（EWMA），估算 Retry-After
+
+    # -------------------------------
+    # 请求线程
+    # -------------------------------
+
+    def submit(self, func, label="write", timeout=WAIT_TIMEOUT_SECONDS):
+
+        if not PIPELINE_ENABLED:
+            return self._run_inline(func)
+
+        self._ensure_writer()
+
+        item = _WriteItem(func, label)
+        labels = {"plant": self._plant.code, "write": label}
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            metrics.inc("mes_write_rejected_total", {**labels, "reason": "queue_full"})
+            raise HTTPException(
+                status_code=429,
+                detail="Write queue full, retry later",
+                headers={"Retry-After": self.retry_after()},
+            )
+
+        metrics.set("mes_write_queue_depth", {"plant": self._plant.code}, self._queue.qsize())
+
+        with phase("write_queue"):
+            return self._wait(item, labels, timeout)
+
+    def _wait(self, item, labels, timeout):
+
+        try:
+            return item.future.result(timeout)
+        except FutureTimeout:
+            pass
+
+        if item.future.cancel():
+            # 还没轮到：撤回，保证 503 = 没写入
+            metrics.inc("mes_write_rejected_total", {**labels, "reason": "timeout"})
+            raise HTTPException(
+                status_code=503,
+                detail="Write not started in time, retry later",
+                headers={"Retry-After": self.retry_after()},
+            )
+
+        # 已在当前批次里：等这一批提交完
+        try:
+            return item.future.result(timeout)
+        except FutureTimeout:
+            metrics.inc("mes_write_rejected_total", {**labels, "reason": "timeout"})
+            raise HTTPException(
+                status_code=503,
+                detail="Write outcome unknown, retry with the same Idempotency-Key",
+                headers={"Retry-After": self.retry_after()},
+            )
+
+    def retry_after(self):
+        depth = self._queue.qsize()
+        rate = self._throughput or 1.0
+        return str(min(max(math.ceil(depth / rate), 1), MAX_RETRY_AFTER_SECONDS))
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run_inline(self, func):
+        db = current_plant().SessionLocal(expire_on_commit=False)
+        try:
+            db.connection(execution_options=WRITE_TRANSACTION)
+            result = func(db)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # -------------------------------
+    # 写线程
+    # -------------------------------
+
+    def _ensure_writer(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._plant = current_plant()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name=f"mes-writer-{self._plant.code}",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self):
+        # 不需要 stop：关停时 uvicorn 先等请求结束，请求都在等自己的写入
+        with use_plant(self._plant):
+            while True:
+                batch = self._collect()
+
+                metrics.set("mes_write_queue_depth", {"plant": self._plant.code}, self._queue.qsize())
+
+                batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+                if batch:
+                    self._commit_batch(batch)
+
+    def _collect(self):
+
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + BATCH_WINDOW_SECONDS
+
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _commit_batch(self, batch):
+
+        started = time.perf_counter()
+
+        for attempt in range(COMMIT_RETRIES):
+            try:
+                results = self._execute(batch)
+                break
+
+            except OperationalError:
+                # 其它进程持有写锁：退避后整批重来
+                metrics.inc("mes_write_commit_retries_total", {"plant": self._plant.code})
+                time.sleep(0.05 * (2 ** attempt))
+
+            except Exception:
+                # 提交本身失败（非锁）：逐条单独提交，坏的一条不连累整批
+                logger.exception("group commit failed, retrying %d writes one by one", len(batch))
+                if len(batch) == 1:
+                    self._fail(batch, HTTPException(status_code=500, detail="Write failed"))
+                    return
+                for item in batch:
+                    self._commit_batch([item])
+                return
+        else:
+            self._fail(batch, HTTPException(
+                status_code=503,
+                detail="Database busy, retry later",
+                headers={"Retry-After": self.retry_after()},
+            ))
+            return
+
+        elapsed = time.perf_counter() - started
+        labels = {"plant": self._plant.code}
+        metrics.observe("mes_write_batch_size", labels, len(batch), buckets=QUERY_COUNT_BUCKETS)
+        metrics.observe("mes_write_commit_seconds", labels, elapsed)
+
+        rate = len(batch) / max(elapsed, 1e-6)
+        self._throughput = rate if self._throughput is None else 0.8 * self._throughput + 0.2 * rate
+
+        now = time.perf_counter()
+        for item, (ok, value) in zip(batch, results):
+            metrics.observe("mes_write_wait_seconds", {**labels, "write": item.label}, now - item.submitted_at)
+            if ok:
+                item.future.set_result(value)
+            else:
+                item.future.set_exception(value)
+
+    def _execute(self, batch):
+
+        db = self._plant.SessionLocal(expire_on_commit=False)
+        try:
+            db.connection(execution_options=WRITE_TRANSACTION)
+            results = []
+            for item in batch:
+                try:
+                    with db.begin_nested():
+                        # 先发出 SAVEPOINT（否则它在 func 的第一条 SQL 前才发，会记到请求上）
+                        db.connection()
+                        results.append((True, item.context.run(item.func, db)))
+                except OperationalError:
+                    raise
+                except (HTTPException, IntegrityError) as exc:
+                    results.append((False, exc))
+                except Exception:
+                    logger.exception("write %s failed", item.label)
+                    results.append((False, HTTPException(status_code=500, detail="Write failed")))
+
+            db.commit()
+            return results
+
+        except Exception:
+            db.rollback()
+            raise
+
+        finally:
+            db.close()
+
+    @staticmethod
+    def _fail(batch, exc):
+        for item in batch:
+            item.future.set_exception(exc)
+
+
+write_pipeline = PlantLocal(WritePipeline)